@@ -0,0 +1,68 @@
+import hashlib
+import time
+from sqlalchemy import event
+from . import models
+
+
+class CacheRespuestas:
+    """Respuestas serializadas (ETag + cuerpo JSON) por obra, invalidadas al escribir obras o medios."""
+
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self._datos = {}           # (ruta, obra_uuid) -> (expira_en, etag, cuerpo)
+        self._uuid_por_id = {}     # obra.id -> obra_uuid, para invalidar desde un Medio
+
+    def obtener(self, ruta, obra_uuid):
+        entrada = self._datos.get((ruta, obra_uuid))
+        if entrada is None or entrada[0] < time.monotonic():
+            return None
+        return entrada[1], entrada[2]
+
+    def guardar(self, ruta, obra_uuid, obra_id, etag, cuerpo):
+        if self.ttl <= 0:
+            return
+        self._uuid_por_id[obra_id] = obra_uuid
+        self._datos[(ruta, obra_uuid)] = (time.monotonic() + self.ttl, etag, cuerpo)
+
+    def invalidar_obra(self, obra_uuid):
+        for clave in [c for c in self._datos if c[1] == obra_uuid]:
+            del self._datos[clave]
+
+    def invalidar_por_id(self, obra_id):
+        obra_uuid = self._uuid_por_id.get(obra_id)
+        if obra_uuid is None:
+            return
+        self.invalidar_obra(obra_uuid)
+
+    def limpiar(self):
+        self._datos.clear()
+
+    def registrar_eventos(self):
+        # Las escrituras hechas con los modelos en este proceso invalidan la caché;
+        # las ediciones externas (SQL directo) se reflejan al vencer el TTL
+        def obra_modificada(_mapper, _conexion, obra):
+            self.invalidar_obra(str(obra.uuid))
+
+        def medio_modificado(_mapper, _conexion, medio):
+            self.invalidar_por_id(medio.obra_id)
+
+        for evento in ("after_insert", "after_update", "after_delete"):
+            event.listen(models.Obra, evento, obra_modificada)
+            event.listen(models.Medio, evento, medio_modificado)
+
+
+def calcular_etag(cuerpo, *versiones):
+    # ETag fuerte a partir de las versiones (id, actualizado_en) de las filas que forman la respuesta
+    # y del cuerpo serializado, por si dos ediciones caen en la misma marca de tiempo
+    h = hashlib.sha1(cuerpo)
+    h.update("|".join(str(v) for v in versiones).encode())
+    return '"' + h.hexdigest()[:20] + '"'
+
+def version_filas(filas):
+    return sorted((f.id, f.actualizado_en.isoformat() if f.actualizado_en else "") for f in filas)
+
+def coincide_etag(if_none_match, etag):
+    if not if_none_match:
+        return False
+    etiquetas = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+    return "*" in etiquetas or etag in etiquetas
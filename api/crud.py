@@ -0,0 +1,44 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from starlette.concurrency import run_in_threadpool
+from . import models
+
+async def ejecutar(db, stmt):
+    # Con AsyncSession la consulta no bloquea el event loop; la sesión síncrona se ejecuta en el threadpool
+    if isinstance(db, AsyncSession):
+        return await db.execute(stmt)
+    return await run_in_threadpool(db.execute, stmt)
+
+async def obtener_obra(db, obra_uuid):
+    resultado = await ejecutar(db, select(models.Obra).where(models.Obra.uuid == obra_uuid))
+    return resultado.scalars().first()
+
+async def obtener_obra_completa(db, obra_uuid):
+    # Obra con todos sus medios en una sola consulta (JOIN)
+    stmt = (
+        select(models.Obra)
+        .options(joinedload(models.Obra.medios))
+        .where(models.Obra.uuid == obra_uuid)
+    )
+    resultado = await ejecutar(db, stmt)
+    return resultado.unique().scalars().first()
+
+async def obtener_obras_completas(db, uuids):
+    stmt = (
+        select(models.Obra)
+        .options(selectinload(models.Obra.medios))
+        .where(models.Obra.uuid.in_(uuids))
+    )
+    resultado = await ejecutar(db, stmt)
+    return resultado.scalars().all()
+
+async def obtener_catalogo(db):
+    # Todas las obras con sus medios, para la instantánea que el bot mantiene en memoria
+    stmt = select(models.Obra).options(selectinload(models.Obra.medios)).order_by(models.Obra.id)
+    resultado = await ejecutar(db, stmt)
+    return resultado.scalars().all()
+
+async def obtener_medios(db, obra_id):
+    resultado = await ejecutar(db, select(models.Medio).where(models.Medio.obra_id == obra_id))
+    return resultado.scalars().all()
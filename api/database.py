@@ -1,5 +1,7 @@
 # database.py (PostgreSQL)
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -11,34 +13,75 @@ DB_HOST = os.getenv("POSTGRES_HOST")
 DB_PORT = os.getenv("POSTGRES_PORT")
 DB_NAME = os.getenv("POSTGRES_DB")
 
-DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# "async": SQLAlchemy asyncio (asyncpg); "sync": sesión psycopg2 ejecutada en el threadpool de FastAPI
+DB_MODO = os.getenv("DB_MODO", "async")
 
-engine = create_engine(
-    DATABASE_URL,
-    pool_size=20,
-    max_overflow=10,
-    pool_pre_ping=True
+DATABASE_URL = os.getenv("DATABASE_URL") or (
+    f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 )
 
-SessionLocal = sessionmaker(
-    autocommit=False,
-    autoflush=False,
-    bind=engine
-)
+# Drivers asíncronos equivalentes a cada backend
+DRIVERS_ASYNC = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+def url_para_modo(url, modo):
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if modo == "async":
+        return url.set(drivername=DRIVERS_ASYNC.get(backend, url.drivername))
+    if backend == "postgresql":
+        return url.set(drivername="postgresql+psycopg2")
+    return url.set(drivername=backend)
+
+def opciones_pool(url):
+    # SQLite en memoria (sustituto local en pruebas) usa un pool sin pool_size/max_overflow
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {"pool_size": 20, "max_overflow": 10, "pool_pre_ping": True}
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+if DB_MODO == "async":
+    async_engine = create_async_engine(
+        url_para_modo(DATABASE_URL, "async"), **opciones_pool(DATABASE_URL)
+    )
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine,
+        class_=AsyncSession,
+        autoflush=False,
+        expire_on_commit=False
+    )
+
+    async def get_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+else:
+    engine = create_engine(
+        url_para_modo(DATABASE_URL, "sync"),
+        **opciones_pool(DATABASE_URL)
+    )
+
+    SessionLocal = sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        bind=engine
+    )
+
+    # Dependencia síncrona: FastAPI la ejecuta en su threadpool
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+# Engine síncrono subyacente (en modo async, el que envuelve async_engine), para escuchar eventos del cursor
+motor_sync = async_engine.sync_engine if DB_MODO == "async" else engine
 
 # Para crear tablas inicialmente (opcional)
 def create_tables():
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=create_engine(url_para_modo(DATABASE_URL, "sync")))
 
 if __name__ == "__main__":
     create_tables()
-    print("✅ Tablas creadas en PostgreSQL")
\ No newline at end of file
+    print("✅ Tablas creadas en PostgreSQL")
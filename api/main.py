@@ -1,19 +1,33 @@
-from fastapi import FastAPI, HTTPException, Depends, Security, status 
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, Security, status 
 from fastapi.security import APIKeyHeader
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
 from typing import List, Optional
-from . import models
-from .database import get_db
-from sqlalchemy.orm import Session
+from . import crud
+from .cache import CacheRespuestas, calcular_etag, coincide_etag, version_filas
+from .database import get_db, motor_sync
+from .metricas import registrar_consultas, registrar_endpoint, registrar_middleware
 from uuid import UUID
 import os
 
 API_KEY_NAME = os.getenv("API_KEY_NAME")
+# Caché de respuestas en el servidor y max-age para clientes/CDN (segundos)
+CACHE_RESPUESTAS_TTL = float(os.getenv("CACHE_RESPUESTAS_TTL", "60"))
+CACHE_MAX_AGE = int(os.getenv("CACHE_MAX_AGE", "60"))
+# Tiempos por ruta y por consulta SQL expuestos en /metrics (sin API key: restringirlo en el proxy)
+METRICAS_API = os.getenv("METRICAS_API", "1") == "1"
 
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 
 app = FastAPI()
 
+cache_respuestas = CacheRespuestas(CACHE_RESPUESTAS_TTL)
+cache_respuestas.registrar_eventos()
+
+if METRICAS_API:
+    registrar_middleware(app)
+    registrar_consultas(motor_sync)
+    registrar_endpoint(app)
+
 async def get_api_key(api_key: str = Security(api_key_header)):
     if api_key != os.getenv("API_KEY"):  # Clave almacenada en variables de entorno
         raise HTTPException(
@@ -48,20 +62,81 @@ class MedioResponse(BaseModel):
     info: Optional[str] = None
     ruta_local: Optional[str] = None
 
+class ObraCompletaResponse(ObraResponse):
+    medios: List[MedioResponse] = []
+
+MediosAdapter = TypeAdapter(List[MedioResponse])
+CatalogoAdapter = TypeAdapter(List[ObraCompletaResponse])
+
+class LoteObrasRequest(BaseModel):
+    uuids: List[UUID] = Field(..., min_length=1, max_length=100)
+
+def respuesta_json(request: Request, etag: str, cuerpo: bytes) -> Response:
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"max-age={CACHE_MAX_AGE}, must-revalidate",
+        # La respuesta depende de la API key: una CDN no debe compartirla entre claves distintas
+        "Vary": API_KEY_NAME or "X-API-Key",
+    }
+    if coincide_etag(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
+
+async def responder_obra(request: Request, ruta: str, obra_uuid: UUID, serializar):
+    # serializar(obra) -> (etag, cuerpo JSON); la base solo se consulta si la caché no tiene la respuesta
+    clave = str(obra_uuid)
+    en_cache = cache_respuestas.obtener(ruta, clave)
+    if en_cache is None:
+        obra, etag, cuerpo = await serializar(obra_uuid)
+        if obra is None:
+            raise HTTPException(status_code=404, detail="Obra no encontrada")
+        cache_respuestas.guardar(ruta, clave, obra.id, etag, cuerpo)
+        en_cache = (etag, cuerpo)
+    return respuesta_json(request, *en_cache)
+
 # Endpoints
+@app.get("/catalogo", response_model=List[ObraCompletaResponse], dependencies=[Depends(get_api_key)])
+async def get_catalogo(request: Request, db=Depends(get_db)):
+    # Catálogo completo (obras y medios); el ETag cambia con cualquier alta, baja o edición de filas,
+    # así que el bot puede revalidar su instantánea con If-None-Match sin volver a descargarla
+    obras = await crud.obtener_catalogo(db)
+    cuerpo = CatalogoAdapter.dump_json(CatalogoAdapter.validate_python(obras, from_attributes=True))
+    etag = calcular_etag(cuerpo, version_filas(obras), version_filas([m for o in obras for m in o.medios]))
+    return respuesta_json(request, etag, cuerpo)
+
+# /obras/batch se declara antes que /obras/{obra_uuid} para que no se confunda con un UUID
+@app.post("/obras/batch", response_model=List[ObraCompletaResponse], dependencies=[Depends(get_api_key)])
+async def get_obras_lote(lote: LoteObrasRequest, db=Depends(get_db)):
+    # Obras y medios de varios UUID a la vez (para precarga); los inexistentes se omiten
+    return await crud.obtener_obras_completas(db, list(dict.fromkeys(lote.uuids)))
+
+@app.get("/obras/{obra_uuid}/full", response_model=ObraCompletaResponse, dependencies=[Depends(get_api_key)])
+async def get_obra_completa(obra_uuid: UUID, request: Request, db=Depends(get_db)):
+    async def serializar(obra_uuid):
+        obra = await crud.obtener_obra_completa(db, obra_uuid)
+        if not obra:
+            return None, None, None
+        cuerpo = ObraCompletaResponse.model_validate(obra, from_attributes=True).model_dump_json().encode()
+        return obra, calcular_etag(cuerpo, version_filas([obra]), version_filas(obra.medios)), cuerpo
+    return await responder_obra(request, "full", obra_uuid, serializar)
+
 @app.get("/obras/{obra_uuid}", response_model=ObraResponse, dependencies=[Depends(get_api_key)])
-async def get_obra(obra_uuid: str, db: Session = Depends(get_db)):
-    obra = db.query(models.Obra).filter(models.Obra.uuid == obra_uuid).first()
-    if not obra:
-        raise HTTPException(status_code=404, detail="Obra no encontrada")
-    return obra
+async def get_obra(obra_uuid: UUID, request: Request, db=Depends(get_db)):
+    async def serializar(obra_uuid):
+        obra = await crud.obtener_obra(db, obra_uuid)
+        if not obra:
+            return None, None, None
+        cuerpo = ObraResponse.model_validate(obra, from_attributes=True).model_dump_json().encode()
+        return obra, calcular_etag(cuerpo, version_filas([obra])), cuerpo
+    return await responder_obra(request, "obra", obra_uuid, serializar)
 
 @app.get("/medios/{obra_uuid}", response_model=List[MedioResponse], dependencies=[Depends(get_api_key)])
-async def get_medios(obra_uuid: str, db: Session = Depends(get_db)):
-    obra = db.query(models.Obra).filter(models.Obra.uuid == obra_uuid).first()
-    if not obra:
-        raise HTTPException(status_code=404, detail="Obra no encontrada")
-    
-    medios = db.query(models.Medio).filter(models.Medio.obra_id == obra.id).all()
-    return medios
-
+async def get_medios(obra_uuid: UUID, request: Request, db=Depends(get_db)):
+    async def serializar(obra_uuid):
+        obra = await crud.obtener_obra(db, obra_uuid)
+        if not obra:
+            return None, None, None
+        medios = await crud.obtener_medios(db, obra.id)
+        cuerpo = MediosAdapter.dump_json(MediosAdapter.validate_python(medios, from_attributes=True))
+        return obra, calcular_etag(cuerpo, version_filas(medios)), cuerpo
+    return await responder_obra(request, "medios", obra_uuid, serializar)
@@ -0,0 +1,52 @@
+import time
+from fastapi import FastAPI, Request, Response
+from sqlalchemy import event
+from metricas_utils import REGISTRO
+
+peticiones_segundos = REGISTRO.histograma(
+    "museo_api_peticion_segundos", "Duración de las peticiones HTTP", ("metodo", "ruta", "codigo"))
+consultas_segundos = REGISTRO.histograma(
+    "museo_api_consulta_db_segundos", "Duración de las consultas SQL", ("operacion",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+peticiones_en_curso = REGISTRO.medidor("museo_api_peticiones_en_curso", "Peticiones HTTP en curso")
+
+
+def _plantilla_ruta(request):
+    # La plantilla (/obras/{obra_uuid}) y no la URL concreta, para no crear una serie por UUID
+    ruta = request.scope.get("route")
+    return getattr(ruta, "path", "sin_ruta")
+
+def registrar_middleware(app: FastAPI):
+    @app.middleware("http")
+    async def medir_peticion(request: Request, call_next):
+        inicio = time.perf_counter()
+        codigo = 500
+        peticiones_en_curso.inc()
+        try:
+            respuesta = await call_next(request)
+            codigo = respuesta.status_code
+            return respuesta
+        finally:
+            peticiones_en_curso.dec()
+            peticiones_segundos.observar(
+                time.perf_counter() - inicio,
+                metodo=request.method, ruta=_plantilla_ruta(request), codigo=codigo
+            )
+
+def registrar_consultas(engine):
+    # engine síncrono (en modo async, async_engine.sync_engine); mide cada sentencia en el cursor
+    @event.listens_for(engine, "before_cursor_execute")
+    def antes(_conexion, _cursor, _sentencia, _parametros, contexto, _multiple):
+        contexto._inicio_metricas = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def despues(_conexion, _cursor, sentencia, _parametros, contexto, _multiple):
+        inicio = getattr(contexto, "_inicio_metricas", None)
+        if inicio is not None:
+            operacion = sentencia.lstrip().split(None, 1)[0].upper() if sentencia.strip() else "?"
+            consultas_segundos.observar(time.perf_counter() - inicio, operacion=operacion)
+
+def registrar_endpoint(app: FastAPI, ruta="/metrics"):
+    @app.get(ruta, include_in_schema=False)
+    def metricas():
+        return Response(REGISTRO.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, String, Integer, Text, ForeignKey, CheckConstraint, Index
+from sqlalchemy import Column, String, Integer, Text, DateTime, ForeignKey, CheckConstraint, Index
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
-from sqlalchemy.sql import text
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func, text
 from .database import Base
 
 class Obra(Base):
@@ -14,6 +15,9 @@ class Obra(Base):
     año = Column(Integer, CheckConstraint("año >= 0"))
     estilo = Column(String(50))
     descripcion = Column(Text)
+    actualizado_en = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+    medios = relationship("Medio", back_populates="obra")
 
 class Medio(Base):
     __tablename__ = "medios"
@@ -24,6 +28,9 @@ class Medio(Base):
     url = Column(String(500), nullable=True)
     ruta_local = Column(String(500), nullable=True)
     info = Column(Text, nullable=True)
+    actualizado_en = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+    obra = relationship("Obra", back_populates="medios")
     __table_args__ = (
             Index("idx_medios_obra_id", "obra_id"),
             Index("idx_medios_tipo_medio", "tipo_medio"),
@@ -0,0 +1,115 @@
+import asyncio
+import random
+from collections import OrderedDict
+import httpx
+
+from cache_utils import CacheTTL
+
+# Códigos que indican un fallo transitorio del servidor y justifican reintentar
+CODIGOS_REINTENTO = {502, 503, 504}
+# Máximo de UUID por petición a /obras/batch (el mismo límite que valida la API)
+MAX_LOTE_OBRAS = 100
+
+
+class ClienteAPI:
+    """Cliente HTTP asíncrono para la API del museo con pool de conexiones keep-alive, reintentos
+    y caché en memoria de obras y medios."""
+
+    def __init__(self, base_url, api_key, api_key_name="X-API-Key", timeout=5.0,
+                 max_conexiones=20, reintentos=2, espera_base=0.2, cache_max=256, cache_ttl=300.0):
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.cache_obras = CacheTTL(cache_max, cache_ttl)
+        self.cache_medios = CacheTTL(cache_max, cache_ttl)
+        # Última respuesta con ETag por ruta, para revalidar con If-None-Match cuando vence la caché
+        self._validadores = OrderedDict()
+        self._max_validadores = cache_max * 4
+        self._cliente = httpx.AsyncClient(
+            base_url=base_url,
+            headers={api_key_name: api_key or ""},
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 3.0)),
+            limits=httpx.Limits(max_connections=max_conexiones, max_keepalive_connections=max_conexiones),
+        )
+
+    async def _esperar(self, intento):
+        # Backoff exponencial con jitter completo para no sincronizar reintentos de varios visitantes
+        await asyncio.sleep(random.uniform(0, self.espera_base * (2 ** intento)))
+
+    async def get_json(self, ruta):
+        # Si ya se tiene una versión con ETag, una respuesta 304 la reutiliza sin volver a transferirla
+        validador = self._validadores.get(ruta)
+        headers = {"If-None-Match": validador[0]} if validador else None
+        response = await self._solicitar("GET", ruta, headers=headers)
+        if response.status_code == 304 and validador:
+            self._validadores.move_to_end(ruta)
+            return validador[1]
+
+        datos = response.json()
+        etag = response.headers.get("ETag")
+        if etag:
+            self._validadores[ruta] = (etag, datos)
+            self._validadores.move_to_end(ruta)
+            while len(self._validadores) > self._max_validadores:
+                self._validadores.popitem(last=False)
+        return datos
+
+    async def post_json(self, ruta, datos):
+        return (await self._solicitar("POST", ruta, json=datos)).json()
+
+    async def _solicitar(self, metodo, ruta, **kwargs):
+        # Lanza httpx.HTTPStatusError para respuestas 4xx/5xx y httpx.TransportError si no hay conexión
+        for intento in range(self.reintentos + 1):
+            try:
+                response = await self._cliente.request(metodo, ruta, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout, httpx.RemoteProtocolError):
+                if intento == self.reintentos:
+                    raise
+                await self._esperar(intento)
+                continue
+
+            if response.status_code in CODIGOS_REINTENTO and intento < self.reintentos:
+                await self._esperar(intento)
+                continue
+            if response.status_code != 304:
+                response.raise_for_status()
+            return response
+
+    async def obtener_medios(self, obra_uuid):
+        return await self.cache_medios.obtener_o_cargar(
+            obra_uuid, lambda: self.get_json(f"/medios/{obra_uuid}")
+        )
+
+    async def obtener_obra_completa(self, obra_uuid):
+        # Obra y medios en un solo viaje a la API; ambos quedan en caché para los botones de medios
+        async def cargar():
+            obra = dict(await self.get_json(f"/obras/{obra_uuid}/full"))
+            self.cache_medios.guardar(obra_uuid, obra.pop("medios", []))
+            return obra
+
+        obra = await self.cache_obras.obtener_o_cargar(obra_uuid, cargar)
+        return obra, await self.obtener_medios(obra_uuid)
+
+    async def precargar_obras(self, uuids):
+        # Trae en una sola petición (hasta MAX_LOTE_OBRAS) las obras que aún no están en caché, con sus
+        # medios; las inexistentes no vuelven y quedan sin caché
+        faltantes = [u for u in dict.fromkeys(uuids) if not self.cache_obras.obtener(u)[0]]
+        if not faltantes:
+            return 0
+        obras = await self.post_json("/obras/batch", {"uuids": faltantes[:MAX_LOTE_OBRAS]})
+        for obra in obras:
+            self.cache_medios.guardar(obra["uuid"], obra.pop("medios", []))
+            self.cache_obras.guardar(obra["uuid"], obra)
+        return len(obras)
+
+    async def obtener_catalogo(self, etag=None):
+        # Devuelve (obras con medios, etag) o (None, etag) si el catálogo no cambió desde etag
+        response = await self._solicitar("GET", "/catalogo", headers={"If-None-Match": etag} if etag else None)
+        if response.status_code == 304:
+            return None, etag
+        return response.json(), response.headers.get("ETag")
+
+    def estadisticas_cache(self):
+        return {"obras": self.cache_obras.estadisticas(), "medios": self.cache_medios.estadisticas()}
+
+    async def cerrar(self):
+        await self._cliente.aclose()
@@ -0,0 +1,159 @@
+"""Prueba de carga de la API con una base SQLite local como sustituto de PostgreSQL.
+
+Compara el acceso a la base en el event loop (comportamiento anterior), la sesión síncrona
+en el threadpool (DB_MODO=sync) y SQLAlchemy asyncio (DB_MODO=async).
+
+    python -m benchmarks.carga_api --peticiones 400 --concurrencia 20 --latencia-db 0.01
+
+La concurrencia debe ser menor que el pool de conexiones (pool_size + max_overflow = 30): en modo
+bloqueante una petición que espera conexión libre detiene el event loop y nunca se libera ninguna.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+MODOS = ("bloqueante", "sync", "async")
+API_KEY = "clave-carga"
+
+def crear_base(ruta, n_obras):
+    # Esquema equivalente a database.sql sin las funciones propias de PostgreSQL
+    import sqlite3
+    conexion = sqlite3.connect(ruta)
+    conexion.executescript("""
+        CREATE TABLE obras (id INTEGER PRIMARY KEY, uuid CHAR(32) UNIQUE NOT NULL,
+            nombre_archivo VARCHAR(255) NOT NULL, titulo VARCHAR(100) NOT NULL, autor VARCHAR(100),
+            año INTEGER, estilo VARCHAR(50), descripcion TEXT,
+            actualizado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE medios (id INTEGER PRIMARY KEY, obra_id INTEGER NOT NULL, tipo_medio VARCHAR(20),
+            url VARCHAR(500), ruta_local VARCHAR(500), info TEXT,
+            actualizado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);
+        CREATE INDEX idx_medios_obra_id ON medios(obra_id);
+    """)
+    uuids = [uuid.uuid4() for _ in range(n_obras)]
+    for i, u in enumerate(uuids, start=1):
+        conexion.execute(
+            "INSERT INTO obras (id, uuid, nombre_archivo, titulo, autor, año, estilo, descripcion) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (i, u.hex, f"obra_{i}.jpg", f"Obra {i}", "Autor", 1900, "Estilo", "Descripción"),
+        )
+        for tipo in ("audio", "video", "texto"):
+            conexion.execute(
+                "INSERT INTO medios (obra_id, tipo_medio, ruta_local) VALUES (?, ?, ?)",
+                (i, tipo, f"/media/{tipo}/{i}"),
+            )
+    conexion.commit()
+    conexion.close()
+    return [str(u) for u in uuids]
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+async def ejecutar_carga(modo, uuids, peticiones, concurrencia, latencia_db):
+    import httpx
+    from sqlalchemy import event
+
+    from api import crud, database
+    from api.main import app
+
+    # Simula la latencia de red de un PostgreSQL remoto en cada sentencia. El callback de traza de
+    # sqlite3 corre en el hilo que ejecuta la sentencia (threadpool, event loop o hilo de aiosqlite)
+    motor = database.async_engine.sync_engine if modo == "async" else database.engine
+    @event.listens_for(motor, "connect")
+    def _latencia(conexion_dbapi, _registro):
+        conexion_sqlite = getattr(getattr(conexion_dbapi, "_connection", None), "_conn", conexion_dbapi)
+        conexion_sqlite.set_trace_callback(lambda _sentencia: time.sleep(latencia_db))
+
+    if modo == "bloqueante":
+        # Reproduce el comportamiento anterior: la sesión síncrona se usa directamente en el event loop
+        async def directo(funcion, *args):
+            return funcion(*args)
+        crud.run_in_threadpool = directo
+
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias = []
+    transporte = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://api",
+                                 headers={"X-API-Key": API_KEY}) as cliente:
+        async def una(i):
+            async with semaforo:
+                inicio = time.perf_counter()
+                respuesta = await cliente.get(f"/obras/{uuids[i % len(uuids)]}/full")
+                respuesta.raise_for_status()
+                latencias.append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(una(i) for i in range(peticiones)))
+        total = time.perf_counter() - inicio
+
+    if modo == "async":
+        # Cierra las conexiones del driver asíncrono para que el proceso pueda terminar
+        await database.async_engine.dispose()
+
+    return {
+        "modo": modo,
+        "peticiones": peticiones,
+        "concurrencia": concurrencia,
+        "segundos": round(total, 3),
+        "peticiones_por_segundo": round(peticiones / total, 1),
+        "p50_ms": round(statistics.median(latencias) * 1000, 1),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 1),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peticiones", type=int, default=400)
+    parser.add_argument("--concurrencia", type=int, default=20)
+    parser.add_argument("--obras", type=int, default=50)
+    parser.add_argument("--latencia-db", type=float, default=0.01, help="segundos añadidos a cada consulta")
+    parser.add_argument("--modos", nargs="+", choices=MODOS, default=list(MODOS))
+    parser.add_argument("--hijo", choices=MODOS, help=argparse.SUPPRESS)
+    parser.add_argument("--base", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hijo:
+        # La configuración de api.database se lee al importar, por eso cada modo corre en su propio proceso
+        with open(f"{args.base}.uuids") as f:
+            uuids = json.load(f)
+        resultado = asyncio.run(
+            ejecutar_carga(args.hijo, uuids, args.peticiones, args.concurrencia, args.latencia_db)
+        )
+        print(json.dumps(resultado))
+        return
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        base = os.path.join(carpeta, "museo.db")
+        with open(f"{base}.uuids", "w") as f:
+            json.dump(crear_base(base, args.obras), f)
+
+        resultados = []
+        for modo in args.modos:
+            entorno = dict(
+                os.environ,
+                DATABASE_URL=f"sqlite:///{base}",
+                DB_MODO="async" if modo == "async" else "sync",
+                API_KEY=API_KEY,
+                API_KEY_NAME="X-API-Key",
+                # Se mide el acceso a la base, no la caché de respuestas
+                CACHE_RESPUESTAS_TTL="0",
+            )
+            salida = subprocess.run(
+                [sys.executable, "-m", "benchmarks.carga_api", "--hijo", modo, "--base", base,
+                 "--peticiones", str(args.peticiones), "--concurrencia", str(args.concurrencia),
+                 "--latencia-db", str(args.latencia_db)],
+                env=entorno, capture_output=True, text=True, check=True,
+            )
+            resultados.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+
+    print(json.dumps(resultados, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
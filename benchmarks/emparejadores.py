@@ -0,0 +1,114 @@
+"""Recall y latencia de los emparejadores de descriptores (fuerza bruta, FLANN LSH por tile, índice global).
+
+Sobre fotos sintéticas de cuadros/ mide, para cada configuración:
+- recall_matches: fracción de los matches que pasan el ratio test con fuerza bruta (exactos) que el
+  emparejador también encuentra, en los tiles candidatos de cada foto;
+- emparejamiento_ms: costo del emparejamiento solo (consulta + ratio test en todos los candidatos);
+- precisión top-1, falsos positivos y latencia p50/p95 de buscar_obra completo (con salida temprana);
+- preparacion_ms: construcción del emparejador al cargar el índice en un worker.
+
+Una configuración es nombre[:tablas,bits_clave,sondeo[,vecinos]]:
+
+    python -m benchmarks.emparejadores --configuraciones fuerza_bruta flann_lsh:6,12,1 global:6,20,1,8
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.sinteticas import foto_sin_obra, generar_consultas
+from image_utils import buscar_obra, buenos_matches, imagen_gris, preprocesar_imagen, recortar_centro
+from indice_utils import cargar_indice
+
+CONFIGURACIONES = ("fuerza_bruta", "flann_lsh:6,12,1", "flann_lsh:10,16,2", "global:6,20,1,8", "global:8,20,2,16")
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+def leer_configuracion(texto):
+    nombre, _, valores = texto.partition(":")
+    claves = ("tablas", "bits_clave", "sondeo", "vecinos")
+    return nombre, dict(zip(claves, (int(v) for v in valores.split(",")))) if valores else {}
+
+def descriptores_consulta(datos, indice):
+    # Mismo preprocesamiento que buscar_en_nivel
+    img = recortar_centro(preprocesar_imagen(imagen_gris(datos)), porcentaje=0.6)
+    _, des = cv2.ORB_create(nfeatures=indice.n_features).detectAndCompute(img, None)
+    return des
+
+def evaluar(texto, indice, consultas, negativas, top_k):
+    nombre, parametros = leer_configuracion(texto)
+    inicio = time.perf_counter()
+    indice.preparar_busqueda(nombre, **parametros)
+    preparacion = time.perf_counter() - inicio
+
+    encontrados = exactos = 0
+    tiempos_emparejamiento = []
+    for _, datos in consultas:
+        des1 = descriptores_consulta(datos, indice)
+        candidatos = indice.candidatos(des1, top_k)
+        inicio = time.perf_counter()
+        emparejar = indice.emparejador.consulta(des1)
+        aproximados = [emparejar(tile) for tile in candidatos]
+        tiempos_emparejamiento.append(time.perf_counter() - inicio)
+        for tile, (idx_query, idx_train) in zip(candidatos, aproximados):
+            referencia = set(zip(*(a.tolist() for a in buenos_matches(des1, indice.tiles[tile][3]))))
+            encontrados += len(referencia & set(zip(idx_query.tolist(), idx_train.tolist())))
+            exactos += len(referencia)
+
+    aciertos, latencias = 0, []
+    for archivo, datos in consultas:
+        inicio = time.perf_counter()
+        resultado = buscar_obra(datos, indice, top_k)
+        latencias.append(time.perf_counter() - inicio)
+        aciertos += resultado.coincidencia is not None and resultado.coincidencia[0] == archivo
+    falsos_positivos = sum(buscar_obra(datos, indice, top_k).coincidencia is not None
+                           for datos in negativas)
+
+    return {
+        "configuracion": texto,
+        "recall_matches": round(encontrados / exactos, 3) if exactos else None,
+        "emparejamiento_ms_p50": round(statistics.median(tiempos_emparejamiento) * 1000, 2),
+        "precision": round(aciertos / len(consultas), 3),
+        "falsos_positivos": falsos_positivos,
+        "p50_ms": round(statistics.median(latencias) * 1000, 1),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 1),
+        "preparacion_ms": round(preparacion * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configuraciones", nargs="+", default=list(CONFIGURACIONES))
+    parser.add_argument("--variantes", type=int, default=3, help="fotos sintéticas por obra")
+    parser.add_argument("--negativas", type=int, default=10, help="fotos sin obra para medir falsos positivos")
+    parser.add_argument("--top-k", type=int, default=3, help="obras por puntuación en la lista corta")
+    parser.add_argument("--encuadre", type=float, nargs=2, default=(0.35, 0.9),
+                        help="fracción mínima y máxima del ancho de la obra que aparece en la foto")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--carpeta", default="cuadros")
+    args = parser.parse_args()
+
+    # Un solo hilo para que la latencia medida sea la de un worker del pool de procesamiento
+    cv2.setNumThreads(1)
+    with tempfile.TemporaryDirectory() as carpeta_indices:
+        indice = cargar_indice(args.carpeta, os.path.join(carpeta_indices, "indice.idx")).niveles[0]
+    consultas = generar_consultas(args.carpeta, args.variantes, args.semilla, args.encuadre)
+    rng = np.random.default_rng(args.semilla)
+    negativas = [foto_sin_obra(rng) for _ in range(args.negativas)]
+
+    resultados = [evaluar(texto, indice, consultas, negativas, args.top_k) for texto in args.configuraciones]
+    print(json.dumps({
+        "tiles": len(indice.tiles),
+        "descriptores": sum(len(des) for _, _, _, des in indice.tiles),
+        "consultas": len(consultas),
+        "configuraciones": resultados,
+    }, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Tiempo de consulta y recall de la lista corta de candidatos a medida que crece la galería.
+
+Agrega obras de relleno (recortes espejados de las obras reales) a una copia de cuadros/ y, para cada
+tamaño de galería, reindexa de forma incremental (el vocabulario se redimensiona si la galería creció
+demasiado) y mide con fotos sintéticas de las obras reales:
+- recall de la lista corta por obra (tiles de las top_k obras por coseno y de las top_k por cobertura):
+  fracción de fotos cuya obra está en la lista ("verdad") y fracción de las que el barrido completo
+  (verificación geométrica de todos los tiles, sin salida temprana) asigna a alguna obra en las que esa
+  obra está en la lista ("barrido");
+- el mismo recall para la lista corta anterior de los top_k_tiles tiles con mejor coseno tf-idf, con
+  la cantidad media de obras y tiles de cada lista para comparar con el mismo costo de verificación;
+- candidatos_ms: costo de la primera etapa sola (cuantizar y recorrer las listas invertidas);
+- precisión y latencia p50 de buscar_obra con la lista corta por defecto del bot (top_k_candidatos según
+  la cantidad de obras) contra el barrido completo.
+
+    python -m benchmarks.escalabilidad --relleno 0 100 300 --top-k 1 3 5
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.sinteticas import generar_consultas, imagenes, obra_ficticia
+from image_utils import buscar_obra, imagen_gris, preprocesar_imagen, recortar_centro
+from indice_utils import cargar_indice
+from recuperacion_utils import top_k_candidatos
+
+def descriptores_consulta(foto, indice):
+    # Mismo preprocesamiento que buscar_en_nivel
+    img = recortar_centro(preprocesar_imagen(imagen_gris(foto, indice.ancho_trabajo)), porcentaje=0.6)
+    _, des = cv2.ORB_create(nfeatures=indice.n_features).detectAndCompute(img, None)
+    return des
+
+def obras_de(indice, tiles):
+    return {indice.tiles[tile][0] for tile in tiles}
+
+def evaluar(indice, consultas, lista_top_k, top_k_tiles, top_k_busqueda):
+    # Recall contra la obra de la que sale cada foto y contra la que elige el barrido completo
+    contenidas = {top_k: [0, 0] for top_k in lista_top_k}
+    contenidas_tiles = [0, 0]
+    # Tamaño de cada lista corta: obras y tiles que pasan a la verificación geométrica
+    tamaños = {top_k: [] for top_k in lista_top_k}
+    tamaños_tiles = []
+    tiempos_candidatos = {top_k: [] for top_k in lista_top_k}
+    latencias_completo, latencias_lista = [], []
+    aciertos_completo = aciertos_lista = coinciden = con_referencia = 0
+    for archivo, datos in consultas:
+        foto = imagen_gris(datos)
+        inicio = time.perf_counter()
+        completo = buscar_obra(foto, indice, top_k=None, salida_temprana=False)
+        latencias_completo.append(time.perf_counter() - inicio)
+        inicio = time.perf_counter()
+        lista = buscar_obra(foto, indice, top_k_busqueda)
+        latencias_lista.append(time.perf_counter() - inicio)
+        referencia = completo.coincidencia and completo.coincidencia[0]
+        aciertos_completo += referencia == archivo
+        aciertos_lista += bool(lista.coincidencia) and lista.coincidencia[0] == archivo
+        coinciden += (lista.coincidencia and lista.coincidencia[0]) == referencia
+        con_referencia += bool(referencia)
+
+        des = descriptores_consulta(foto, indice)
+        for top_k in lista_top_k:
+            inicio = time.perf_counter()
+            candidatos = indice.candidatos(des, top_k)
+            tiempos_candidatos[top_k].append(time.perf_counter() - inicio)
+            obras = obras_de(indice, candidatos)
+            tamaños[top_k].append((len(obras), len(candidatos)))
+            contenidas[top_k][0] += archivo in obras
+            contenidas[top_k][1] += bool(referencia) and referencia in obras
+        coseno, _ = indice.invertido.puntuar(des)
+        obras = obras_de(indice, np.argsort(-coseno, kind="stable")[:top_k_tiles])
+        tamaños_tiles.append((len(obras), top_k_tiles))
+        contenidas_tiles[0] += archivo in obras
+        contenidas_tiles[1] += bool(referencia) and referencia in obras
+
+    def recall(contenidas, tamaños):
+        return {
+            "verdad": round(contenidas[0] / len(consultas), 3),
+            "barrido": round(contenidas[1] / con_referencia, 3) if con_referencia else None,
+            "obras_en_lista": round(statistics.mean(obras for obras, _ in tamaños), 1),
+            "tiles_en_lista": round(statistics.mean(tiles for _, tiles in tamaños), 1),
+        }
+
+    return {
+        "obras": len(indice.obras),
+        "tiles": len(indice.tiles),
+        "palabras_vocabulario": indice.vocabulario.n_palabras,
+        "postings_por_palabra": round(len(indice.invertido.post_tiles) / indice.vocabulario.n_palabras, 1),
+        "con_obra_en_barrido": con_referencia,
+        "recall_por_obra": {
+            str(top_k): {**recall(contenidas[top_k], tamaños[top_k]),
+                         "candidatos_ms_p50": round(statistics.median(tiempos_candidatos[top_k]) * 1000, 2)}
+            for top_k in lista_top_k
+        },
+        f"recall_top{top_k_tiles}_tiles": recall(contenidas_tiles, tamaños_tiles),
+        "barrido_completo": {
+            "precision": round(aciertos_completo / len(consultas), 3),
+            "p50_ms": round(statistics.median(latencias_completo) * 1000, 1),
+        },
+        f"lista_corta_top{top_k_busqueda}": {
+            "precision": round(aciertos_lista / len(consultas), 3),
+            "coincide_con_barrido": round(coinciden / len(consultas), 3),
+            "p50_ms": round(statistics.median(latencias_lista) * 1000, 1),
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--relleno", type=int, nargs="+", default=[0, 100, 300],
+                        help="cantidad de obras de relleno agregadas a la galería, en orden creciente")
+    parser.add_argument("--top-k", type=int, nargs="+", default=[1, 3, 5], help="obras en la lista corta")
+    parser.add_argument("--top-k-tiles", type=int, default=10, help="lista corta por tile de referencia")
+    parser.add_argument("--variantes", type=int, default=2, help="fotos sintéticas por obra real")
+    parser.add_argument("--encuadre", type=float, nargs=2, default=(0.35, 0.9),
+                        help="fracción mínima y máxima del ancho de la obra que aparece en la foto")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--carpeta", default="cuadros")
+    args = parser.parse_args()
+
+    # Un solo hilo para que la latencia medida sea la de un worker del pool de procesamiento
+    cv2.setNumThreads(1)
+    consultas = generar_consultas(args.carpeta, args.variantes, args.semilla, args.encuadre)
+    obras = [obra for _, obra in imagenes(args.carpeta)]
+    rng = np.random.default_rng(args.semilla)
+    resultados = []
+    with tempfile.TemporaryDirectory() as temporal:
+        galeria = shutil.copytree(args.carpeta, os.path.join(temporal, "galeria"))
+        agregadas = 0
+        for relleno in sorted(args.relleno):
+            for i in range(agregadas, relleno):
+                cv2.imwrite(os.path.join(galeria, f"relleno_{i:05d}.jpg"), obra_ficticia(obras, rng))
+            agregadas = max(agregadas, relleno)
+            inicio = time.perf_counter()
+            indice = cargar_indice(galeria, os.path.join(temporal, "indice.idx")).niveles[0]
+            construccion = time.perf_counter() - inicio
+            resultado = evaluar(indice, consultas, args.top_k, args.top_k_tiles, top_k_candidatos(len(indice)))
+            resultado["reindexado_s"] = round(construccion, 1)
+            resultados.append(resultado)
+            print(json.dumps(resultado, ensure_ascii=False), flush=True)
+
+    print(json.dumps({"consultas": len(consultas), "tamaños": resultados}, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Banco de pruebas offline de las etapas de reconocimiento, OCR y QR con los datos de ejemplo.
+
+Genera fotos sintéticas reproducibles (perspectiva, rotación, recorte parcial, desenfoque, reflejo y
+recompresión JPEG) a partir de cuadros/, QR_Ejemplos/ y fichas de sala dibujadas, y mide por etapa:
+precisión top-1, latencia p50/p95/p99, rendimiento y memoria máxima (RSS). Cada etapa corre en su
+propio proceso para que la memoria medida sea solo la suya.
+
+    python -m benchmarks.pipeline --variantes 3 --salida resultados.json
+    python -m benchmarks.pipeline --comparar resultados.json   # falla si hay regresiones
+
+La precisión del OCR cuenta como acierto una ficha cuyo texto reconocido se parece al esperado en al
+menos --similitud-ocr (difflib, ignorando mayúsculas y espacios).
+"""
+import argparse
+import difflib
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks import sinteticas
+
+ETAPAS = ("comparacion", "ocr", "qr")
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+def rss_maximo_mb():
+    # ru_maxrss está en KiB en Linux y en bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def medir(consultas, funcion, es_acierto):
+    # consultas: [(esperado, bytes)]; funcion(bytes) -> resultado; es_acierto(esperado, resultado) -> bool
+    latencias, aciertos = [], 0
+    inicio_total = time.perf_counter()
+    for esperado, datos in consultas:
+        inicio = time.perf_counter()
+        resultado = funcion(datos)
+        latencias.append(time.perf_counter() - inicio)
+        aciertos += bool(es_acierto(esperado, resultado))
+    total = time.perf_counter() - inicio_total
+    return {
+        "consultas": len(consultas),
+        "precision": round(aciertos / len(consultas), 3) if consultas else None,
+        "p50_ms": round(statistics.median(latencias) * 1000, 1),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 1),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 1),
+        "media_ms": round(statistics.mean(latencias) * 1000, 1),
+        "consultas_por_segundo": round(len(consultas) / total, 2),
+    }
+
+def etapa_comparacion(args, rng):
+    from image_utils import buscar_obra
+    from indice_utils import cargar_indice
+
+    consultas = []
+    for archivo, obra in sinteticas.imagenes(args.cuadros):
+        consultas.extend(
+            (archivo, sinteticas.foto_obra(obra, rng, (0.35, 0.9), rotacion_max=15, reflejo=rng.random() < 0.5))
+            for _ in range(args.variantes)
+        )
+    negativas = [(None, sinteticas.foto_sin_obra(rng)) for _ in range(args.negativas)]
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        inicio = time.perf_counter()
+        indice = cargar_indice(args.cuadros, os.path.join(carpeta, "indice.idx"))
+        construccion = time.perf_counter() - inicio
+
+    def comparar(datos):
+        return buscar_obra(datos, indice, args.top_k).coincidencia
+
+    metricas = medir(consultas, comparar, lambda esperado, r: r is not None and r[0] == esperado)
+    metricas["falsos_positivos"] = sum(comparar(datos) is not None for _, datos in negativas)
+    metricas["negativas"] = len(negativas)
+    metricas["construccion_indice_s"] = round(construccion, 2)
+    return metricas
+
+def etapa_ocr(args, rng):
+    from text_utils import obtener_motor_ocr, procesar_texto_imagen
+
+    def normalizar(texto):
+        return " ".join(texto.lower().split())
+
+    consultas = [(texto, sinteticas.foto_ficha(texto, rng))
+                 for texto in sinteticas.FICHAS for _ in range(args.variantes)]
+    # Fotos de obras sin texto: deben salir por la vía rápida sin llamar a Tesseract
+    sin_texto = [("", sinteticas.foto_obra(obra, rng)) for _, obra in sinteticas.imagenes(args.cuadros)]
+
+    motor = obtener_motor_ocr()
+    metricas = medir(
+        consultas,
+        lambda datos: procesar_texto_imagen(datos)[0],
+        lambda esperado, r: difflib.SequenceMatcher(None, normalizar(esperado), normalizar(r)).ratio()
+        >= args.similitud_ocr,
+    )
+    vacias = medir(sin_texto, lambda datos: procesar_texto_imagen(datos)[0], lambda _, r: not r)
+    metricas["motor"] = motor.nombre
+    metricas["sin_texto"] = {clave: vacias[clave] for clave in ("consultas", "precision", "p50_ms", "p95_ms")}
+    return metricas
+
+def etapa_qr(args, rng):
+    from qr_utils import decode_qr
+
+    consultas, no_decodificables = [], []
+    for archivo, qr in sinteticas.imagenes(args.qr):
+        # El valor esperado sale del QR original; si ni el original se lee se informa aparte
+        original = decode_qr(qr)
+        if original is None:
+            no_decodificables.append(archivo)
+            continue
+        consultas.extend((original[0], sinteticas.foto_qr(qr, rng)) for _ in range(args.variantes))
+
+    metricas = medir(consultas, decode_qr, lambda esperado, r: r is not None and r[0] == esperado)
+    metricas["referencias_no_decodificables"] = no_decodificables
+    return metricas
+
+def ejecutar_etapa(etapa, args):
+    cv2.setNumThreads(args.hilos_opencv)
+    rng = np.random.default_rng([args.semilla, ETAPAS.index(etapa)])
+    try:
+        metricas = {"comparacion": etapa_comparacion, "ocr": etapa_ocr, "qr": etapa_qr}[etapa](args, rng)
+    except Exception as e:
+        # Una etapa sin sus dependencias (p. ej. sin tesseract instalado) no invalida el resto
+        metricas = {"error": f"{type(e).__name__}: {e}"}
+    metricas["rss_max_mb"] = rss_maximo_mb()
+    return {"etapa": etapa, **metricas}
+
+def comparar_con(previo, actual, tolerancia_latencia, tolerancia_precision):
+    # Devuelve las regresiones de actual respecto a previo
+    anteriores = {r["etapa"]: r for r in previo["etapas"]}
+    regresiones = []
+    for r in actual["etapas"]:
+        antes = anteriores.get(r["etapa"])
+        if not antes or "error" in antes or "error" in r:
+            continue
+        if r["precision"] is not None and antes["precision"] is not None \
+                and r["precision"] < antes["precision"] - tolerancia_precision:
+            regresiones.append(f"{r['etapa']}: precisión {antes['precision']} -> {r['precision']}")
+        for clave in ("p50_ms", "p95_ms"):
+            if r[clave] > antes[clave] * (1 + tolerancia_latencia):
+                regresiones.append(f"{r['etapa']}: {clave} {antes[clave]} -> {r[clave]}")
+        if r.get("falsos_positivos", 0) > antes.get("falsos_positivos", 0):
+            regresiones.append(f"{r['etapa']}: falsos positivos {antes['falsos_positivos']} -> {r['falsos_positivos']}")
+    return regresiones
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--etapas", nargs="+", choices=ETAPAS, default=list(ETAPAS))
+    parser.add_argument("--variantes", type=int, default=3, help="fotos sintéticas por obra, QR o ficha")
+    parser.add_argument("--negativas", type=int, default=10, help="fotos sin obra para medir falsos positivos")
+    parser.add_argument("--top-k", type=int, default=3, help="obras por puntuación en la lista corta")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--similitud-ocr", type=float, default=0.8)
+    parser.add_argument("--hilos-opencv", type=int, default=1,
+                        help="hilos internos de OpenCV; 1 reproduce un worker del pool de procesamiento")
+    parser.add_argument("--cuadros", default="cuadros")
+    parser.add_argument("--qr", default="QR_Ejemplos")
+    parser.add_argument("--salida", help="archivo JSON donde guardar los resultados")
+    parser.add_argument("--comparar", help="resultados JSON previos; sale con código 1 si hay regresiones")
+    parser.add_argument("--tolerancia-latencia", type=float, default=0.2, help="aumento relativo permitido")
+    parser.add_argument("--tolerancia-precision", type=float, default=0.02, help="caída absoluta permitida")
+    parser.add_argument("--hijo", choices=ETAPAS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hijo:
+        print(json.dumps(ejecutar_etapa(args.hijo, args)))
+        return
+
+    parametros = {clave: valor for clave, valor in vars(args).items()
+                  if clave not in ("hijo", "salida", "comparar", "etapas")}
+    etapas = []
+    for etapa in args.etapas:
+        comando = [sys.executable, "-m", "benchmarks.pipeline", "--hijo", etapa]
+        for clave, valor in parametros.items():
+            comando += [f"--{clave.replace('_', '-')}", str(valor)]
+        salida = subprocess.run(comando, capture_output=True, text=True, check=True)
+        etapas.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+
+    resultado = {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "entorno": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "cpus": os.cpu_count(),
+            "maquina": platform.machine(),
+        },
+        "parametros": parametros,
+        "etapas": etapas,
+    }
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    print(texto)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regresiones = comparar_con(json.load(f), resultado, args.tolerancia_latencia, args.tolerancia_precision)
+        for regresion in regresiones:
+            print(f"REGRESIÓN {regresion}", file=sys.stderr)
+        if regresiones:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
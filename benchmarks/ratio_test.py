@@ -0,0 +1,97 @@
+"""Costo por tile del ratio test y la recolección de puntos antes de RANSAC.
+
+Compara la versión anterior (knnMatch + listas de DMatch + atributos de KeyPoint en Python) con la
+vectorizada de image_utils.buenos_matches sobre los tiles reales del índice de cuadros/, y comprueba
+que ambas entregan exactamente los mismos pares de puntos.
+
+    python -m benchmarks.ratio_test --consultas 6 --repeticiones 3
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.sinteticas import generar_consultas
+from image_utils import N_FEATURES, RATIO_LOWE, buenos_matches, imagen_gris, preprocesar_imagen, recortar_centro
+from indice_utils import cargar_indice
+
+def puntos_lista(kp1, des1, puntos2, des2):
+    # Implementación anterior, conservada solo como referencia para la medición
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
+    matches = bf.knnMatch(des1, des2, k=2)
+    good_matches = [m for m, n in matches if m.distance < RATIO_LOWE * n.distance]
+    src_pts = np.float32([kp1[m.queryIdx].pt for m in good_matches]).reshape(-1, 2)
+    dst_pts = puntos2[[m.trainIdx for m in good_matches]]
+    return src_pts, dst_pts
+
+def puntos_vectorizado(puntos1, des1, puntos2, des2):
+    idx_query, idx_train = buenos_matches(des1, des2)
+    return puntos1[idx_query], puntos2[idx_train]
+
+def solo_distancias(des1, des2):
+    return cv2.batchDistance(des1, des2, cv2.CV_32S, normType=cv2.NORM_HAMMING, K=2)
+
+def medir(funcion, repeticiones, *args):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--consultas", type=int, default=6, help="fotos sintéticas a comparar contra todos los tiles")
+    parser.add_argument("--repeticiones", type=int, default=3, help="se toma el mejor tiempo de cada tile")
+    parser.add_argument("--carpeta", default="cuadros")
+    args = parser.parse_args()
+
+    cv2.setNumThreads(1)
+    with tempfile.TemporaryDirectory() as carpeta_indices:
+        indice = cargar_indice(args.carpeta, os.path.join(carpeta_indices, "indice.idx")).niveles[0]
+
+    detector = cv2.ORB_create(nfeatures=N_FEATURES)
+    consultas = generar_consultas(args.carpeta, 1, 0, (0.4, 0.8))[:args.consultas]
+    tiempos_lista, tiempos_vector, tiempos_distancia = [], [], []
+    buenos = 0
+    for _, datos in consultas:
+        img = recortar_centro(preprocesar_imagen(imagen_gris(datos)), porcentaje=0.6)
+        kp1, des1 = detector.detectAndCompute(img, None)
+        puntos1 = cv2.KeyPoint_convert(kp1).astype(np.float32).reshape(-1, 2)
+        for _, _, puntos2, des2 in indice.tiles:
+            t_lista, (src_a, dst_a) = medir(puntos_lista, args.repeticiones, kp1, des1, puntos2, des2)
+            t_vector, (src_b, dst_b) = medir(puntos_vectorizado, args.repeticiones, puntos1, des1, puntos2, des2)
+            t_distancia, _ = medir(solo_distancias, args.repeticiones, des1, des2)
+            if not (np.array_equal(src_a, src_b) and np.array_equal(dst_a, dst_b)):
+                raise AssertionError("Las dos implementaciones no devuelven los mismos puntos")
+            tiempos_lista.append(t_lista)
+            tiempos_vector.append(t_vector)
+            tiempos_distancia.append(t_distancia)
+            buenos += len(src_b)
+
+    mediana_lista = statistics.median(tiempos_lista)
+    mediana_vector = statistics.median(tiempos_vector)
+    # Lo que no es el cálculo de distancias de Hamming: objetos DMatch, ratio test y recolección de puntos
+    sobrecarga_lista = statistics.median(a - d for a, d in zip(tiempos_lista, tiempos_distancia))
+    sobrecarga_vector = statistics.median(b - d for b, d in zip(tiempos_vector, tiempos_distancia))
+    print(json.dumps({
+        "tiles": len(tiempos_lista),
+        "descriptores_por_tile_media": round(statistics.mean(len(des2) for _, _, _, des2 in indice.tiles)),
+        "buenos_matches_media": round(buenos / len(tiempos_lista), 1),
+        "lista_us_p50": round(mediana_lista * 1e6, 1),
+        "vectorizado_us_p50": round(mediana_vector * 1e6, 1),
+        "aceleracion_p50": round(mediana_lista / mediana_vector, 2),
+        "distancias_us_p50": round(statistics.median(tiempos_distancia) * 1e6, 1),
+        "sobrecarga_lista_us_p50": round(sobrecarga_lista * 1e6, 1),
+        "sobrecarga_vectorizado_us_p50": round(sobrecarga_vector * 1e6, 1),
+        "lista_ms_total": round(sum(tiempos_lista) * 1000, 1),
+        "vectorizado_ms_total": round(sum(tiempos_vector) * 1000, 1),
+    }, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Precisión y latencia de la comparación de obras según la resolución de trabajo del índice.
+
+Genera fotos sintéticas de detalles de cada obra de cuadros/ (perspectiva, escala, desenfoque, brillo,
+ruido y compresión JPEG) y las compara contra índices construidos a distintos anchos
+de trabajo. Una configuración con varios anchos ("480,960") es una pirámide: se compara en el más bajo
+y solo se refina en el siguiente si el resultado no es confiable.
+
+    python -m benchmarks.resolucion --resoluciones 0 480 640 960 480,960 --variantes 3
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import cv2
+
+from benchmarks.sinteticas import generar_consultas
+from image_utils import buscar_obra
+from indice_utils import cargar_indice
+
+CARPETA_IMAGENES = "cuadros"
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+def evaluar(resoluciones, consultas, carpeta, carpeta_indices, top_k):
+    inicio = time.perf_counter()
+    ruta = os.path.join(carpeta_indices, f"indice_{'-'.join(map(str, resoluciones))}.idx")
+    indice = cargar_indice(carpeta, ruta, resoluciones=resoluciones)
+    construccion = time.perf_counter() - inicio
+
+    aciertos = errores = sin_coincidencia = refinadas = 0
+    latencias = []
+    for archivo, datos in consultas:
+        inicio = time.perf_counter()
+        # La decodificación es parte del costo por consulta, igual que en el bot
+        resultado = buscar_obra(datos, indice, top_k)
+        latencias.append(time.perf_counter() - inicio)
+        refinadas += len(resultado.resoluciones) > 1
+        if resultado.coincidencia is None:
+            sin_coincidencia += 1
+        elif resultado.coincidencia[0] == archivo:
+            aciertos += 1
+        else:
+            errores += 1
+
+    return {
+        "resoluciones": ",".join(str(a) for a in resoluciones),
+        "consultas": len(consultas),
+        "precision": round(aciertos / len(consultas), 3),
+        "errores": errores,
+        "sin_coincidencia": sin_coincidencia,
+        "refinadas": refinadas,
+        "p50_ms": round(statistics.median(latencias) * 1000, 1),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 1),
+        "media_ms": round(statistics.mean(latencias) * 1000, 1),
+        "construccion_s": round(construccion, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resoluciones", nargs="+", default=["0", "480", "640", "960", "480,960"],
+                        help="anchos de trabajo; varios separados por coma forman una pirámide")
+    parser.add_argument("--variantes", type=int, default=3, help="fotos sintéticas por obra")
+    parser.add_argument("--top-k", type=int, default=3, help="obras por puntuación en la lista corta")
+    parser.add_argument("--encuadre", type=float, nargs=2, default=(0.3, 0.6),
+                        help="fracción mínima y máxima del ancho de la obra que aparece en la foto")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--carpeta", default=CARPETA_IMAGENES)
+    args = parser.parse_args()
+
+    # Un solo hilo para que la latencia medida sea la de un worker del pool de procesamiento
+    cv2.setNumThreads(1)
+    consultas = generar_consultas(args.carpeta, args.variantes, args.semilla, args.encuadre)
+    resultados = []
+    with tempfile.TemporaryDirectory() as carpeta_indices:
+        for configuracion in args.resoluciones:
+            resoluciones = tuple(int(a) for a in configuracion.split(","))
+            resultados.append(evaluar(resoluciones, consultas, args.carpeta, carpeta_indices, args.top_k))
+
+    print(json.dumps(resultados, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Fotos sintéticas de visitante generadas a partir de los datos de ejemplo del repositorio."""
+import os
+
+import cv2
+import numpy as np
+
+ANCHO_FOTO, ALTO_FOTO = 1280, 960
+
+# Textos de fichas de sala para el OCR (sin acentos: cv2.putText solo dibuja ASCII)
+FICHAS = [
+    "El Grito\nEdvard Munch, 1893\nTemple y pastel sobre carton",
+    "La noche estrellada\nVincent van Gogh, 1889\nOleo sobre lienzo",
+    "Las Meninas\nDiego Velazquez, 1656\nOleo sobre lienzo",
+    "La persistencia de la memoria\nSalvador Dali, 1931",
+    "El beso\nGustav Klimt, 1908\nOleo y pan de oro",
+    "Impresion, sol naciente\nClaude Monet, 1872",
+]
+
+def _perspectiva(rng, ancho, alto, jitter):
+    return rng.uniform(-jitter, jitter, (4, 2)).astype(np.float32) * np.float32([ancho, alto])
+
+def _degradar(foto, rng, reflejo=False, calidad_jpeg=80):
+    # Desenfoque, exposición, reflejo de luz, ruido del sensor y recompresión JPEG
+    foto = cv2.GaussianBlur(foto, (0, 0), rng.uniform(0.3, 1.5))
+    foto = cv2.convertScaleAbs(foto, alpha=rng.uniform(0.75, 1.2), beta=rng.uniform(-25, 25))
+    if reflejo:
+        alto, ancho = foto.shape[:2]
+        yy, xx = np.mgrid[0:alto, 0:ancho].astype(np.float32)
+        cx, cy = rng.uniform(0, ancho), rng.uniform(0, alto)
+        radio = rng.uniform(0.1, 0.3) * ancho
+        brillo = rng.uniform(80, 160) * np.exp(-((xx - cx) ** 2 + (yy - cy) ** 2) / (2 * radio ** 2))
+        foto = np.clip(foto.astype(np.float32) + brillo[..., None], 0, 255).astype(np.uint8)
+    ruido = rng.normal(0, 4, foto.shape)
+    foto = np.clip(foto.astype(np.float32) + ruido, 0, 255).astype(np.uint8)
+    _, jpeg = cv2.imencode(".jpg", foto, [cv2.IMWRITE_JPEG_QUALITY, calidad_jpeg])
+    return jpeg.tobytes()
+
+def foto_obra(obra, rng, encuadre=(0.3, 0.6), rotacion_max=0.0, reflejo=False):
+    # Simula una foto de celular de un detalle de la obra: una región que ocupa entre encuadre[0] y
+    # encuadre[1] del ancho de la obra llena el cuadro, con perspectiva y pared alrededor si se sale
+    alto, ancho = obra.shape[:2]
+    sw = ancho * rng.uniform(*encuadre)
+    sh = min(alto, sw * ALTO_FOTO / ANCHO_FOTO)
+    sx, sy = rng.uniform(0, ancho - sw), rng.uniform(0, alto - sh)
+    origen = np.float32([[sx, sy], [sx + sw, sy], [sx + sw, sy + sh], [sx, sy + sh]])
+    destino = np.float32([[0, 0], [ANCHO_FOTO, 0], [ANCHO_FOTO, ALTO_FOTO], [0, ALTO_FOTO]])
+    destino += _perspectiva(rng, ANCHO_FOTO, ALTO_FOTO, 0.08)
+    matriz = cv2.getPerspectiveTransform(origen, destino)
+    if rotacion_max:
+        # Celular inclinado: rotación en el plano alrededor del centro de la foto
+        giro = cv2.getRotationMatrix2D((ANCHO_FOTO / 2, ALTO_FOTO / 2), rng.uniform(-rotacion_max, rotacion_max), 1)
+        matriz = np.vstack([giro, [0, 0, 1]]) @ matriz
+
+    fondo = np.full((ALTO_FOTO, ANCHO_FOTO, 3), rng.integers(90, 200), np.uint8)
+    foto = cv2.warpPerspective(obra, matriz, (ANCHO_FOTO, ALTO_FOTO), dst=fondo,
+                               borderMode=cv2.BORDER_TRANSPARENT)
+    return _degradar(foto, rng, reflejo)
+
+def foto_qr(qr, rng, rotacion_max=20.0):
+    # El código impreso en la ficha ocupa entre un cuarto y la mitad del ancho de la foto
+    lado = ANCHO_FOTO * rng.uniform(0.25, 0.5)
+    x0, y0 = rng.uniform(0, ANCHO_FOTO - lado), rng.uniform(0, ALTO_FOTO - lado)
+    alto, ancho = qr.shape[:2]
+    origen = np.float32([[0, 0], [ancho, 0], [ancho, alto], [0, alto]])
+    destino = np.float32([[x0, y0], [x0 + lado, y0], [x0 + lado, y0 + lado], [x0, y0 + lado]])
+    destino += _perspectiva(rng, lado, lado, 0.06)
+    matriz = cv2.getPerspectiveTransform(origen, destino)
+    giro = cv2.getRotationMatrix2D((x0 + lado / 2, y0 + lado / 2), rng.uniform(-rotacion_max, rotacion_max), 1)
+    matriz = np.vstack([giro, [0, 0, 1]]) @ matriz
+
+    fondo = np.full((ALTO_FOTO, ANCHO_FOTO, 3), rng.integers(90, 200), np.uint8)
+    foto = cv2.warpPerspective(qr, matriz, (ANCHO_FOTO, ALTO_FOTO), dst=fondo,
+                               borderMode=cv2.BORDER_TRANSPARENT)
+    return _degradar(foto, rng)
+
+def foto_ficha(texto, rng):
+    # Ficha clara con texto oscuro sobre una pared, fotografiada de frente con algo de perspectiva
+    lineas = texto.split("\n")
+    escala = rng.uniform(1.0, 1.6)
+    ficha = np.full((int(60 * escala * len(lineas) + 60), int(900 * escala * 0.9), 3), 235, np.uint8)
+    for i, linea in enumerate(lineas):
+        cv2.putText(ficha, linea, (30, int(30 + 55 * escala * (i + 0.8))), cv2.FONT_HERSHEY_SIMPLEX,
+                    escala, (25, 25, 25), max(2, int(2 * escala)), cv2.LINE_AA)
+
+    alto, ancho = ficha.shape[:2]
+    factor = min(ANCHO_FOTO * 0.8 / ancho, ALTO_FOTO * 0.6 / alto)
+    w, h = ancho * factor, alto * factor
+    x0, y0 = rng.uniform(0, ANCHO_FOTO - w), rng.uniform(0, ALTO_FOTO - h)
+    origen = np.float32([[0, 0], [ancho, 0], [ancho, alto], [0, alto]])
+    destino = np.float32([[x0, y0], [x0 + w, y0], [x0 + w, y0 + h], [x0, y0 + h]])
+    destino += _perspectiva(rng, w, h, 0.03)
+    matriz = cv2.getPerspectiveTransform(origen, destino)
+    fondo = np.full((ALTO_FOTO, ANCHO_FOTO, 3), rng.integers(60, 140), np.uint8)
+    foto = cv2.warpPerspective(ficha, matriz, (ANCHO_FOTO, ALTO_FOTO), dst=fondo,
+                               borderMode=cv2.BORDER_TRANSPARENT)
+    return _degradar(foto, rng)
+
+def foto_sin_obra(rng):
+    # Negativo: manchas de color suavizadas, sin ninguna obra de la galería
+    manchas = rng.integers(0, 256, (12, 16, 3), dtype=np.uint8)
+    foto = cv2.resize(manchas, (ANCHO_FOTO, ALTO_FOTO), interpolation=cv2.INTER_CUBIC)
+    return _degradar(foto, rng)
+
+def obra_ficticia(obras, rng, ancho=900):
+    # Obra de relleno para agrandar la galería: un recorte espejado y con otros colores de una obra real.
+    # Tiene textura de pintura pero no empareja con el original, porque ORB no es invariante al espejado
+    obra = obras[rng.integers(len(obras))]
+    alto, ancho_obra = obra.shape[:2]
+    w, h = (np.array([ancho_obra, alto]) * rng.uniform(0.4, 0.8, 2)).astype(int)
+    x, y = rng.integers(0, ancho_obra - w + 1), rng.integers(0, alto - h + 1)
+    recorte = cv2.flip(obra[y:y + h, x:x + w], int(rng.integers(2)))
+    hsv = cv2.cvtColor(recorte, cv2.COLOR_BGR2HSV)
+    hsv[..., 0] = (hsv[..., 0].astype(int) + rng.integers(30, 150)) % 180
+    recorte = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+    return cv2.resize(recorte, (ancho, int(h * ancho / w)), interpolation=cv2.INTER_AREA)
+
+def generar_consultas(carpeta, variantes, semilla, encuadre, **kwargs):
+    # [(archivo esperado, bytes JPEG)] con variantes fotos por obra, reproducible con la semilla
+    rng = np.random.default_rng(semilla)
+    consultas = []
+    for archivo, obra in imagenes(carpeta):
+        consultas.extend((archivo, foto_obra(obra, rng, encuadre, **kwargs)) for _ in range(variantes))
+    return consultas
+
+def imagenes(carpeta):
+    for archivo in sorted(os.listdir(carpeta)):
+        img = cv2.imread(os.path.join(carpeta, archivo))
+        if img is not None:
+            yield archivo, img
@@ -1,9 +1,10 @@
 import os
-import requests
-import uuid
+import signal
+import httpx
 from telegram import (BotCommand,Update, InputFile, ReplyKeyboardMarkup, KeyboardButton,  
                     ReplyKeyboardRemove,  InlineKeyboardButton, InlineKeyboardMarkup)
-from telegram.error import BadRequest
+from telegram.constants import ChatAction
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import (
     Application,
     ApplicationBuilder,
@@ -15,9 +16,18 @@ from telegram.ext import (
     CallbackQueryHandler
 )
 from text_utils import procesar_texto_imagen
-from image_utils import comparar_imagenes
+from galeria_utils import VigilanteGaleria
+from api_client import ClienteAPI
+from catalogo_utils import CatalogoObras, normalizar_uuid
+from duplicados_utils import CacheResultadosFotos, ResultadoFoto
+from envios_utils import CacheFileIds, enviar_con_cache
+from pool_utils import PoolProcesamiento, ColaLlenaError, inicializar_worker, comparar_en_worker
 from qr_utils import decode_qr
+from image_utils import EMPAREJADORES, huella_jpeg
+from metricas_utils import REGISTRO, Traza, iniciar_servidor_metricas
+from webhook_utils import ProcesadorPorChat, ejecutar_webhook
 from pathlib import Path
+import asyncio
 
 project_root = Path(__file__).resolve().parent
 
@@ -25,18 +35,222 @@ project_root = Path(__file__).resolve().parent
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 API_URL = os.getenv("API_BASE_URL") 
 API_KEY = os.getenv("API_KEY")
+API_KEY_NAME = os.getenv("API_KEY_NAME", "X-API-Key")
+TIMEOUT_API = float(os.getenv("TIMEOUT_API", "5"))
+MAX_CONEXIONES_API = int(os.getenv("MAX_CONEXIONES_API", "20"))
+REINTENTOS_API = int(os.getenv("REINTENTOS_API", "2"))
+CACHE_API_MAX = int(os.getenv("CACHE_API_MAX", "256"))
+CACHE_API_TTL = float(os.getenv("CACHE_API_TTL", "300"))
 CARPETA_IMAGENES = "./cuadros"
-CARPETA_TEMP = "temporal"
+RUTA_INDICE = os.getenv("RUTA_INDICE", "indice_cuadros.idx")
+# Cada cuántos segundos se revisa CARPETA_IMAGENES para reindexar obras nuevas, cambiadas o quitadas
+# (0 lo desactiva; SIGHUP o /recargar fuerzan una revisión)
+INTERVALO_GALERIA = float(os.getenv("INTERVALO_GALERIA", "60"))
+# IDs de usuario de Telegram que pueden usar los comandos de administración, separados por coma
+ADMINISTRADORES = {int(i) for i in os.getenv("ADMINISTRADORES", "").split(",") if i.strip()}
+RUTA_FILE_IDS = os.getenv("RUTA_FILE_IDS", "file_ids.json")
+# Instantánea local de obras y medios: resuelve los QR sin ir a la API y se refresca cada INTERVALO_CATALOGO s
+RUTA_CATALOGO = os.getenv("RUTA_CATALOGO", "catalogo.json")
+INTERVALO_CATALOGO = float(os.getenv("INTERVALO_CATALOGO", "300"))
+# Tamaño del vocabulario visual (ramas ** niveles palabras); sin definir se dimensiona según la galería
+RAMAS_VOCABULARIO = int(os.getenv("RAMAS_VOCABULARIO", "0")) or None
+NIVELES_VOCABULARIO = int(os.getenv("NIVELES_VOCABULARIO", "0")) or None
+# Obras por puntuación (coseno y cobertura) cuyos tiles pasan a la verificación geométrica: como mínimo
+# TOP_K_CANDIDATOS y una más por cada OBRAS_POR_CANDIDATO obras de la galería (0 deja el mínimo fijo)
+TOP_K_CANDIDATOS = int(os.getenv("TOP_K_CANDIDATOS", "3"))
+OBRAS_POR_CANDIDATO = int(os.getenv("OBRAS_POR_CANDIDATO", "30"))
+SALIDA_TEMPRANA = os.getenv("SALIDA_TEMPRANA", "1") == "1"
+MARGEN_UMBRAL = float(os.getenv("MARGEN_UMBRAL", "2.0"))
+MARGEN_SEGUNDO = float(os.getenv("MARGEN_SEGUNDO", "2.0"))
+# Motor de OCR: "auto" (tesserocr si está instalado), "tesserocr" o "pytesseract"
+MOTOR_OCR = os.getenv("MOTOR_OCR", "auto")
+RUTA_TESSDATA = os.getenv("RUTA_TESSDATA") or None
+# Anchos de trabajo de la pirámide de búsqueda, de menor a mayor (0 = resolución original).
+# Se compara primero en el más bajo y solo se refina en el siguiente si el resultado es dudoso
+RESOLUCIONES_INDICE = tuple(int(a) for a in os.getenv("RESOLUCIONES_INDICE", "0").split(","))
 FILAS = 4
 COLUMNAS = 4
+WORKERS_PROCESAMIENTO = int(os.getenv("WORKERS_PROCESAMIENTO", str(os.cpu_count() or 1)))
+MAX_COLA_PROCESAMIENTO = int(os.getenv("MAX_COLA_PROCESAMIENTO", "8"))
+TIMEOUT_PROCESAMIENTO = float(os.getenv("TIMEOUT_PROCESAMIENTO", "30"))
+# Hilos por consulta para verificar tiles en paralelo; por defecto reparte los núcleos entre los workers
+HILOS_MATCHING = int(os.getenv("HILOS_MATCHING", str(max(1, (os.cpu_count() or 1) // WORKERS_PROCESAMIENTO))))
+# Emparejador de descriptores: "fuerza_bruta" (exacto), "flann_lsh" (LSH por tile) o "global" (un índice LSH
+# con todas las obras). Ver python -m benchmarks.emparejadores para elegir según recall y latencia
+EMPAREJADOR = os.getenv("EMPAREJADOR", "fuerza_bruta")
+PARAMETROS_EMPAREJADOR = {
+    "tablas": int(os.getenv("LSH_TABLAS", "6")),
+    "bits_clave": int(os.getenv("LSH_BITS_CLAVE", "12")),
+    "sondeo": int(os.getenv("LSH_SONDEO", "1")),
+    "vecinos": int(os.getenv("VECINOS_GLOBAL", "8")),
+}
+
+# Endpoint /metrics en formato Prometheus (0 lo desactiva); por defecto solo escucha en localhost
+PUERTO_METRICAS = int(os.getenv("PUERTO_METRICAS", "9101"))
+HOST_METRICAS = os.getenv("HOST_METRICAS", "127.0.0.1")
+# Peticiones más lentas que esto (segundos) se registran con el desglose de sus etapas
+UMBRAL_PETICION_LENTA = float(os.getenv("UMBRAL_PETICION_LENTA", "10"))
+
+# Caché de resultados por file_unique_id y huella perceptual de la foto (CACHE_FOTOS_MAX=0 la desactiva)
+CACHE_FOTOS_MAX = int(os.getenv("CACHE_FOTOS_MAX", "512"))
+CACHE_FOTOS_MB = float(os.getenv("CACHE_FOTOS_MB", "64"))
+UMBRAL_HUELLA = int(os.getenv("UMBRAL_HUELLA", "4"))
+# Modo de ejecución: "polling" (desarrollo) o "webhook" (producción, servidor ASGI propio)
+MODO_BOT = os.getenv("MODO_BOT", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # URL pública HTTPS que Telegram alcanza, p. ej. https://bot.museo.cl
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PUERTO = int(os.getenv("WEBHOOK_PUERTO", "8443"))
+WEBHOOK_RUTA = os.getenv("WEBHOOK_RUTA", "/telegram")
+WEBHOOK_SECRETO = os.getenv("WEBHOOK_SECRETO") or None
+# Actualizaciones atendidas a la vez (en orden dentro de cada chat); 1 equivale al procesamiento secuencial
+MAX_ACTUALIZACIONES_CONCURRENTES = int(os.getenv("MAX_ACTUALIZACIONES_CONCURRENTES", "32"))
+
+MENSAJE_OCUPADO = "🚦 Estoy atendiendo a muchos visitantes en este momento, intenta de nuevo en unos segundos."
+MENSAJE_TIMEOUT = "⌛ El análisis tardó demasiado, intenta con otra foto."
 
 # Estados para la conversación
 WAITING_PHOTO, CHOOSING_OPTION, WAITING_QR_PHOTO = range(3)
 
-# Asegura que la carpeta temporal exista
-os.makedirs(CARPETA_TEMP, exist_ok=True)
+# file_id de Telegram de las imágenes y medios ya subidos
+cache_file_ids = CacheFileIds(RUTA_FILE_IDS, project_root)
+
+# Pool de procesos para OCR, comparación de imágenes y QR, se crea al arrancar el bot
+pool_procesamiento = None
+# Cliente HTTP compartido para la API, se crea al arrancar y se cierra al apagar el bot
+cliente_api = None
+# Catálogo de obras en memoria y su tarea de sincronización periódica
+catalogo = None
+tarea_catalogo = None
+# Índice de referencias de la galería y su tarea de revisión periódica
+vigilante_galeria = None
+tarea_galeria = None
+servidor_metricas = None
+# Resultados de fotos ya analizadas, para responder al instante a reenvíos y fotos casi idénticas
+cache_resultados = CacheResultadosFotos(
+    CACHE_FOTOS_MAX, int(CACHE_FOTOS_MB * 1024 * 1024), UMBRAL_HUELLA
+) if CACHE_FOTOS_MAX > 0 else None
+# Reparte las actualizaciones entre chats en paralelo manteniendo el orden de cada chat
+procesador_actualizaciones = ProcesadorPorChat(MAX_ACTUALIZACIONES_CONCURRENTES)
+
+# Métricas del bot
+etapas_segundos = REGISTRO.histograma(
+    "museo_bot_etapa_segundos", "Duración de cada etapa de atención", ("flujo", "etapa"))
+peticiones_segundos = REGISTRO.histograma(
+    "museo_bot_peticion_segundos", "Duración total de cada petición por resultado", ("flujo", "resultado"))
+inliers_comparacion = REGISTRO.histograma(
+    "museo_bot_inliers", "Inliers de la mejor obra en cada comparación", ("coincidencia",),
+    buckets=(10, 20, 30, 45, 60, 90, 120, 180, 250, 400))
+tiles_verificados = REGISTRO.histograma(
+    "museo_bot_tiles_verificados", "Tiles verificados con RANSAC por comparación", (),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+salidas_tempranas = REGISTRO.contador(
+    "museo_bot_salidas_tempranas_total", "Comparaciones resueltas por salida temprana")
+REGISTRO.medidor(
+    "museo_bot_cola_procesamiento", "Trabajos en curso o en espera en el pool de procesamiento",
+    funcion=lambda: pool_procesamiento.pendientes if pool_procesamiento else 0)
+REGISTRO.contador(
+    "museo_bot_cache_api_total", "Consultas a la caché del cliente de la API", ("cache", "resultado"),
+    funcion=lambda: {
+        (cache, resultado): estadisticas[resultado]
+        for cache, estadisticas in (cliente_api.estadisticas_cache() if cliente_api else {}).items()
+        for resultado in ("aciertos", "fallos", "compartidas")
+    })
+
+REGISTRO.medidor(
+    "museo_bot_actualizaciones_en_curso", "Actualizaciones de Telegram procesándose en este momento",
+    funcion=lambda: procesador_actualizaciones.current_concurrent_updates)
+REGISTRO.medidor(
+    "museo_bot_chats_activos", "Chats con actualizaciones en curso o en espera",
+    funcion=lambda: procesador_actualizaciones.chats_activos)
+
+REGISTRO.medidor(
+    "museo_bot_catalogo_obras", "Obras en la instantánea local del catálogo",
+    funcion=lambda: len(catalogo) if catalogo is not None else 0)
+REGISTRO.medidor(
+    "museo_bot_catalogo_antiguedad_segundos", "Segundos desde la última sincronización correcta del catálogo",
+    funcion=lambda: (catalogo.antiguedad or 0) if catalogo is not None else 0)
+REGISTRO.contador(
+    "museo_bot_catalogo_resoluciones_total", "Obras y medios resueltos por origen", ("origen",),
+    funcion=lambda: {"local": catalogo.resueltas_local, "api": catalogo.resueltas_api} if catalogo is not None else {})
+
+REGISTRO.medidor(
+    "museo_bot_galeria_obras", "Obras en el índice de referencias publicado",
+    funcion=lambda: len(vigilante_galeria) if vigilante_galeria is not None else 0)
+REGISTRO.medidor(
+    "museo_bot_galeria_generacion", "Generación del índice de referencias (sube con cada cambio de la galería)",
+    funcion=lambda: vigilante_galeria.generacion.value if vigilante_galeria is not None else 0)
+
+REGISTRO.contador(
+    "museo_bot_cache_fotos_total", "Búsquedas en la caché de resultados de fotos", ("resultado",),
+    funcion=lambda: {
+        "acierto_file_id": cache_resultados.aciertos_file_id,
+        "acierto_huella": cache_resultados.aciertos_huella,
+        "fallo": cache_resultados.fallos,
+    } if cache_resultados is not None else {})
+REGISTRO.medidor(
+    "museo_bot_cache_fotos_bytes", "Memoria estimada de la caché de resultados de fotos",
+    funcion=lambda: cache_resultados.bytes if cache_resultados is not None else 0)
+
+def nueva_traza(flujo):
+    return Traza(flujo, etapas_segundos, peticiones_segundos, UMBRAL_PETICION_LENTA)
+
+def registrar_comparacion(traza, resultado):
+    traza.registrar("comparacion_cpu", resultado.segundos)
+    inliers_comparacion.observar(resultado.inliers, coincidencia=str(resultado.coincidencia is not None).lower())
+    tiles_verificados.observar(resultado.tiles_verificados)
+    if resultado.salida_temprana:
+        salidas_tempranas.inc()
+    traza.datos.update(inliers=resultado.inliers, tiles_verificados=resultado.tiles_verificados)
+
+def galeria_cambiada():
+    # Los resultados guardados pueden apuntar a obras quitadas o no conocer las nuevas
+    if cache_resultados is not None:
+        cache_resultados.limpiar()
 
 async def post_init(app: Application) -> None:
+    global pool_procesamiento, cliente_api, catalogo, tarea_catalogo, servidor_metricas
+    global vigilante_galeria, tarea_galeria
+    cliente_api = ClienteAPI(
+        API_URL, API_KEY, API_KEY_NAME, timeout=TIMEOUT_API,
+        max_conexiones=MAX_CONEXIONES_API, reintentos=REINTENTOS_API,
+        cache_max=CACHE_API_MAX, cache_ttl=CACHE_API_TTL
+    )
+    # Se parte de la instantánea guardada y se revalida con la API; si la API no responde el bot
+    # arranca igual con lo que haya en disco
+    catalogo = CatalogoObras(cliente_api, RUTA_CATALOGO)
+    catalogo.cargar()
+    try:
+        await catalogo.sincronizar()
+    except Exception as e:
+        print(f"No se pudo sincronizar el catálogo al iniciar ({len(catalogo)} obras en disco): {e!r}")
+    if INTERVALO_CATALOGO > 0:
+        tarea_catalogo = asyncio.create_task(catalogo.sincronizar_periodicamente(INTERVALO_CATALOGO))
+    # El índice se construye o actualiza aquí; los workers solo lo cargan desde disco y lo recargan
+    # cuando el vigilante publica una generación nueva
+    vigilante_galeria = VigilanteGaleria(
+        CARPETA_IMAGENES, RUTA_INDICE, filas=FILAS, columnas=COLUMNAS,
+        ramas_vocabulario=RAMAS_VOCABULARIO, niveles_vocabulario=NIVELES_VOCABULARIO,
+        resoluciones=RESOLUCIONES_INDICE
+    )
+    await vigilante_galeria.actualizar()
+    pool_procesamiento = PoolProcesamiento(
+        WORKERS_PROCESAMIENTO, MAX_COLA_PROCESAMIENTO, TIMEOUT_PROCESAMIENTO,
+        inicializador=inicializar_worker,
+        initargs=(RUTA_INDICE, RESOLUCIONES_INDICE, MOTOR_OCR, RUTA_TESSDATA, EMPAREJADOR, PARAMETROS_EMPAREJADOR,
+                  vigilante_galeria.generacion)
+    )
+    if INTERVALO_GALERIA > 0:
+        tarea_galeria = asyncio.create_task(
+            vigilante_galeria.vigilar_periodicamente(INTERVALO_GALERIA, galeria_cambiada))
+    if hasattr(signal, "SIGHUP"):
+        # kill -HUP <pid> reindexa sin reiniciar; no existe en Windows
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGHUP,
+            lambda: app.create_task(vigilante_galeria.actualizar_y_avisar(galeria_cambiada, forzar=True)))
+
+    if PUERTO_METRICAS:
+        servidor_metricas = iniciar_servidor_metricas(PUERTO_METRICAS, HOST_METRICAS)
+
     comandos = [
             BotCommand("iniciar", "Iniciar el bot"),
             BotCommand("ayuda", "Mostrar ayuda"),
@@ -45,6 +259,20 @@ async def post_init(app: Application) -> None:
         ]
     await app.bot.set_my_commands(comandos)
 
+async def post_shutdown(app: Application) -> None:
+    if tarea_catalogo:
+        tarea_catalogo.cancel()
+    if tarea_galeria:
+        tarea_galeria.cancel()
+    if hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+    if pool_procesamiento:
+        pool_procesamiento.cerrar()
+    if cliente_api:
+        await cliente_api.cerrar()
+    if servidor_metricas:
+        servidor_metricas.shutdown()
+
 def get_main_keyboard():
     return ReplyKeyboardMarkup([
         [KeyboardButton("📸 Analizar obra"), KeyboardButton("ℹ️ Información")],
@@ -129,100 +357,282 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     return CHOOSING_OPTION
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    cancelar_analisis(context)
     await update.message.reply_text(
         "Gracias por usar el bot del museo. ¡Vuelve cuando quieras!",
         reply_markup=ReplyKeyboardRemove()
     )
     return ConversationHandler.END
 
+async def recargar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Comando de administración: reindexa la galería ahora, sin esperar a la próxima revisión periódica
+    if update.effective_user is None or update.effective_user.id not in ADMINISTRADORES:
+        return
+    await update.message.reply_text("🔄 Revisando la galería...")
+    cambios = await vigilante_galeria.actualizar_y_avisar(galeria_cambiada, forzar=True)
+    if cambios is None:
+        await update.message.reply_text("⚠️ No se pudo actualizar el índice, se mantiene el anterior.")
+        return
+    añadidas, actualizadas, eliminadas = cambios
+    await update.message.reply_text(
+        f"✅ Índice al día: {len(vigilante_galeria)} obras "
+        f"(+{len(añadidas)} ~{len(actualizadas)} -{len(eliminadas)}, "
+        f"generación {vigilante_galeria.generacion.value})"
+    )
+
+def cancelar_analisis(context: ContextTypes.DEFAULT_TYPE) -> bool:
+    # Cancela el análisis de foto en curso del chat, si lo hay. Los trabajos aún en la cola del pool
+    # se descartan; uno que ya está corriendo en un worker termina, pero su resultado se ignora
+    tarea = context.chat_data.pop("analisis", None)
+    if tarea and not tarea.done():
+        tarea.cancel()
+        return True
+    return False
+
+class AccionChat:
+    """Acción de chat ("escribiendo...", "enviando foto...") visible mientras dura un análisis.
+
+    Telegram la muestra unos 5 s, así que se repite hasta cancelar(); cambiar() la reemplaza de inmediato
+    en el mismo bucle, que si no la volvería a pisar con la anterior en la siguiente repetición.
+    """
+
+    def __init__(self, bot, chat_id, accion, intervalo=4.5):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.accion = accion
+        self.intervalo = intervalo
+        self._cambio = asyncio.Event()
+        self._tarea = asyncio.create_task(self._mantener())
+
+    def cambiar(self, accion):
+        if accion != self.accion:
+            self.accion = accion
+            self._cambio.set()
+
+    def cancelar(self):
+        self._tarea.cancel()
+
+    async def _mantener(self):
+        while True:
+            self._cambio.clear()
+            try:
+                await self.bot.send_chat_action(self.chat_id, self.accion)
+            except TelegramError:
+                pass
+            try:
+                await asyncio.wait_for(self._cambio.wait(), self.intervalo)
+            except (TimeoutError, asyncio.TimeoutError):
+                pass
+
 async def procesar_imagen(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message.photo:
         await update.message.reply_text("Por favor, envíame una foto.")
         return
 
-    # Obtener la imagen
-    foto = update.message.photo[-1]
-    file = await context.bot.get_file(foto.file_id)
-    image_bytes = await file.download_as_bytearray()
-
-    # ---- OCR ----
+    # El análisis corre en segundo plano para que /cancelar o una foto nueva se atiendan mientras tanto;
+    # una foto nueva reemplaza al análisis anterior del mismo chat
+    cancelar_analisis(context)
+    context.chat_data["analisis"] = context.application.create_task(analizar_foto(update, context), update=update)
+
+async def analizar_foto(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    traza = nueva_traza("imagen")
+    estado = "error"
+    accion = AccionChat(context.bot, update.effective_chat.id, ChatAction.TYPING)
+    avisos = set()
+    etapas = []
     try:
-        extracted_text, image_with_boxes = procesar_texto_imagen(image_bytes)
-    except Exception as e:
-        await update.message.reply_text(f"Error procesando OCR: {e}")
-        return
+        foto = update.message.photo[-1]
+        # Un reenvío conserva el file_unique_id: se responde sin descargar ni procesar la foto
+        en_cache = cache_resultados.por_file_id(foto.file_unique_id) if cache_resultados is not None else None
+        if en_cache:
+            estado = "cache"
+            traza.datos["cache"] = "file_id"
+            with traza.tramo("envio"):
+                await responder_desde_cache(update, en_cache)
+            return
 
-    
-    if extracted_text.strip():
-    # Enviar imagen con recuadros + texto
-        #print(extracted_text)
-        await update.message.reply_photo(
-            photo=InputFile(image_with_boxes),
-            caption="Texto detectado:\n" + (extracted_text or "No se detectó texto.")
-        )
-    else:
-        #print("No se encontro un texto en la imagen.")
-        await update.message.reply_text("No se encontro un texto en la imagen.")
+        # Obtener la imagen
+        with traza.tramo("descarga"):
+            file = await context.bot.get_file(foto.file_id)
+            image_bytes = await file.download_as_bytearray()
 
-    # ---- Comparación de imagen ----
-    # Guardar temporalmente la imagen descargada
-    nuevo_nombre = f"{uuid.uuid4().hex}.jpg"
-    ruta_archivo = os.path.join(CARPETA_TEMP, nuevo_nombre)
-    with open(ruta_archivo, "wb") as f:
-        f.write(image_bytes)
+        # La foto viaja a cada etapa como JPEG y se decodifica dentro de su worker (los píxeles pesan ~20 veces
+        # más que el JPEG). Aquí solo se calcula la huella con una decodificación a 1/8, que además valida la foto
+        datos = bytes(image_bytes)
+        try:
+            with traza.tramo("huella"):
+                huella = await asyncio.to_thread(huella_jpeg, datos)
+        except ValueError:
+            estado = "imagen_invalida"
+            await update.message.reply_text("No pude leer la imagen, ¿podrías enviarla de nuevo?")
+            return
 
-    # Ejecutar la comparación
-    resultado = comparar_imagenes(ruta_archivo, CARPETA_IMAGENES, filas=FILAS, columnas=COLUMNAS)
+        # Foto casi idéntica a una ya analizada (otra subida de la misma foto, recomprimida o reescalada)
+        en_cache = cache_resultados.por_huella(huella, foto.file_unique_id) if cache_resultados is not None else None
+        if en_cache:
+            estado = "cache"
+            traza.datos["cache"] = "huella"
+            with traza.tramo("envio"):
+                await responder_desde_cache(update, en_cache)
+            return
 
-    if resultado:
-        nombre_archivo = resultado
+        # OCR y comparación son independientes: corren en paralelo y cada una responde apenas termina
+        salida = {}
+        etapas = [
+            asyncio.create_task(etapa_ocr(update, traza, datos, avisos, salida, accion)),
+            asyncio.create_task(etapa_comparacion(update, traza, datos, avisos, salida)),
+        ]
+        # Un error inesperado en una etapa (p. ej. al enviar su respuesta) no interrumpe a la otra
+        ocr, comparacion = await asyncio.gather(*etapas, return_exceptions=True)
+        estado = comparacion if isinstance(comparacion, str) else "error"
+        for error in (ocr, comparacion):
+            if isinstance(error, Exception):
+                raise error
+        # Solo se guardan análisis completos; un timeout o un pool lleno no deben quedar en caché
+        if cache_resultados is not None and ocr == "ok" and comparacion in ("coincidencia", "sin_coincidencia"):
+            cache_resultados.guardar(huella, ResultadoFoto(**salida), foto.file_unique_id)
+    except asyncio.CancelledError:
+        estado = "cancelado"
+        raise
+    finally:
+        accion.cancelar()
+        for etapa in etapas:
+            etapa.cancel()
+        if context.chat_data.get("analisis") is asyncio.current_task():
+            del context.chat_data["analisis"]
+        traza.finalizar(estado)
+
+async def avisar_una_vez(update, avisos, mensaje):
+    # Si las dos etapas fallan por el mismo motivo (pool lleno, timeout) el visitante recibe un solo aviso
+    if mensaje not in avisos:
+        avisos.add(mensaje)
+        await update.message.reply_text(mensaje)
+
+async def responder_ocr(update, texto, imagen):
+    # imagen: bytes de la foto con recuadros, file_id de una ya enviada o None para responder solo con el
+    # texto; devuelve el file_id enviado
+    if texto.strip() and imagen is None:
+        await update.message.reply_text("Texto detectado:\n" + texto)
+        return None
+    if texto.strip():
+        # Enviar imagen con recuadros + texto
+        mensaje = await update.message.reply_photo(
+            photo=InputFile(imagen) if isinstance(imagen, (bytes, bytearray)) else imagen,
+            caption="Texto detectado:\n" + texto
+        )
+        return mensaje.photo[-1].file_id if mensaje.photo else None
+    #print("No se encontro un texto en la imagen.")
+    await update.message.reply_text("No se encontro un texto en la imagen.")
+    return None
+
+async def responder_comparacion(update, coincidencia):
+    if coincidencia:
+        nombre_archivo = coincidencia
         await update.message.reply_text(
             f"Obra identificada: *{nombre_archivo}*",
             parse_mode="Markdown"
         )
-    else:
-        await update.message.reply_text("No encontre una coincidencia, me podrias proporcionar otra foto con mejor claridad.")
+        return "coincidencia"
+    await update.message.reply_text("No encontre una coincidencia, me podrias proporcionar otra foto con mejor claridad.")
+    return "sin_coincidencia"
 
-    # Limpiar la imagen temporal
-    os.remove(ruta_archivo)
+async def responder_desde_cache(update, resultado):
+    await responder_ocr(update, resultado.texto, resultado.imagen_para(update.effective_chat.id))
+    await responder_comparacion(update, resultado.coincidencia)
+
+async def etapa_ocr(update, traza, datos, avisos, salida, accion):
+    try:
+        with traza.tramo("ocr"):
+            extracted_text, image_with_boxes = await pool_procesamiento.ejecutar(procesar_texto_imagen, datos)
+    except ColaLlenaError:
+        await avisar_una_vez(update, avisos, MENSAJE_OCUPADO)
+        return "ocupado"
+    except TimeoutError:
+        await avisar_una_vez(update, avisos, MENSAJE_TIMEOUT)
+        return "timeout"
+    except Exception as e:
+        await update.message.reply_text(f"Error procesando OCR: {e}")
+        return "error"
+
+    with traza.tramo("envio_ocr"):
+        if extracted_text.strip():
+            accion.cambiar(ChatAction.UPLOAD_PHOTO)
+        file_id = await responder_ocr(update, extracted_text, image_with_boxes)
+    # La comparación puede seguir en curso
+    accion.cambiar(ChatAction.TYPING)
+    # En caché se guarda el file_id de la foto ya subida en lugar de sus bytes
+    salida.update(texto=extracted_text, imagen_ocr=file_id or (image_with_boxes if extracted_text.strip() else None),
+                  chat_id=update.effective_chat.id)
+    return "ok"
+
+async def etapa_comparacion(update, traza, datos, avisos, salida):
+    try:
+        with traza.tramo("comparacion"):
+            resultado = await pool_procesamiento.ejecutar(
+                comparar_en_worker, datos, top_k=TOP_K_CANDIDATOS, obras_por_candidato=OBRAS_POR_CANDIDATO,
+                salida_temprana=SALIDA_TEMPRANA,
+                margen_umbral=MARGEN_UMBRAL, margen_segundo=MARGEN_SEGUNDO, hilos=HILOS_MATCHING
+            )
+    except ColaLlenaError:
+        await avisar_una_vez(update, avisos, MENSAJE_OCUPADO)
+        return "ocupado"
+    except TimeoutError:
+        await avisar_una_vez(update, avisos, MENSAJE_TIMEOUT)
+        return "timeout"
+    except Exception as e:
+        await update.message.reply_text(f"Error comparando la imagen: {e}")
+        return "error"
+    registrar_comparacion(traza, resultado)
+    salida.update(coincidencia=resultado.coincidencia, inliers=resultado.inliers)
+
+    with traza.tramo("envio"):
+        return await responder_comparacion(update, resultado.coincidencia)
 
 
 async def procesar_qr(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    traza = nueva_traza("qr")
+    estado = "error"
     try:
         if not update.message.photo:
+            estado = "sin_foto"
             await update.message.reply_text("Por favor, envíame una foto con el código QR.")
             return
         
         # Descargar imagen
-        foto = update.message.photo[-1]
-        file = await context.bot.get_file(foto.file_id)
-        image_bytes = await file.download_as_bytearray()
-        
-        # Guardar temporalmente
-        nombre_temp = f"{uuid.uuid4().hex}_qr.jpg"
-        ruta_temp = os.path.join(CARPETA_TEMP, nombre_temp)
-        with open(ruta_temp, "wb") as f:
-            f.write(image_bytes)
+        with traza.tramo("descarga"):
+            foto = update.message.photo[-1]
+            file = await context.bot.get_file(foto.file_id)
+            image_bytes = await file.download_as_bytearray()
             
-        # Procesar QR
-        resultado = decode_qr(ruta_temp)
+        # Procesar QR (la imagen se decodifica en memoria dentro del worker)
+        try:
+            with traza.tramo("qr"):
+                resultado = await pool_procesamiento.ejecutar(decode_qr, bytes(image_bytes))
+        except ColaLlenaError:
+            estado = "ocupado"
+            await update.message.reply_text(MENSAJE_OCUPADO)
+            return
+        except TimeoutError:
+            estado = "timeout"
+            await update.message.reply_text(MENSAJE_TIMEOUT)
+            return
         
         if resultado:
             decoded_info, _ = resultado  
-            obra_uuid = decoded_info
-            
-            # Headers con API Key
-            headers = {"X-API-Key": os.getenv("API_KEY")}
+            obra_uuid = normalizar_uuid(decoded_info)
+            if obra_uuid is None:
+                # QR ajeno a la galería: la API lo rechazaría con 422, no vale la pena consultarla
+                estado = "qr_invalido"
+                await update.message.reply_text("❌ Obra no encontrada")
+                return
             
             try:
-                # Consultar obra
-                response_obra = requests.get(
-                    f"{API_URL}/obras/{obra_uuid}",
-                    headers=headers
-                )
-                response_obra.raise_for_status()
+                # Consultar obra (en la instantánea local; la API solo si aún no está en ella)
+                with traza.tramo("catalogo"):
+                    obra_data, _ = await catalogo.obtener_obra_completa(obra_uuid)
                 
-            except requests.exceptions.HTTPError as e:
+            except httpx.HTTPStatusError as e:
+                estado = f"http_{e.response.status_code}"
                 error_msg = (
                     "🔐 Error de autenticación con la API" if e.response.status_code == 401 else
                     "❌ Obra no encontrada" if e.response.status_code == 404 else
@@ -231,7 +641,6 @@ async def procesar_qr(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text(error_msg)
                 return
             
-            obra_data = response_obra.json()
             #print(obra_data)
             # Validar nombre_archivo
             nombre_archivo = obra_data.get("nombre_archivo")
@@ -259,23 +668,24 @@ async def procesar_qr(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             # Enviar imagen de la obra
             try:
-                with open(ruta_imagen, "rb") as img_file:
-                    await context.bot.send_photo(
+                with traza.tramo("envio"):
+                    await enviar_con_cache(
+                        cache_file_ids, context.bot.send_photo, ruta_imagen, "photo",
                         chat_id=update.effective_chat.id,
-                        photo=InputFile(img_file),
                         caption=texto_info,
                         parse_mode="Markdown",
                         reply_markup=get_media_keyboard()
                     )
+                estado = "ok"
             except FileNotFoundError:
                 await update.message.reply_text("⚠️ Error al cargar la imagen")
             context.user_data["qr_data"] = {"obra_uuid": obra_uuid,"reply":False}
+        else:
+            estado = "sin_qr"
     except Exception as e:
         await update.message.reply_text(f"🚨 Error crítico: {str(e)}")
-        
     finally:
-        if os.path.exists(ruta_temp):
-            os.remove(ruta_temp)
+        traza.finalizar(estado)
             
     return ConversationHandler.END
 
@@ -317,16 +727,17 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     
     if action in {"audio", "video", "imagen", "texto"}:
-        headers = {"X-API-Key": os.getenv("API_KEY")}
+        traza = nueva_traza(f"boton_{action}")
+        estado = "error"
         try:
-            response = requests.get(f"{API_URL}/medios/{obra_uuid}", headers=headers)
-            response.raise_for_status()
-            medios_data = response.json()
+            with traza.tramo("catalogo"):
+                medios_data = await catalogo.obtener_medios(obra_uuid)
             #print(f"medios_data: {medios_data}")
             medio = next((m for m in medios_data if m["tipo_medio"] == action), None)
             
             if not medio:
                 #print("qr_data =", context.user_data["qr_data"])
+                estado = "sin_medio"
                 await query.edit_message_reply_markup(reply_markup=None)
                 if not context.user_data["qr_data"]["reply"]:
                     await query.message.reply_text(
@@ -343,38 +754,41 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             context.user_data["qr_data"]["reply"] = False
             data_media = next((medio for medio in medios_data if medio.get("tipo_medio") == action))
             await query.edit_message_reply_markup(reply_markup=None)
-            if action == "audio":
-                ruta = f"{project_root}{data_media['ruta_local']}"
-                await context.bot.send_audio(
-                    chat_id=query.message.chat.id,
-                    audio=open(ruta,'rb'),
-                    caption=f"🎧 {medio.get('descripcion', 'Audio descriptivo')}",
-                    reply_markup=media_back
-                )
-            elif action == "video":
-                ruta = f"{project_root}{data_media['ruta_local']}"
-                #print(f"\nruta del video: {project_root}")
-                await context.bot.send_video(
-                    chat_id=query.message.chat.id,
-                    video=open(ruta,'rb'),
-                    caption=f"🎥 {medio.get('descripcion', 'Video explicativo')}",
-                    reply_markup=media_back
-                )
-            elif action == "imagen":
-                ruta = f"{project_root}{data_media['ruta_local']}"
-                await context.bot.send_photo(
-                    chat_id=query.message.chat.id,
-                    photo=InputFile(medio["ruta_local"]),
-                    caption=f"🖼️ {medio.get('descripcion', 'Imagen adicional')}",
-                    reply_markup=media_back
-                )
-            elif action == "texto":
-                await context.bot.send_message(
-                    chat_id=query.message.chat.id,
-                    text= data_media["info"],
-                    reply_markup=media_back
-                )
-        except requests.exceptions.HTTPError as e:
+            with traza.tramo("envio"):
+                if action == "audio":
+                    ruta = f"{project_root}{data_media['ruta_local']}"
+                    await enviar_con_cache(
+                        cache_file_ids, context.bot.send_audio, ruta, "audio",
+                        chat_id=query.message.chat.id,
+                        caption=f"🎧 {medio.get('descripcion', 'Audio descriptivo')}",
+                        reply_markup=media_back
+                    )
+                elif action == "video":
+                    ruta = f"{project_root}{data_media['ruta_local']}"
+                    #print(f"\nruta del video: {project_root}")
+                    await enviar_con_cache(
+                        cache_file_ids, context.bot.send_video, ruta, "video",
+                        chat_id=query.message.chat.id,
+                        caption=f"🎥 {medio.get('descripcion', 'Video explicativo')}",
+                        reply_markup=media_back
+                    )
+                elif action == "imagen":
+                    ruta = f"{project_root}{data_media['ruta_local']}"
+                    await enviar_con_cache(
+                        cache_file_ids, context.bot.send_photo, ruta, "photo",
+                        chat_id=query.message.chat.id,
+                        caption=f"🖼️ {medio.get('descripcion', 'Imagen adicional')}",
+                        reply_markup=media_back
+                    )
+                elif action == "texto":
+                    await context.bot.send_message(
+                        chat_id=query.message.chat.id,
+                        text= data_media["info"],
+                        reply_markup=media_back
+                    )
+            estado = "ok"
+        except httpx.HTTPStatusError as e:
+            estado = f"http_{e.response.status_code}"
             error_msg = "🔐 Error de autenticación" if e.response.status_code == 401 else "⚠️ Error en el servidor"
 
             try:
@@ -416,10 +830,22 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     text=msg_error,
                     reply_markup=media_back
                 )
+        finally:
+            traza.finalizar(estado)
 
 # Inicialización del bot
 if __name__ == "__main__":
-    app = ApplicationBuilder().token(BOT_TOKEN).post_init(post_init).build()
+    # Un emparejador inválido haría fallar el arranque de cada worker; mejor detenerse aquí
+    if EMPAREJADOR not in EMPAREJADORES:
+        raise SystemExit(f"EMPAREJADOR debe ser uno de: {', '.join(EMPAREJADORES)}")
+    builder = (
+        ApplicationBuilder().token(BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+        .concurrent_updates(procesador_actualizaciones)
+    )
+    if MODO_BOT == "webhook":
+        # Las actualizaciones llegan por el servidor del webhook, no hace falta el Updater de polling
+        builder = builder.updater(None)
+    app = builder.build()
     
     conv_handler = ConversationHandler(
     entry_points=[CommandHandler("iniciar", start)],
@@ -428,10 +854,14 @@ if __name__ == "__main__":
         MessageHandler(filters.TEXT & filters.Regex(r'^(📸 Analizar obra|⛶ Lector QR)$'), handle_menu)
     ],
     WAITING_PHOTO: [
+        # procesar_imagen solo lanza el análisis en segundo plano y vuelve enseguida, así el estado
+        # sigue siendo WAITING_PHOTO y /cancelar o una foto nueva se atienden durante el análisis
         MessageHandler(filters.PHOTO, procesar_imagen),
         CommandHandler("cancelar", cancel)
     ],
     WAITING_QR_PHOTO: [
+        # Bloqueante a propósito: con block=False el ConversationHandler queda pendiente mientras se lee el QR
+        # y descarta /cancelar o una foto nueva. Las actualizaciones de otros chats no esperan (ProcesadorPorChat)
         MessageHandler(filters.PHOTO, procesar_qr),
         CommandHandler("cancelar", cancel)
     ]},
@@ -440,8 +870,17 @@ if __name__ == "__main__":
     
     app.add_handler(conv_handler)
     app.add_handler(CommandHandler("ayuda", help))
+    app.add_handler(CommandHandler("recargar", recargar))
     app.add_handler(CallbackQueryHandler(button_handler))
     
     
     #print("🤖 Bot iniciado...")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
\ No newline at end of file
+    if MODO_BOT == "webhook":
+        if not WEBHOOK_URL:
+            raise SystemExit("MODO_BOT=webhook requiere WEBHOOK_URL")
+        asyncio.run(ejecutar_webhook(
+            app, WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PUERTO, WEBHOOK_RUTA, WEBHOOK_SECRETO,
+            max_conexiones=min(100, MAX_ACTUALIZACIONES_CONCURRENTES)
+        ))
+    else:
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
\ No newline at end of file
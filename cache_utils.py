@@ -0,0 +1,82 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class CacheTTL:
+    """Caché LRU acotada con expiración por entrada y de-duplicación de cargas concurrentes (single-flight)."""
+
+    def __init__(self, max_entradas=256, ttl=300.0):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()  # clave -> (expira_en, valor)
+        self._en_vuelo = {}          # clave -> asyncio.Future de la carga en curso
+        self.aciertos = 0
+        self.fallos = 0
+        self.compartidas = 0         # peticiones que esperaron la carga de otra
+
+    def __len__(self):
+        return len(self._datos)
+
+    def obtener(self, clave):
+        # Devuelve (encontrado, valor) sin contar estadísticas
+        entrada = self._datos.get(clave)
+        if entrada is None:
+            return False, None
+        expira_en, valor = entrada
+        if expira_en < time.monotonic():
+            del self._datos[clave]
+            return False, None
+        self._datos.move_to_end(clave)
+        return True, valor
+
+    def guardar(self, clave, valor):
+        self._datos[clave] = (time.monotonic() + self.ttl, valor)
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+
+    def invalidar(self, clave=None):
+        if clave is None:
+            self._datos.clear()
+        else:
+            self._datos.pop(clave, None)
+
+    async def obtener_o_cargar(self, clave, cargar):
+        # cargar es una función async sin argumentos; los errores no se guardan en la caché
+        encontrado, valor = self.obtener(clave)
+        if encontrado:
+            self.aciertos += 1
+            return valor
+
+        en_vuelo = self._en_vuelo.get(clave)
+        if en_vuelo is not None:
+            self.compartidas += 1
+            return await asyncio.shield(en_vuelo)
+
+        self.fallos += 1
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_vuelo[clave] = futuro
+        try:
+            valor = await cargar()
+        except BaseException as e:
+            if isinstance(e, Exception):
+                futuro.set_exception(e)
+                futuro.exception()  # evita el aviso de excepción no recuperada si nadie más esperaba
+            else:
+                futuro.cancel()
+            raise
+        else:
+            self.guardar(clave, valor)
+            futuro.set_result(valor)
+            return valor
+        finally:
+            del self._en_vuelo[clave]
+
+    def estadisticas(self):
+        return {
+            "entradas": len(self._datos),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "compartidas": self.compartidas,
+        }
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from api_client import MAX_LOTE_OBRAS
+
+# Versión del formato del archivo de instantánea; una versión distinta se ignora y se vuelve a descargar
+VERSION_CATALOGO = 1
+
+
+def normalizar_uuid(valor):
+    try:
+        return str(uuid.UUID(str(valor).strip()))
+    except ValueError:
+        return None
+
+
+class CatalogoObras:
+    """Instantánea en memoria de todas las obras y sus medios, persistida en disco.
+
+    Resuelve obras y medios sin ir a la red; la API solo se usa para refrescar la instantánea
+    (revalidando con ETag) y para las obras que todavía no están en ella. Las obras que faltan y se
+    piden a la vez se traen juntas con un solo POST /obras/batch. Si la API no responde se sigue
+    atendiendo con la última instantánea conocida.
+    """
+
+    def __init__(self, cliente_api, ruta):
+        self.cliente_api = cliente_api
+        self.ruta = ruta
+        self.etag = None
+        self.sincronizado_en = None  # time.time() de la última descarga o revalidación correcta
+        self._obras = {}   # uuid -> obra sin medios
+        self._medios = {}  # uuid -> lista de medios
+        self._pendientes = set()  # uuid que faltan en la instantánea y esperan la próxima precarga
+        self._lock_precarga = asyncio.Lock()
+        self.resueltas_local = 0
+        self.resueltas_api = 0
+
+    def __len__(self):
+        return len(self._obras)
+
+    def __contains__(self, obra_uuid):
+        return normalizar_uuid(obra_uuid) in self._obras
+
+    @property
+    def antiguedad(self):
+        return time.time() - self.sincronizado_en if self.sincronizado_en else None
+
+    def _reemplazar(self, obras, etag, sincronizado_en):
+        obras_nuevas, medios_nuevos = {}, {}
+        for obra in obras:
+            obra = dict(obra)
+            clave = normalizar_uuid(obra["uuid"])
+            medios_nuevos[clave] = obra.pop("medios", [])
+            obras_nuevas[clave] = obra
+        # Se cambian las referencias de una vez; las lecturas en curso ven la instantánea anterior completa
+        self._obras, self._medios = obras_nuevas, medios_nuevos
+        self.etag = etag
+        self.sincronizado_en = sincronizado_en
+
+    def cargar(self):
+        # Carga la instantánea guardada; devuelve False si no existe o no es de este formato
+        if not os.path.exists(self.ruta):
+            return False
+        try:
+            with open(self.ruta, encoding="utf-8") as f:
+                datos = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"No se pudo leer el catálogo guardado: {e}")
+            return False
+        if datos.get("version") != VERSION_CATALOGO:
+            return False
+        self._reemplazar(datos["obras"], datos.get("etag"), datos.get("sincronizado_en"))
+        print(f"Catálogo cargado de {self.ruta}: {len(self)} obras")
+        return True
+
+    def _persistir(self, obras):
+        ruta_tmp = f"{self.ruta}.tmp"
+        with open(ruta_tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": VERSION_CATALOGO,
+                "etag": self.etag,
+                "sincronizado_en": self.sincronizado_en,
+                "obras": obras,
+            }, f, ensure_ascii=False)
+        os.replace(ruta_tmp, self.ruta)
+
+    async def sincronizar(self):
+        # Devuelve True si el catálogo cambió; los errores (red, HTTP, JSON inválido, obras sin uuid) se
+        # propagan al llamador sin tocar la instantánea
+        obras, etag = await self.cliente_api.obtener_catalogo(self.etag if self._obras else None)
+        if obras is None:
+            self.sincronizado_en = time.time()
+            return False
+        self._reemplazar(obras, etag, time.time())
+        self._persistir(obras)
+        print(f"Catálogo sincronizado: {len(self)} obras")
+        return True
+
+    async def sincronizar_periodicamente(self, intervalo):
+        # Tarea de fondo: refresca cada intervalo segundos y sigue con la instantánea actual si falla
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                await self.sincronizar()
+            except Exception as e:
+                # Además de red y disco: respuestas que no son JSON u obras sin uuid no deben matar la tarea
+                print(f"No se pudo sincronizar el catálogo, se mantiene la instantánea actual: {e!r}")
+
+    async def _precargar(self, clave):
+        # Las claves que llegan mientras hay una precarga en curso salen juntas en la siguiente; los
+        # errores solo se registran porque la petición individual que sigue los vuelve a reportar
+        self._pendientes.add(clave)
+        async with self._lock_precarga:
+            if clave not in self._pendientes:
+                return
+            lote = [clave] + [u for u in self._pendientes if u != clave][:MAX_LOTE_OBRAS - 1]
+            self._pendientes.difference_update(lote)
+            try:
+                await self.cliente_api.precargar_obras(lote)
+            except Exception as e:
+                print(f"No se pudieron precargar {len(lote)} obras: {e!r}")
+
+    async def obtener_obra_completa(self, obra_uuid):
+        # Misma interfaz que ClienteAPI.obtener_obra_completa: (obra, medios)
+        clave = normalizar_uuid(obra_uuid)
+        obra = self._obras.get(clave)
+        if obra is not None:
+            self.resueltas_local += 1
+            return obra, self._medios.get(clave, [])
+        # Obra creada después de la última sincronización (o UUID inválido, que la API rechaza)
+        self.resueltas_api += 1
+        if clave is None:
+            return await self.cliente_api.obtener_obra_completa(obra_uuid)
+        await self._precargar(clave)
+        return await self.cliente_api.obtener_obra_completa(clave)
+
+    async def obtener_medios(self, obra_uuid):
+        clave = normalizar_uuid(obra_uuid)
+        if clave in self._medios:
+            self.resueltas_local += 1
+            return self._medios[clave]
+        self.resueltas_api += 1
+        if clave is None:
+            return await self.cliente_api.obtener_medios(obra_uuid)
+        await self._precargar(clave)
+        return await self.cliente_api.obtener_medios(clave)
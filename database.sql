@@ -13,7 +13,8 @@ CREATE TABLE obras (
     autor VARCHAR(100),
     año INTEGER CHECK (año >= 0),
     estilo VARCHAR(50),
-    descripcion TEXT
+    descripcion TEXT,
+    actualizado_en TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 
 -- Tabla 'medios' con referencia a 'obras.id' (entero)
@@ -24,9 +25,24 @@ CREATE TABLE medios (
     url VARCHAR(500) DEFAULT NULL,
     ruta_local VARCHAR(500) DEFAULT NULL,
     info TEXT DEFAULT NULL,
+    actualizado_en TIMESTAMPTZ NOT NULL DEFAULT now(),
     FOREIGN KEY (obra_id) REFERENCES obras(id)
 );
 
+-- actualizado_en se renueva en cada UPDATE; la API lo usa para calcular el ETag de las respuestas
+-- (en una base existente: ALTER TABLE obras/medios ADD COLUMN actualizado_en TIMESTAMPTZ NOT NULL DEFAULT now();)
+CREATE OR REPLACE FUNCTION tocar_actualizado_en() RETURNS trigger AS $$
+BEGIN
+    NEW.actualizado_en = now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER obras_actualizado_en BEFORE UPDATE ON obras
+    FOR EACH ROW EXECUTE FUNCTION tocar_actualizado_en();
+CREATE TRIGGER medios_actualizado_en BEFORE UPDATE ON medios
+    FOR EACH ROW EXECUTE FUNCTION tocar_actualizado_en();
+
 -- Índices para optimización de consultas
 CREATE INDEX idx_medios_obra_id ON medios(obra_id);
 CREATE INDEX idx_medios_tipo_medio ON medios(tipo_medio);
@@ -0,0 +1,152 @@
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+
+# Bits de la huella dHash de image_utils (8x8)
+BITS_HUELLA = 64
+# Distancia de Hamming máxima para considerar dos fotos la misma: un reenvío recomprimido por Telegram
+# cambia 0-2 bits, mientras que otra toma de la misma obra ya difiere en más de 10
+UMBRAL_HAMMING = 4
+
+
+def distancia_hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class IndiceHamming:
+    """Búsqueda de huellas a distancia de Hamming <= umbral mediante multi-index hashing.
+
+    La huella se parte en umbral + 1 trozos: dos huellas a distancia <= umbral coinciden exactamente
+    en al menos uno (palomar), así que basta mirar los candidatos que comparten algún trozo y
+    verificar la distancia completa. A diferencia de un BK-tree admite quitar entradas sin reconstruir.
+    """
+
+    def __init__(self, umbral=UMBRAL_HAMMING, bits=BITS_HUELLA):
+        partes = umbral + 1
+        self.umbral = umbral
+        self._rangos = [(i * bits // partes, (i + 1) * bits // partes) for i in range(partes)]
+        self._tablas = [defaultdict(set) for _ in self._rangos]
+
+    def _trozos(self, huella):
+        return [(huella >> inicio) & ((1 << (fin - inicio)) - 1) for inicio, fin in self._rangos]
+
+    def agregar(self, huella):
+        for tabla, trozo in zip(self._tablas, self._trozos(huella)):
+            tabla[trozo].add(huella)
+
+    def quitar(self, huella):
+        for tabla, trozo in zip(self._tablas, self._trozos(huella)):
+            grupo = tabla.get(trozo)
+            if grupo is not None:
+                grupo.discard(huella)
+                if not grupo:
+                    del tabla[trozo]
+
+    def buscar(self, huella):
+        # Huella indexada más cercana a distancia <= umbral, o None
+        mejor, mejor_distancia = None, self.umbral + 1
+        for tabla, trozo in zip(self._tablas, self._trozos(huella)):
+            for candidata in tabla.get(trozo, ()):
+                distancia = distancia_hamming(huella, candidata)
+                if distancia < mejor_distancia:
+                    mejor, mejor_distancia = candidata, distancia
+        return mejor
+
+
+@dataclass
+class ResultadoFoto:
+    texto: str
+    # file_id de Telegram de la foto con recuadros ya enviada (o sus bytes si no se pudo enviar); None sin texto
+    imagen_ocr: str | bytes | None
+    coincidencia: tuple | None
+    inliers: int = 0
+    # Chat que envió la foto: solo a él se le reenvía imagen_ocr, que muestra su foto. A otros chats con
+    # una foto casi idéntica se les responde con el texto y la obra, que no la exponen
+    chat_id: int | None = None
+
+    def imagen_para(self, chat_id):
+        return self.imagen_ocr if chat_id == self.chat_id else None
+
+    @property
+    def tamano(self):
+        # Estimación de memoria: contenido variable más un costo fijo por objeto y claves
+        return len(self.texto.encode()) + len(self.imagen_ocr or b"") + 512
+
+
+class CacheResultadosFotos:
+    """Resultados de análisis (OCR + comparación) por file_unique_id y por huella perceptual.
+
+    Un reenvío de Telegram conserva el file_unique_id y se resuelve sin descargar la foto; una foto
+    casi idéntica con otro file_unique_id se encuentra por huella dHash. LRU acotada por cantidad de
+    entradas y por bytes. Se comparte entre chats, salvo la foto con recuadros (ResultadoFoto.imagen_para).
+    """
+
+    def __init__(self, max_entradas=512, max_bytes=64 * 1024 * 1024, umbral_hamming=UMBRAL_HAMMING):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._datos = OrderedDict()   # huella -> ResultadoFoto
+        self._por_file_id = {}        # file_unique_id -> huella
+        self._file_ids = {}           # huella -> file_unique_id que apuntan a ella
+        self._indice = IndiceHamming(umbral_hamming)
+        self.bytes = 0
+        self.aciertos_file_id = 0
+        self.aciertos_huella = 0
+        self.fallos = 0
+
+    def __len__(self):
+        return len(self._datos)
+
+    def _usar(self, huella, file_unique_id=None):
+        self._datos.move_to_end(huella)
+        if file_unique_id and file_unique_id not in self._por_file_id:
+            self._por_file_id[file_unique_id] = huella
+            self._file_ids.setdefault(huella, set()).add(file_unique_id)
+        return self._datos[huella]
+
+    def por_file_id(self, file_unique_id):
+        huella = self._por_file_id.get(file_unique_id)
+        if huella is None:
+            return None
+        self.aciertos_file_id += 1
+        return self._usar(huella)
+
+    def por_huella(self, huella, file_unique_id=None):
+        # Además asocia file_unique_id a la entrada encontrada para que el próximo reenvío no descargue
+        cercana = self._indice.buscar(huella)
+        if cercana is None:
+            self.fallos += 1
+            return None
+        self.aciertos_huella += 1
+        return self._usar(cercana, file_unique_id)
+
+    def guardar(self, huella, resultado, file_unique_id=None):
+        if resultado.tamano > self.max_bytes:
+            return
+        if huella in self._datos:
+            self.bytes -= self._datos[huella].tamano
+        else:
+            self._indice.agregar(huella)
+        self._datos[huella] = resultado
+        self.bytes += resultado.tamano
+        self._usar(huella, file_unique_id)
+        while self._datos and (len(self._datos) > self.max_entradas or self.bytes > self.max_bytes):
+            self._quitar(next(iter(self._datos)))
+
+    def _quitar(self, huella):
+        self.bytes -= self._datos.pop(huella).tamano
+        self._indice.quitar(huella)
+        for file_unique_id in self._file_ids.pop(huella, ()):
+            del self._por_file_id[file_unique_id]
+
+    def limpiar(self):
+        # Los resultados de comparación dependen del índice de referencias; se descartan si este cambia
+        for huella in list(self._datos):
+            self._quitar(huella)
+
+    def estadisticas(self):
+        return {
+            "entradas": len(self._datos),
+            "bytes": self.bytes,
+            "aciertos_file_id": self.aciertos_file_id,
+            "aciertos_huella": self.aciertos_huella,
+            "fallos": self.fallos,
+        }
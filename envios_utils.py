@@ -0,0 +1,94 @@
+import json
+import os
+from telegram import InputFile
+from telegram.error import BadRequest
+
+from indice_utils import hash_archivo
+
+# Fragmentos (en minúsculas) de los BadRequest de Telegram que indican que un file_id ya no sirve:
+# generado por otro bot, vencido o de otro tipo de archivo
+ERRORES_FILE_ID = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "file reference expired",
+    "file_reference_expired",
+    "wrong padding",
+    "type of file mismatch",
+    "can't use file of type",
+)
+
+
+class CacheFileIds:
+    """Mapeo persistente (ruta del archivo + hash de contenido) -> file_id de Telegram."""
+
+    def __init__(self, ruta_cache, carpeta_base="."):
+        self.ruta_cache = ruta_cache
+        self.carpeta_base = os.path.abspath(carpeta_base)
+        self._file_ids = {}
+        self._hashes = {}  # ruta -> (mtime, tamaño, hash), evita releer archivos grandes en cada envío
+        if os.path.exists(ruta_cache):
+            try:
+                with open(ruta_cache, encoding="utf-8") as f:
+                    self._file_ids = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"No se pudo leer la caché de file_id: {e}")
+
+    def _clave(self, ruta):
+        stat = os.stat(ruta)
+        previo = self._hashes.get(ruta)
+        if previo and previo[:2] == (stat.st_mtime_ns, stat.st_size):
+            hash_actual = previo[2]
+        else:
+            hash_actual = hash_archivo(ruta)
+            self._hashes[ruta] = (stat.st_mtime_ns, stat.st_size, hash_actual)
+        ruta_relativa = os.path.relpath(os.path.abspath(ruta), self.carpeta_base)
+        return f"{ruta_relativa}:{hash_actual}"
+
+    def obtener(self, ruta):
+        return self._file_ids.get(self._clave(ruta))
+
+    def guardar(self, ruta, file_id):
+        self._file_ids[self._clave(ruta)] = file_id
+        self._persistir()
+
+    def olvidar(self, ruta):
+        if self._file_ids.pop(self._clave(ruta), None) is not None:
+            self._persistir()
+
+    def _persistir(self):
+        ruta_tmp = f"{self.ruta_cache}.tmp"
+        with open(ruta_tmp, "w", encoding="utf-8") as f:
+            json.dump(self._file_ids, f, ensure_ascii=False, indent=1)
+        os.replace(ruta_tmp, self.ruta_cache)
+
+
+def es_file_id_invalido(error):
+    mensaje = error.message.lower()
+    return any(fragmento in mensaje for fragmento in ERRORES_FILE_ID)
+
+def _file_id_enviado(mensaje, campo):
+    if campo == "photo":
+        return mensaje.photo[-1].file_id
+    adjunto = getattr(mensaje, campo, None) or mensaje.document
+    return adjunto.file_id if adjunto else None
+
+async def enviar_con_cache(cache, enviar, ruta, campo, **kwargs):
+    # enviar es el método del bot (send_photo, send_audio, send_video) y campo su parámetro de archivo.
+    # Si el archivo ya se subió antes se reutiliza su file_id y no se envía ningún byte.
+    file_id = cache.obtener(ruta)
+    if file_id:
+        try:
+            return await enviar(**{campo: file_id}, **kwargs)
+        except BadRequest as e:
+            # Solo un file_id inválido se olvida y se vuelve a subir el archivo; cualquier otro error
+            # (chat inexistente, caption demasiado largo, ...) fallaría igual al subirlo y se propaga
+            if not es_file_id_invalido(e):
+                raise
+            cache.olvidar(ruta)
+
+    with open(ruta, "rb") as archivo:
+        mensaje = await enviar(**{campo: InputFile(archivo)}, **kwargs)
+    nuevo_file_id = _file_id_enviado(mensaje, campo)
+    if nuevo_file_id:
+        cache.guardar(ruta, nuevo_file_id)
+    return mensaje
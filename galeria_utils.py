@@ -0,0 +1,78 @@
+import asyncio
+import multiprocessing
+import os
+
+from indice_utils import cargar_indice
+
+
+def firma_carpeta(carpeta):
+    # (nombre, mtime, tamaño) de cada archivo: cambia al agregar, reemplazar o quitar una obra
+    with os.scandir(carpeta) as entradas:
+        archivos = [(e.name, e.stat()) for e in entradas if e.is_file()]
+    return frozenset((nombre, stat.st_mtime_ns, stat.st_size) for nombre, stat in archivos)
+
+
+class VigilanteGaleria:
+    """Mantiene el índice de referencias al día con la carpeta de obras sin reiniciar el bot.
+
+    Revisa la carpeta por sondeo de mtime (o cuando se le pide, p. ej. con SIGHUP o /recargar) y
+    reindexa de forma incremental en un hilo aparte. Los niveles del índice se escriben en archivos
+    nuevos y se publican juntos (indice_utils.publicar_niveles); solo después se avisa una nueva
+    generación: los workers cambian de índice entre dos consultas, nunca a mitad de una.
+    """
+
+    def __init__(self, carpeta, ruta_indice, **opciones_indice):
+        self.carpeta = carpeta
+        self.ruta_indice = ruta_indice
+        self.opciones_indice = opciones_indice
+        # Generación del índice compartida con los workers (se pasa en initargs del pool)
+        self.generacion = multiprocessing.Value("i", 0, lock=False)
+        self._firma = None
+        self._hashes = {}  # archivo -> hash del contenido en el índice publicado
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def _reindexar(self):
+        # El bot no busca en este índice, solo los workers: no se arman las estructuras de búsqueda
+        piramide = cargar_indice(self.carpeta, self.ruta_indice, preparar=False, **self.opciones_indice)
+        return {archivo: obra["hash"] for archivo, obra in piramide.niveles[0].obras.items()}
+
+    async def actualizar(self, forzar=False):
+        # Devuelve (añadidas, actualizadas, eliminadas); forzar reindexa aunque la firma no haya cambiado
+        async with self._lock:
+            firma = await asyncio.to_thread(firma_carpeta, self.carpeta)
+            if not forzar and firma == self._firma:
+                return [], [], []
+            hashes = await asyncio.to_thread(self._reindexar)
+            inicial = self._firma is None
+            self._firma = firma
+            añadidas = sorted(hashes.keys() - self._hashes.keys())
+            eliminadas = sorted(self._hashes.keys() - hashes.keys())
+            actualizadas = sorted(a for a in hashes.keys() & self._hashes.keys() if hashes[a] != self._hashes[a])
+            self._hashes = hashes
+            # La primera carga es la generación 0, la que leen los workers al iniciar
+            if not inicial and (añadidas or actualizadas or eliminadas):
+                self.generacion.value += 1
+                print(f"Galería actualizada (generación {self.generacion.value}): "
+                      f"+{len(añadidas)} ~{len(actualizadas)} -{len(eliminadas)}")
+            return añadidas, actualizadas, eliminadas
+
+    async def vigilar_periodicamente(self, intervalo, al_cambiar=None):
+        # Tarea de fondo: revisa la carpeta cada intervalo segundos; al_cambiar() se llama tras publicar cambios
+        while True:
+            await asyncio.sleep(intervalo)
+            await self.actualizar_y_avisar(al_cambiar)
+
+    async def actualizar_y_avisar(self, al_cambiar=None, forzar=False):
+        # Cualquier error al reindexar (archivo corrupto, disco lleno, falla de OpenCV, ...) deja publicado
+        # el índice anterior y no corta vigilar_periodicamente: la próxima revisión lo vuelve a intentar
+        try:
+            cambios = await self.actualizar(forzar)
+        except Exception as e:
+            print(f"No se pudo actualizar el índice de la galería, se mantiene el anterior: {e!r}")
+            return None
+        if any(cambios) and al_cambiar:
+            al_cambiar()
+        return cambios
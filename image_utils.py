@@ -1,8 +1,98 @@
 import cv2
 import numpy as np
-import os
+import functools
+import itertools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
 N_FEATURES=1000
+UMBRAL_INLIERS = 30
+# Salida temprana: la mejor obra debe superar UMBRAL_INLIERS * MARGEN_UMBRAL
+# y a la segunda mejor obra verificada por un factor MARGEN_SEGUNDO
+MARGEN_UMBRAL = 2.0
+MARGEN_SEGUNDO = 2.0
+# Ratio test de Lowe y mínimo de matches que lo pasan para intentar la homografía
+RATIO_LOWE = 0.75
+MIN_BUENOS_MATCHES = 10
+# Hilos para verificar tiles en paralelo dentro de una consulta (OpenCV libera el GIL)
+HILOS_MATCHING = 1
+# Emparejador de descriptores: "fuerza_bruta" (exacto), "flann_lsh" (un índice LSH por tile) o
+# "global" (un solo índice LSH con todos los descriptores de referencia, consultado una vez por foto)
+EMPAREJADOR = "fuerza_bruta"
+# Parámetros de LSH: tablas hash, bits de cada clave y nivel de multi-sondeo (buckets vecinos visitados)
+LSH_TABLAS = 6
+LSH_BITS_CLAVE = 12
+LSH_SONDEO = 1
+# Valor de FLANN para el algoritmo LSH (cv2 no lo expone como constante)
+FLANN_INDEX_LSH = 6
+# Vecinos por descriptor en el índice global; el ratio test de cada tile usa los que caen en él
+VECINOS_GLOBAL = 8
+
+@dataclass
+class ResultadoComparacion:
+    coincidencia: tuple | None = None
+    inliers: int = 0
+    inliers_segundo: int = 0
+    salida_temprana: bool = False
+    tiles_totales: int = 0
+    tiles_candidatos: int = 0
+    tiles_verificados: int = 0
+    # Resoluciones de la pirámide evaluadas (ancho de trabajo, 0 = original)
+    resoluciones: tuple = ()
+    # Tiempo de CPU de la búsqueda dentro del worker (sin la espera en la cola del pool)
+    segundos: float = 0.0
+
+    @property
+    def tiles_omitidos(self):
+        return self.tiles_totales - self.tiles_verificados
+
+def reducir_ancho(img, max_ancho):
+    # Reduce la imagen a un ancho máximo conservando la proporción (0 = sin límite)
+    alto, ancho = img.shape[:2]
+    if not max_ancho or ancho <= max_ancho:
+        return img
+    return cv2.resize(img, (max_ancho, max(1, round(alto * max_ancho / ancho))), interpolation=cv2.INTER_AREA)
+
+def huella_dhash(img, lado=8):
+    # Hash perceptual de diferencias (dHash) de lado*lado bits: se reduce primero y luego se pasa a gris,
+    # así el costo no depende del tamaño de la foto
+    pequena = cv2.resize(img, (lado + 1, lado), interpolation=cv2.INTER_AREA)
+    if pequena.ndim == 3:
+        pequena = cv2.cvtColor(pequena, cv2.COLOR_BGR2GRAY)
+    bits = (pequena[:, 1:] > pequena[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def huella_jpeg(datos):
+    # Huella dHash directo de los bytes: libjpeg decodifica a 1/8 de escala y en gris, sin la foto completa.
+    # Lanza ValueError si los bytes no son una imagen
+    img = cv2.imdecode(np.frombuffer(datos, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        raise ValueError("Error en decodificación de imagen")
+    return huella_dhash(img)
+
+def decodificar_imagen(fuente, flags=cv2.IMREAD_COLOR):
+    # Acepta bytes/bytearray en memoria, un array ya decodificado o la ruta de un archivo
+    if isinstance(fuente, np.ndarray):
+        return fuente
+    if isinstance(fuente, (bytes, bytearray, memoryview)):
+        img = cv2.imdecode(np.frombuffer(fuente, np.uint8), flags)
+    else:
+        img = cv2.imread(fuente, flags)
+    if img is None:
+        raise ValueError("Error en decodificación de imagen")
+    return img
+
+def imagen_gris(fuente, max_ancho=0):
+    # Bytes y rutas se decodifican directo en gris (libjpeg omite la conversión de color); un array BGR se convierte
+    if isinstance(fuente, np.ndarray) and fuente.ndim == 3:
+        return reducir_ancho(cv2.cvtColor(fuente, cv2.COLOR_BGR2GRAY), max_ancho)
+    return reducir_ancho(decodificar_imagen(fuente, cv2.IMREAD_GRAYSCALE), max_ancho)
+
+def preprocesar_imagen(img):
+    img = cv2.GaussianBlur(img, (5, 5), 0)
+    return cv2.equalizeHist(img)
 
 def recortar_centro(img, porcentaje=0.6):
     alto, ancho = img.shape
@@ -23,61 +113,244 @@ def dividir_imagen(img, filas=3, columnas=3):
             tiles.append(((i, j), tile))
     return tiles
 
-def comparar_imagenes(archivo_referencia, carpeta_imagenes, filas=3, columnas=3):
-    UMBRAL_INLIERS = 30
-    img_ref = cv2.imread(archivo_referencia, cv2.IMREAD_GRAYSCALE)
-    if img_ref is None:
-        raise ValueError(f"No se pudo cargar la imagen: {archivo_referencia}")
+def es_confiable(inliers, inliers_segundo, margen_umbral=MARGEN_UMBRAL, margen_segundo=MARGEN_SEGUNDO):
+    return inliers >= UMBRAL_INLIERS * margen_umbral and inliers >= inliers_segundo * margen_segundo
+
+def ratio_test(distancias, indices, ratio=RATIO_LOWE):
+    # distancias e indices de los 2 vecinos más cercanos de cada descriptor; devuelve (query, train) de los
+    # que pasan. Un vecino no encontrado (índice -1, posible con LSH) deja el ratio test sin definir
+    pasan = np.flatnonzero((indices[:, 1] >= 0) & (distancias[:, 0] < ratio * distancias[:, 1]))
+    return pasan, indices[pasan, 0]
+
+def buenos_matches(des1, des2, ratio=RATIO_LOWE):
+    # Ratio test de Lowe vectorizado: devuelve los índices (query, train) de los matches que pasan.
+    # batchDistance con K=2 da los mismos vecinos que BFMatcher.knnMatch sin crear objetos DMatch.
+    # ORB con WTA_K=2 (el valor por defecto) se compara con NORM_HAMMING; NORM_HAMMING2 es para WTA_K 3 o 4
+    if len(des2) < 2:
+        # Con un solo vecino posible el ratio test no está definido
+        vacio = np.empty(0, np.int32)
+        return vacio, vacio
+    distancias, indices = cv2.batchDistance(des1, des2, cv2.CV_32S, normType=cv2.NORM_HAMMING, K=2)
+    return ratio_test(distancias, indices, ratio)
+
+def _indice_lsh(descriptores, tablas, bits_clave, sondeo):
+    return cv2.flann_Index(descriptores, {
+        "algorithm": FLANN_INDEX_LSH,
+        "table_number": tablas, "key_size": bits_clave, "multi_probe_level": sondeo,
+    })
+
+
+class EmparejadorFuerzaBruta:
+    """Vecinos exactos: distancia de Hamming de cada descriptor de la foto contra todos los del tile."""
+
+    nombre = "fuerza_bruta"
+
+    def __init__(self, tiles, **_):
+        self.tiles = tiles
+
+    def consulta(self, des1):
+        # Devuelve emparejar(tile) -> (idx_query, idx_train) para los descriptores de una foto
+        return lambda tile: buenos_matches(des1, self.tiles[tile][3])
+
+
+class EmparejadorLSH:
+    """Vecinos aproximados con un índice FLANN LSH por tile, construido al preparar la búsqueda."""
+
+    nombre = "flann_lsh"
+
+    def __init__(self, tiles, tablas=LSH_TABLAS, bits_clave=LSH_BITS_CLAVE, sondeo=LSH_SONDEO, **_):
+        self.tiles = tiles
+        self._indices = [
+            _indice_lsh(des, tablas, bits_clave, sondeo) if len(des) >= 2 else None for _, _, _, des in tiles
+        ]
+
+    def _emparejar(self, des1, tile):
+        indice = self._indices[tile]
+        if indice is None:
+            vacio = np.empty(0, np.int32)
+            return vacio, vacio
+        indices, distancias = indice.knnSearch(des1, 2)
+        return ratio_test(distancias, indices)
 
-    img_ref = cv2.GaussianBlur(img_ref, (5, 5), 0)
-    img_ref = cv2.equalizeHist(img_ref)
-    img_ref = recortar_centro(img_ref, porcentaje=0.6)
+    def consulta(self, des1):
+        return functools.partial(self._emparejar, des1)
 
-    detector = cv2.ORB_create(nfeatures=N_FEATURES)
+
+class EmparejadorGlobal:
+    """Un solo índice LSH con los descriptores de todos los tiles.
+
+    Cada foto se busca una vez (VECINOS_GLOBAL vecinos por descriptor) y el ratio test de un tile usa los
+    dos primeros vecinos que caen en él. Si solo uno está entre los encontrados, el segundo está al menos
+    a la distancia del último vecino encontrado y esa cota hace de segunda distancia.
+    """
+
+    nombre = "global"
+
+    def __init__(self, tiles, tablas=LSH_TABLAS, bits_clave=LSH_BITS_CLAVE, sondeo=LSH_SONDEO,
+                 vecinos=VECINOS_GLOBAL):
+        longitudes = np.array([len(des) for _, _, _, des in tiles], dtype=np.int64)
+        self.vecinos = vecinos
+        self.inicios = np.concatenate(([0], np.cumsum(longitudes)[:-1])) if len(tiles) else longitudes
+        # Tile de cada descriptor del índice; la última posición (-1) corresponde a "vecino no encontrado"
+        self.tile_de = np.append(np.repeat(np.arange(len(tiles), dtype=np.int32), longitudes), -1)
+        self._indice = _indice_lsh(
+            np.concatenate([des for _, _, _, des in tiles]), tablas, bits_clave, sondeo
+        ) if longitudes.sum() >= 2 else None
+
+    def consulta(self, des1):
+        if self._indice is None:
+            return lambda tile: (np.empty(0, np.int32), np.empty(0, np.int32))
+        indices, distancias = self._indice.knnSearch(des1, self.vecinos)
+        tiles_vecinos = self.tile_de[indices]
+        # Cota de la distancia a cualquier descriptor que no esté entre los vecinos encontrados
+        encontrados = (indices >= 0).sum(axis=1)
+        cota = distancias[np.arange(len(des1)), np.maximum(encontrados - 1, 0)]
+        return functools.partial(self._emparejar, indices, distancias, tiles_vecinos, cota)
+
+    def _emparejar(self, indices, distancias, tiles_vecinos, cota, tile, ratio=RATIO_LOWE):
+        en_tile = tiles_vecinos == tile
+        filas = np.flatnonzero(en_tile.any(axis=1))
+        en_tile = en_tile[filas]
+        primero = en_tile.argmax(axis=1)
+        en_tile[np.arange(len(filas)), primero] = False
+        segundo = np.where(en_tile.any(axis=1), en_tile.argmax(axis=1), -1)
+        d1 = distancias[filas, primero]
+        d2 = np.where(segundo >= 0, distancias[filas, segundo], cota[filas])
+        pasan = d1 < ratio * d2
+        return filas[pasan], indices[filas[pasan], primero[pasan]] - self.inicios[tile]
+
+
+EMPAREJADORES = {clase.nombre: clase for clase in (EmparejadorFuerzaBruta, EmparejadorLSH, EmparejadorGlobal)}
+
+def crear_emparejador(nombre, tiles, **parametros):
+    # tiles: [(archivo, posicion, puntos, descriptores)] en el orden de IndiceReferencias.tiles
+    if nombre not in EMPAREJADORES:
+        raise ValueError(f"Emparejador desconocido: {nombre} (opciones: {', '.join(EMPAREJADORES)})")
+    return EMPAREJADORES[nombre](tiles, **parametros)
+
+def verificar_tile(emparejar, tile, puntos1, puntos2):
+    # Ratio test + homografía RANSAC de un tile; devuelve el número de inliers (0 si no hay modelo).
+    # Es independiente del resto de tiles para poder ejecutarse en cualquier hilo
+    idx_query, idx_train = emparejar(tile)
+    if len(idx_query) < MIN_BUENOS_MATCHES:
+        return 0
+
+    _, mask = cv2.findHomography(puntos1[idx_query], puntos2[idx_train], cv2.RANSAC, 5.0)
+    return int(mask.sum()) if mask is not None else 0
+
+_ejecutores_hilos = {}
+
+def _ejecutor_hilos(hilos):
+    if hilos not in _ejecutores_hilos:
+        _ejecutores_hilos[hilos] = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="matching")
+    return _ejecutores_hilos[hilos]
+
+def verificar_en_orden(tareas, hilos=HILOS_MATCHING):
+    # Ejecuta las tareas en paralelo pero entrega los resultados en el orden original, con una
+    # ventana de 2 * hilos tareas adelantadas; al cerrar el generador se cancelan las pendientes
+    if hilos <= 1:
+        for tarea in tareas:
+            yield tarea()
+        return
+    ejecutor = _ejecutor_hilos(hilos)
+    tareas = iter(tareas)
+    pendientes = deque(ejecutor.submit(tarea) for tarea in itertools.islice(tareas, 2 * hilos))
+    try:
+        while pendientes:
+            resultado = pendientes.popleft().result()
+            siguiente = next(tareas, None)
+            if siguiente is not None:
+                pendientes.append(ejecutor.submit(siguiente))
+            yield resultado
+    finally:
+        for futuro in pendientes:
+            futuro.cancel()
+
+def buscar_en_nivel(img_gris, indice, top_k=None, salida_temprana=True,
+                    margen_umbral=MARGEN_UMBRAL, margen_segundo=MARGEN_SEGUNDO, hilos=HILOS_MATCHING):
+    # img_gris: foto del visitante en escala de grises, ya reducida a la resolución del índice
+    img_ref = recortar_centro(preprocesar_imagen(img_gris), porcentaje=0.6)
+
+    resultado = ResultadoComparacion(tiles_totales=len(indice.tiles), resoluciones=(indice.ancho_trabajo,))
+    detector = cv2.ORB_create(nfeatures=indice.n_features)
     kp1, des1 = detector.detectAndCompute(img_ref, None)
     if des1 is None or len(des1) < 10:
-        return None
+        return resultado
+    puntos1 = cv2.KeyPoint_convert(kp1).astype(np.float32).reshape(-1, 2)
+    mejor_por_obra = {}
 
-    bf = cv2.BFMatcher(cv2.NORM_HAMMING2, crossCheck=False)
-    mejor_puntuacion = 0
-    mejor_info = None
+    # Etapa 1: tiles ordenados por similitud de palabras visuales (solo los de las top_k obras más
+    # parecidas si se indica)
+    # Etapa 2: verificación geométrica en ese orden, con descriptores precalculados. Los tiles se
+    # verifican en paralelo pero se combinan en el orden del ranking, así el resultado y el punto
+    # de salida temprana son los mismos con cualquier número de hilos
+    candidatos = indice.candidatos(des1, top_k)
+    resultado.tiles_candidatos = len(candidatos)
+    emparejar = indice.emparejador.consulta(des1)
+    tareas = (
+        functools.partial(verificar_tile, emparejar, tile, puntos1, indice.tiles[tile][2]) for tile in candidatos
+    )
+    verificaciones = verificar_en_orden(tareas, hilos)
+    for tile, inliers in zip(candidatos, verificaciones):
+        archivo, (fila, columna), _, _ = indice.tiles[tile]
+        resultado.tiles_verificados += 1
+        if not inliers:
+            continue
 
-    for archivo in os.listdir(carpeta_imagenes):
-        ruta_imagen = os.path.join(carpeta_imagenes, archivo)
-        img = cv2.imread(ruta_imagen, cv2.IMREAD_GRAYSCALE)
-        if img is None:
+        mejor_por_obra[archivo] = max(inliers, mejor_por_obra.get(archivo, 0))
+        if inliers > resultado.inliers:
+            resultado.inliers = inliers
+            resultado.coincidencia = (archivo, (fila, columna))
+        if resultado.coincidencia is None:
             continue
+        resultado.inliers_segundo = max(
+            (v for a, v in mejor_por_obra.items() if a != resultado.coincidencia[0]), default=0
+        )
+
+        # Detener la búsqueda cuando la mejor obra ya es claramente la correcta
+        if salida_temprana and es_confiable(resultado.inliers, resultado.inliers_segundo,
+                                            margen_umbral, margen_segundo):
+            resultado.salida_temprana = True
+            break
+    verificaciones.close()
+
+    if resultado.inliers <= UMBRAL_INLIERS:
+        resultado.coincidencia = None
+    return resultado
 
-        # Preprocesamiento para imágenes de la base de datos
-        img = cv2.GaussianBlur(img, (5, 5), 0)
-        img = cv2.equalizeHist(img)
-        tiles = dividir_imagen(img, filas, columnas)
-
-        for (fila, columna), tile in tiles:
-            kp2, des2 = detector.detectAndCompute(tile, None)
-            if des2 is None or len(des2) < 10:
-                continue
-
-            matches = bf.knnMatch(des1, des2, k=2)
-            good_matches = [m for m, n in matches if m.distance < 0.75 * n.distance]
-            if len(good_matches) < 10:
-                continue
-
-            src_pts = np.float32([kp1[m.queryIdx].pt for m in good_matches])
-            dst_pts = np.float32([kp2[m.trainIdx].pt for m in good_matches])
-            _, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-            if mask is None:
-                continue
-
-            inliers = np.sum(mask)
-            if inliers > mejor_puntuacion:
-                mejor_puntuacion = inliers
-                mejor_info = (archivo, (fila, columna))
-    
-    print(f'Mejor puntuacion: {mejor_puntuacion}')
-    if mejor_puntuacion > UMBRAL_INLIERS:
-        print(f"Coincidencia válida: {mejor_info} (inliers: {mejor_puntuacion})")
-        return mejor_info
+def buscar_obra(imagen, indice, top_k=None, salida_temprana=True,
+                margen_umbral=MARGEN_UMBRAL, margen_segundo=MARGEN_SEGUNDO, hilos=HILOS_MATCHING):
+    # imagen: array (BGR o gris), bytes o ruta de la foto del visitante; se decodifica una vez, en gris
+    # indice: IndiceReferencias o PiramideIndices; en la pirámide se busca primero en la resolución
+    # más baja y solo se refina en la siguiente si el resultado no es confiable
+    inicio = time.perf_counter()
+    gris = imagen_gris(imagen)
+    niveles = getattr(indice, "niveles", [indice])
+    mejor = None
+    resoluciones = ()
+    for nivel in niveles:
+        resultado = buscar_en_nivel(reducir_ancho(gris, nivel.ancho_trabajo), nivel, top_k,
+                                    salida_temprana, margen_umbral, margen_segundo, hilos)
+        resoluciones += resultado.resoluciones
+        if mejor is None or resultado.inliers >= mejor.inliers:
+            mejor = resultado
+        if es_confiable(resultado.inliers, resultado.inliers_segundo, margen_umbral, margen_segundo):
+            break
+    mejor.resoluciones = resoluciones
+    mejor.segundos = time.perf_counter() - inicio
+    return mejor
+
+def imprimir_resultado(resultado):
+    print(f'Mejor puntuacion: {resultado.inliers} '
+          f'(tiles verificados: {resultado.tiles_verificados}/{resultado.tiles_totales}, '
+          f'salida temprana: {resultado.salida_temprana}, resoluciones: {resultado.resoluciones}, '
+          f'{resultado.segundos * 1000:.0f} ms)')
+    if resultado.coincidencia:
+        print(f"Coincidencia válida: {resultado.coincidencia} (inliers: {resultado.inliers})")
     else:
         print("No se encontraron coincidencias significativas.")
-        return None
\ No newline at end of file
+
+def comparar_imagenes(imagen, indice, top_k=None, **kwargs):
+    resultado = buscar_obra(imagen, indice, top_k, **kwargs)
+    imprimir_resultado(resultado)
+    return resultado.coincidencia
@@ -0,0 +1,412 @@
+import cv2
+import numpy as np
+import hashlib
+import json
+import os
+
+from image_utils import (EMPAREJADOR, N_FEATURES, crear_emparejador, preprocesar_imagen, dividir_imagen,
+                         reducir_ancho)
+from recuperacion_utils import IndiceInvertido, Vocabulario, dimensionar_vocabulario
+
+VERSION_INDICE = 5
+# Formato en disco: MAGIA_INDICE | largo de la cabecera (uint64) | cabecera JSON | arrays alineados.
+# Los arrays se abren con numpy.memmap: los workers comparten la copia del archivo en el page cache
+MAGIA_INDICE = b"MUSEOIDX"
+ALINEACION_INDICE = 64
+MIN_DESCRIPTORES = 10
+# Anchos de trabajo de la pirámide, de menor a mayor (0 = resolución original)
+RESOLUCIONES_INDICE = (0,)
+
+def hash_archivo(ruta, tam_bloque=1 << 20):
+    h = hashlib.sha1()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(tam_bloque), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+def _alinear(n):
+    return -(-n // ALINEACION_INDICE) * ALINEACION_INDICE
+
+def guardar_arrays(ruta, metadatos, arrays):
+    # Escribe metadatos (JSON) y arrays contiguos en un archivo plano; los desplazamientos de cada array
+    # se cuentan desde el inicio de la sección de datos, alineada a ALINEACION_INDICE bytes
+    descripcion, desplazamiento = {}, 0
+    for nombre, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[nombre] = array
+        descripcion[nombre] = {"dtype": array.dtype.str, "forma": array.shape, "desplazamiento": desplazamiento}
+        desplazamiento = _alinear(desplazamiento + array.nbytes)
+    cabecera = json.dumps({**metadatos, "arrays": descripcion}).encode()
+    inicio_datos = _alinear(len(MAGIA_INDICE) + 8 + len(cabecera))
+
+    ruta_tmp = f"{ruta}.tmp"
+    with open(ruta_tmp, "wb") as f:
+        f.write(MAGIA_INDICE + len(cabecera).to_bytes(8, "little") + cabecera)
+        for nombre, array in arrays.items():
+            f.seek(inicio_datos + descripcion[nombre]["desplazamiento"])
+            f.write(array.tobytes())
+    os.replace(ruta_tmp, ruta)
+
+def abrir_arrays(ruta):
+    # Devuelve (metadatos, {nombre: array de solo lectura sobre un único memmap del archivo})
+    with open(ruta, "rb") as f:
+        if f.read(len(MAGIA_INDICE)) != MAGIA_INDICE:
+            raise ValueError("No es un archivo de índice de referencias")
+        largo_cabecera = int.from_bytes(f.read(8), "little")
+        cabecera = json.loads(f.read(largo_cabecera))
+    inicio_datos = _alinear(len(MAGIA_INDICE) + 8 + largo_cabecera)
+    mapa = np.memmap(ruta, dtype=np.uint8, mode="r")
+    arrays = {}
+    for nombre, desc in cabecera.pop("arrays").items():
+        dtype, forma = np.dtype(desc["dtype"]), tuple(desc["forma"])
+        inicio = inicio_datos + desc["desplazamiento"]
+        tamano = int(np.prod(forma)) * dtype.itemsize
+        arrays[nombre] = mapa[inicio:inicio + tamano].view(dtype).reshape(forma)
+    return cabecera, arrays
+
+def extraer_caracteristicas_tiles(img, filas, columnas, detector, vocabulario=None):
+    # Devuelve [((fila, columna), puntos float32 (N, 2), descriptores uint8 (N, 32), palabras int32 (N,))]
+    img = preprocesar_imagen(img)
+    resultado = []
+    for (fila, columna), tile in dividir_imagen(img, filas, columnas):
+        kp, des = detector.detectAndCompute(tile, None)
+        if des is None or len(des) < MIN_DESCRIPTORES:
+            continue
+        puntos = cv2.KeyPoint_convert(kp).astype(np.float32).reshape(-1, 2)
+        palabras = vocabulario.cuantizar(des) if vocabulario is not None else None
+        resultado.append(((fila, columna), puntos, des, palabras))
+    return resultado
+
+
+class IndiceReferencias:
+    """Índice persistente de keypoints y descriptores ORB por tile de cada obra de referencia."""
+
+    def __init__(self, filas=4, columnas=4, n_features=N_FEATURES,
+                 ramas_vocabulario=None, niveles_vocabulario=None, ancho_trabajo=0):
+        self.filas = filas
+        self.columnas = columnas
+        self.n_features = n_features
+        # Tamaño configurado del vocabulario; None se dimensiona según la cantidad de descriptores
+        self.ramas_vocabulario = ramas_vocabulario
+        self.niveles_vocabulario = niveles_vocabulario
+        # Las obras se reducen a este ancho antes de extraer características (0 = resolución original)
+        self.ancho_trabajo = ancho_trabajo
+        # archivo -> {"mtime": int, "tamano": int, "hash": str,
+        #             "tiles": [((fila, columna), puntos, descriptores, palabras)]}
+        self.obras = {}
+        self.vocabulario = None
+        # Estructuras de búsqueda derivadas, se reconstruyen con preparar_busqueda()
+        self.tiles = []
+        self.invertido = None
+        self.emparejador = None
+        # Índice invertido leído del archivo; se descarta en cuanto cambian las obras o el vocabulario
+        self._invertido_guardado = None
+
+    def __len__(self):
+        return len(self.obras)
+
+    def iterar_tiles(self):
+        for archivo, obra in self.obras.items():
+            for posicion, puntos, descriptores, _ in obra["tiles"]:
+                yield archivo, posicion, puntos, descriptores
+
+    def entrenar_vocabulario(self):
+        # Entrena el vocabulario visual con todos los descriptores y reasigna las palabras de cada tile
+        descriptores = [des for _, _, _, des in self.iterar_tiles()]
+        if not descriptores:
+            return
+        self.vocabulario = Vocabulario.entrenar(
+            np.concatenate(descriptores), self.ramas_vocabulario, self.niveles_vocabulario
+        )
+        self._invertido_guardado = None
+        for obra in self.obras.values():
+            obra["tiles"] = [
+                (pos, pts, des, self.vocabulario.cuantizar(des)) for pos, pts, des, _ in obra["tiles"]
+            ]
+
+    def vocabulario_desajustado(self):
+        # Con el tamaño automático, el vocabulario se vuelve a entrenar cuando la galería creció o se achicó
+        # tanto que el tamaño ideal difiere en más del doble; agregar unas pocas obras no lo reentrena
+        if self.vocabulario is None or (self.ramas_vocabulario and self.niveles_vocabulario):
+            return False
+        n_descriptores = sum(len(des) for _, _, _, des in self.iterar_tiles())
+        ramas, niveles = dimensionar_vocabulario(n_descriptores, self.ramas_vocabulario, self.niveles_vocabulario)
+        return not 0.5 <= ramas ** niveles / self.vocabulario.n_palabras <= 2
+
+    def _construir_invertido(self):
+        palabras, obra_por_tile = [], []
+        for idx, obra in enumerate(self.obras.values()):
+            for _, _, _, pal in obra["tiles"]:
+                palabras.append(pal)
+                obra_por_tile.append(idx)
+        return IndiceInvertido(self.vocabulario, palabras, obra_por_tile)
+
+    def preparar_busqueda(self, emparejador=EMPAREJADOR, **parametros_emparejador):
+        # parametros_emparejador: tablas, bits_clave, sondeo y vecinos de los emparejadores LSH
+        self.tiles = list(self.iterar_tiles())
+        self.emparejador = crear_emparejador(emparejador, self.tiles, **parametros_emparejador)
+        if self.vocabulario is None:
+            self.invertido = None
+            return
+        self.invertido = self._invertido_guardado or self._construir_invertido()
+
+    def candidatos(self, descriptores, top_k=None):
+        # Primera etapa: posiciones en self.tiles ordenadas por similitud de bolsa de palabras visuales,
+        # limitadas a los tiles de las top_k obras más parecidas si se indica
+        if self.invertido is None:
+            return range(len(self.tiles))
+        return self.invertido.candidatos(descriptores, top_k or len(self.obras)).tolist()
+
+    def actualizar(self, carpeta_imagenes):
+        # Reindexa solo los archivos nuevos o modificados y elimina los que ya no existen
+        detector = cv2.ORB_create(nfeatures=self.n_features)
+        añadidas, actualizadas = [], []
+        presentes = set()
+
+        for archivo in sorted(os.listdir(carpeta_imagenes)):
+            ruta = os.path.join(carpeta_imagenes, archivo)
+            if not os.path.isfile(ruta):
+                continue
+            stat = os.stat(ruta)
+            previa = self.obras.get(archivo)
+            if previa and previa["mtime"] == stat.st_mtime_ns and previa["tamano"] == stat.st_size:
+                presentes.add(archivo)
+                continue
+
+            hash_actual = hash_archivo(ruta)
+            if previa and previa["hash"] == hash_actual:
+                previa["mtime"], previa["tamano"] = stat.st_mtime_ns, stat.st_size
+                presentes.add(archivo)
+                actualizadas.append(archivo)
+                continue
+
+            img = cv2.imread(ruta, cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                continue
+            img = reducir_ancho(img, self.ancho_trabajo)
+            self.obras[archivo] = {
+                "mtime": stat.st_mtime_ns,
+                "tamano": stat.st_size,
+                "hash": hash_actual,
+                "tiles": extraer_caracteristicas_tiles(img, self.filas, self.columnas, detector, self.vocabulario),
+            }
+            presentes.add(archivo)
+            (actualizadas if previa else añadidas).append(archivo)
+
+        eliminadas = [archivo for archivo in self.obras if archivo not in presentes]
+        for archivo in eliminadas:
+            del self.obras[archivo]
+        if añadidas or actualizadas or eliminadas:
+            self._invertido_guardado = None
+        return añadidas, actualizadas, eliminadas
+
+    def guardar(self, ruta):
+        # Formato plano: descriptores y puntos concatenados más una tabla de tiles (inicio, fin) por obra
+        archivos = list(self.obras)
+        tabla_tiles, puntos, descriptores, palabras = [], [], [], []
+        inicio = 0
+        for idx, archivo in enumerate(archivos):
+            for (fila, columna), pts, des, pal in self.obras[archivo]["tiles"]:
+                tabla_tiles.append((idx, fila, columna, inicio, inicio + len(des)))
+                puntos.append(pts)
+                descriptores.append(des)
+                palabras.append(pal)
+                inicio += len(des)
+
+        metadatos = {
+            "version": VERSION_INDICE,
+            "filas": self.filas,
+            "columnas": self.columnas,
+            "n_features": self.n_features,
+            "ramas_vocabulario": self.ramas_vocabulario,
+            "vocabulario_ramas": self.vocabulario.ramas if self.vocabulario is not None else None,
+            "niveles_vocabulario": self.niveles_vocabulario,
+            "ancho_trabajo": self.ancho_trabajo,
+            "obras": [
+                {"archivo": a, "mtime": self.obras[a]["mtime"], "tamano": self.obras[a]["tamano"],
+                 "hash": self.obras[a]["hash"]}
+                for a in archivos
+            ],
+        }
+        arrays = {
+            "tiles": np.array(tabla_tiles, dtype=np.int64).reshape(-1, 5),
+            "puntos": np.concatenate(puntos) if puntos else np.empty((0, 2), np.float32),
+            "descriptores": np.concatenate(descriptores) if descriptores else np.empty((0, 32), np.uint8),
+            "palabras": np.concatenate(palabras) if palabras else np.empty(0, np.int32),
+            "vocabulario": (self.vocabulario.centros if self.vocabulario is not None
+                            else np.empty((0, 32), np.uint8)),
+        }
+        # El índice invertido también se guarda: los workers lo mapean en lugar de recalcularlo al iniciar
+        if self.vocabulario is not None:
+            self._invertido_guardado = self._invertido_guardado or self._construir_invertido()
+            for nombre, array in self._invertido_guardado.arrays().items():
+                arrays[f"invertido_{nombre}"] = array
+        guardar_arrays(ruta, metadatos, arrays)
+
+    @classmethod
+    def cargar(cls, ruta):
+        # Los puntos, descriptores y palabras de cada tile son vistas sobre el archivo mapeado en memoria:
+        # no se copian al proceso y las páginas se comparten entre todos los workers
+        metadatos, datos = abrir_arrays(ruta)
+        if metadatos.get("version") != VERSION_INDICE:
+            raise ValueError(f"Versión de índice no soportada: {metadatos.get('version')}")
+        indice = cls(metadatos["filas"], metadatos["columnas"], metadatos["n_features"],
+                     metadatos["ramas_vocabulario"], metadatos["niveles_vocabulario"],
+                     metadatos["ancho_trabajo"])
+        if len(datos["vocabulario"]):
+            indice.vocabulario = Vocabulario(datos["vocabulario"], metadatos["vocabulario_ramas"])
+        for obra in metadatos["obras"]:
+            indice.obras[obra["archivo"]] = {
+                "mtime": obra["mtime"], "tamano": obra["tamano"], "hash": obra["hash"], "tiles": []
+            }
+        if indice.vocabulario is not None and "invertido_idf" in datos:
+            indice._invertido_guardado = IndiceInvertido.desde_arrays(indice.vocabulario, {
+                nombre.removeprefix("invertido_"): array
+                for nombre, array in datos.items() if nombre.startswith("invertido_")
+            }, len(datos["tiles"]))
+        puntos, descriptores, palabras = datos["puntos"], datos["descriptores"], datos["palabras"]
+        for idx, fila, columna, inicio, fin in datos["tiles"].tolist():
+            archivo = metadatos["obras"][idx]["archivo"]
+            indice.obras[archivo]["tiles"].append(
+                ((fila, columna), puntos[inicio:fin], descriptores[inicio:fin], palabras[inicio:fin])
+            )
+        return indice
+
+
+class PiramideIndices:
+    """Índices de la misma galería a varias resoluciones, ordenados de menor a mayor ancho de trabajo."""
+
+    def __init__(self, niveles):
+        self.niveles = niveles
+
+    def __len__(self):
+        return len(self.niveles[0]) if self.niveles else 0
+
+    @classmethod
+    def cargar(cls, ruta, resoluciones=RESOLUCIONES_INDICE, emparejador=EMPAREJADOR, parametros_emparejador=None,
+               intentos=3):
+        # Abre los niveles que lista el manifiesto. Si mientras tanto se publicó otra versión y se borró
+        # algún archivo de la anterior, se vuelve a leer el manifiesto
+        for intento in range(intentos):
+            rutas = leer_manifiesto(ruta)["niveles"]
+            try:
+                niveles = [IndiceReferencias.cargar(rutas[ancho]) for ancho in resoluciones]
+                break
+            except FileNotFoundError:
+                if intento == intentos - 1:
+                    raise
+        for nivel in niveles:
+            nivel.preparar_busqueda(emparejador, **(parametros_emparejador or {}))
+        return cls(niveles)
+
+
+def ruta_nivel(ruta_indice, ancho_trabajo, publicacion=None):
+    # Cada resolución se guarda en su propio archivo, uno nuevo por publicación: indice.3.idx,
+    # indice_480.3.idx, ... (sin publicación, el nombre fijo de los índices anteriores al manifiesto)
+    base, extension = os.path.splitext(ruta_indice)
+    if ancho_trabajo:
+        base = f"{base}_{ancho_trabajo}"
+    if publicacion is not None:
+        base = f"{base}.{publicacion}"
+    return f"{base}{extension}"
+
+def ruta_manifiesto(ruta_indice):
+    return f"{ruta_indice}.manifiesto"
+
+def leer_manifiesto(ruta_indice):
+    # {"publicacion": n, "niveles": {ancho: ruta}, "anteriores": [rutas]}; vacío si aún no se publicó nada
+    try:
+        with open(ruta_manifiesto(ruta_indice), encoding="utf-8") as f:
+            datos = json.load(f)
+    except FileNotFoundError:
+        return {"publicacion": 0, "niveles": {}, "anteriores": []}
+    carpeta = os.path.dirname(ruta_indice)
+    return {
+        "publicacion": datos["publicacion"],
+        "niveles": {int(ancho): os.path.join(carpeta, archivo) for ancho, archivo in datos["niveles"].items()},
+        "anteriores": [os.path.join(carpeta, archivo) for archivo in datos["anteriores"]],
+    }
+
+def publicar_niveles(ruta_indice, publicacion, rutas, anteriores):
+    # El manifiesto se renombra al final, cuando todos los niveles ya están escritos: quien lo lee ve
+    # todos los niveles de la publicación nueva o todos los de la anterior, nunca una mezcla. Los
+    # archivos de la anterior se conservan una publicación más para un worker que la esté abriendo
+    ruta = ruta_manifiesto(ruta_indice)
+    with open(f"{ruta}.tmp", "w", encoding="utf-8") as f:
+        json.dump({
+            "publicacion": publicacion,
+            "niveles": {str(ancho): os.path.basename(r) for ancho, r in rutas.items()},
+            "anteriores": [os.path.basename(r) for r in anteriores],
+        }, f)
+    os.replace(f"{ruta}.tmp", ruta)
+
+def _borrar_archivos(rutas):
+    for ruta in rutas:
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # En Windows no se puede borrar un archivo mapeado en memoria; queda para la próxima publicación
+            print(f"No se pudo borrar el índice anterior {ruta}: {e}")
+
+def cargar_nivel(carpeta_imagenes, ruta_actual, ruta_nueva, filas=4, columnas=4,
+                 ramas_vocabulario=None, niveles_vocabulario=None, ancho_trabajo=0, preparar=True):
+    # Carga el nivel publicado en ruta_actual (None si no hay) y lo actualiza de forma incremental con los
+    # cambios en la carpeta. Devuelve (índice, ruta): si cambió se guarda en ruta_nueva, sin publicarlo
+    indice = None
+    if ruta_actual and os.path.exists(ruta_actual):
+        try:
+            indice = IndiceReferencias.cargar(ruta_actual)
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            print(f"Índice inválido, se reconstruirá: {e}")
+        configuracion = (filas, columnas, N_FEATURES, ramas_vocabulario, niveles_vocabulario, ancho_trabajo)
+        if indice and (indice.filas, indice.columnas, indice.n_features, indice.ramas_vocabulario,
+                       indice.niveles_vocabulario, indice.ancho_trabajo) != configuracion:
+            indice = None
+
+    nuevo = indice is None
+    if nuevo:
+        indice = IndiceReferencias(filas, columnas, N_FEATURES, ramas_vocabulario, niveles_vocabulario, ancho_trabajo)
+
+    añadidas, actualizadas, eliminadas = indice.actualizar(carpeta_imagenes)
+    entrenado = False
+    if indice.vocabulario is None or indice.vocabulario_desajustado():
+        indice.entrenar_vocabulario()
+        entrenado = True
+    ruta = ruta_actual
+    if añadidas or actualizadas or eliminadas or entrenado or nuevo:
+        indice.guardar(ruta_nueva)
+        ruta = ruta_nueva
+    # Solo quien busca en el índice necesita las estructuras de búsqueda (el bot las arma en cada worker)
+    if preparar:
+        indice.preparar_busqueda()
+    print(f"Índice de referencias ({ancho_trabajo or 'original'}): {len(indice)} obras "
+          f"(+{len(añadidas)} ~{len(actualizadas)} -{len(eliminadas)})")
+    return indice, ruta
+
+def cargar_indice(carpeta_imagenes, ruta_indice, filas=4, columnas=4,
+                  ramas_vocabulario=None, niveles_vocabulario=None,
+                  resoluciones=RESOLUCIONES_INDICE, preparar=True):
+    # Construye o actualiza un índice por cada resolución de la pirámide. Los niveles que cambian se
+    # escriben en archivos nuevos y se publican todos juntos con el manifiesto (ver publicar_niveles)
+    manifiesto = leer_manifiesto(ruta_indice)
+    publicacion = manifiesto["publicacion"] + 1
+    niveles, rutas = [], {}
+    for ancho in resoluciones:
+        # Sin manifiesto se parte del archivo de nombre fijo que dejaban las versiones anteriores
+        ruta_actual = manifiesto["niveles"].get(ancho) or (
+            None if manifiesto["publicacion"] else ruta_nivel(ruta_indice, ancho))
+        indice, rutas[ancho] = cargar_nivel(
+            carpeta_imagenes, ruta_actual, ruta_nivel(ruta_indice, ancho, publicacion), filas, columnas,
+            ramas_vocabulario, niveles_vocabulario, ancho, preparar,
+        )
+        niveles.append(indice)
+    if rutas != manifiesto["niveles"]:
+        vigentes = set(manifiesto["niveles"].values())
+        if not manifiesto["publicacion"]:
+            vigentes = {ruta_nivel(ruta_indice, ancho) for ancho in resoluciones}
+            vigentes = {r for r in vigentes if os.path.exists(r)}
+        publicar_niveles(ruta_indice, publicacion, rutas, sorted(vigentes - set(rutas.values())))
+        _borrar_archivos(set(manifiesto["anteriores"]) - set(rutas.values()))
+    return PiramideIndices(niveles)
@@ -0,0 +1,237 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Límites (segundos) por defecto de los histogramas de latencia
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _formatear_etiquetas(nombres, valores, extra=()):
+    pares = list(zip(nombres, valores)) + list(extra)
+    if not pares:
+        return ""
+    escapar = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{n}="{escapar(v)}"' for n, v in pares) + "}"
+
+def _formatear_valor(valor):
+    if valor == math.inf:
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = "untyped"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), funcion=None):
+        # funcion: callable sin argumentos que devuelve el valor (o {etiquetas: valor}) al exponer
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.funcion = funcion
+        self._lock = threading.Lock()
+        # Sin etiquetas la serie existe desde el inicio (en 0) y no solo tras la primera observación
+        self._valores = {} if self.etiquetas else {(): self._valor_inicial()}
+
+    def _valor_inicial(self):
+        return 0
+
+    def _clave(self, etiquetas):
+        return tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+
+    def _muestras(self):
+        if self.funcion is None:
+            with self._lock:
+                return list(self._valores.items())
+        valor = self.funcion()
+        if isinstance(valor, dict):
+            return [((k,) if not isinstance(k, tuple) else k, v) for k, v in valor.items()]
+        return [((), valor)]
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        for clave, valor in self._muestras():
+            lineas.append(f"{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_formatear_valor(valor)}")
+        return lineas
+
+
+class Contador(_Metrica):
+    """Valor que solo aumenta (peticiones, aciertos de caché, errores)."""
+
+    tipo = "counter"
+
+    def inc(self, valor=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+
+class Medidor(_Metrica):
+    """Valor que sube y baja (profundidad de cola, trabajos en curso)."""
+
+    tipo = "gauge"
+
+    def fijar(self, valor, **etiquetas):
+        with self._lock:
+            self._valores[self._clave(etiquetas)] = valor
+
+    def inc(self, valor=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def dec(self, valor=1, **etiquetas):
+        self.inc(-valor, **etiquetas)
+
+
+class Histograma(_Metrica):
+    """Distribución acumulada por buckets, con suma y cantidad de observaciones."""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(nombre, ayuda, etiquetas)
+
+    def _valor_inicial(self):
+        return [0] * len(self.buckets), 0.0
+
+    def observar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            conteos, suma = self._valores.get(clave, ([0] * len(self.buckets), 0.0))
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    conteos[i] += 1
+                    break
+            self._valores[clave] = (conteos, suma + valor)
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self._lock:
+            valores = [(clave, list(conteos), suma) for clave, (conteos, suma) in self._valores.items()]
+        for clave, conteos, suma in valores:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                etiquetas = _formatear_etiquetas(self.etiquetas, clave, [("le", _formatear_valor(limite))])
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {_formatear_valor(suma)}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {acumulado}")
+        return lineas
+
+
+class Registro:
+    """Conjunto de métricas de un proceso, expuesto en el formato de texto de Prometheus."""
+
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, clase, nombre, *args, **kwargs):
+        with self._lock:
+            if nombre not in self._metricas:
+                self._metricas[nombre] = clase(nombre, *args, **kwargs)
+            return self._metricas[nombre]
+
+    def contador(self, nombre, ayuda, etiquetas=(), funcion=None):
+        return self._registrar(Contador, nombre, ayuda, etiquetas, funcion)
+
+    def medidor(self, nombre, ayuda, etiquetas=(), funcion=None):
+        return self._registrar(Medidor, nombre, ayuda, etiquetas, funcion)
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        return self._registrar(Histograma, nombre, ayuda, etiquetas, buckets)
+
+    def exponer(self):
+        lineas = []
+        for metrica in list(self._metricas.values()):
+            try:
+                lineas.extend(metrica.exponer())
+            except Exception as e:
+                # Una métrica calculada que falla no debe romper el resto de la exposición
+                lineas.append(f"# ERROR {metrica.nombre}: {e}")
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRO = Registro()
+
+@contextmanager
+def medir(histograma, **etiquetas):
+    # Observa la duración del bloque en el histograma, aunque termine con una excepción
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        histograma.observar(time.perf_counter() - inicio, **etiquetas)
+
+
+class Traza:
+    """Tramos con tiempo de una petición (descarga, OCR, comparación, API, envío...).
+
+    Cada tramo se observa en el histograma de etapas; al finalizar, si la petición tardó más
+    que umbral_lento se imprime una línea JSON con el desglose para poder diagnosticarla.
+    """
+
+    def __init__(self, flujo, histograma_etapas, histograma_total=None, umbral_lento=None):
+        self.flujo = flujo
+        self.histograma_etapas = histograma_etapas
+        self.histograma_total = histograma_total
+        self.umbral_lento = umbral_lento
+        self.tramos = []
+        self.datos = {}
+        self._inicio = time.perf_counter()
+
+    @contextmanager
+    def tramo(self, etapa):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar(etapa, time.perf_counter() - inicio)
+
+    def registrar(self, etapa, segundos):
+        # Para tramos medidos en otro proceso (p. ej. dentro de un worker del pool)
+        self.tramos.append((etapa, segundos))
+        self.histograma_etapas.observar(segundos, flujo=self.flujo, etapa=etapa)
+
+    def finalizar(self, resultado="ok"):
+        total = time.perf_counter() - self._inicio
+        if self.histograma_total is not None:
+            self.histograma_total.observar(total, flujo=self.flujo, resultado=resultado)
+        if self.umbral_lento is not None and total >= self.umbral_lento:
+            print(json.dumps({
+                "evento": "peticion_lenta",
+                "flujo": self.flujo,
+                "resultado": resultado,
+                "total_ms": round(total * 1000, 1),
+                "tramos_ms": {etapa: round(s * 1000, 1) for etapa, s in self.tramos},
+                **self.datos,
+            }, ensure_ascii=False))
+        return total
+
+
+def iniciar_servidor_metricas(puerto, host="127.0.0.1", registro=REGISTRO):
+    # Servidor HTTP en un hilo daemon que responde GET /metrics; devuelve el servidor para cerrarlo
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            cuerpo = registro.exponer().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    return servidor
@@ -0,0 +1,110 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from image_utils import EMPAREJADOR, buscar_obra, imprimir_resultado
+from indice_utils import RESOLUCIONES_INDICE, PiramideIndices
+from recuperacion_utils import top_k_candidatos
+from text_utils import IDIOMA_RAPIDO, IDIOMAS_COMPLETOS, MOTOR_OCR, obtener_motor_ocr
+
+
+class ColaLlenaError(Exception):
+    """No quedan cupos en la cola del pool de procesamiento."""
+
+
+# Estado de cada proceso worker: el índice de referencias y el motor de OCR se cargan una sola vez al iniciar.
+# El índice se vuelve a cargar entre dos trabajos si el bot publica una generación nueva
+_indice_worker = None
+_config_indice = None
+_generacion_publicada = None  # multiprocessing.Value compartido con el bot (VigilanteGaleria.generacion)
+_generacion_cargada = None
+
+def _cargar_indice_worker():
+    global _indice_worker, _generacion_cargada
+    # La generación se lee antes de abrir los archivos: si cambia durante la carga se recarga en el próximo trabajo
+    generacion = _generacion_publicada.value if _generacion_publicada is not None else None
+    _indice_worker = PiramideIndices.cargar(*_config_indice)
+    _generacion_cargada = generacion
+
+def indice_actual():
+    if _generacion_publicada is not None and _generacion_publicada.value != _generacion_cargada:
+        _cargar_indice_worker()
+    return _indice_worker
+
+def inicializar_worker(ruta_indice, resoluciones=RESOLUCIONES_INDICE, motor_ocr=MOTOR_OCR, ruta_tessdata=None,
+                       emparejador=EMPAREJADOR, parametros_emparejador=None, generacion=None):
+    global _config_indice, _generacion_publicada
+    _config_indice = (ruta_indice, resoluciones, emparejador, parametros_emparejador)
+    _generacion_publicada = generacion
+    _cargar_indice_worker()
+    obtener_motor_ocr(motor_ocr, ruta_tessdata, precargar=(IDIOMA_RAPIDO, IDIOMAS_COMPLETOS))
+
+def comparar_en_worker(archivo_referencia, top_k=None, obras_por_candidato=0, **kwargs):
+    # Devuelve el ResultadoComparacion completo para que el bot registre inliers y tiempos. top_k es el
+    # mínimo de la lista corta y crece con las obras del índice vigente (ver top_k_candidatos)
+    indice = indice_actual()
+    if top_k:
+        top_k = top_k_candidatos(len(indice), top_k, obras_por_candidato)
+    resultado = buscar_obra(archivo_referencia, indice, top_k, **kwargs)
+    imprimir_resultado(resultado)
+    return resultado
+
+
+class PoolProcesamiento:
+    """Pool de procesos para las etapas de CPU (OCR, comparación, QR) con cola acotada y timeout por trabajo."""
+
+    def __init__(self, workers, max_cola, timeout, inicializador=None, initargs=()):
+        self.workers = workers
+        self.capacidad = workers + max_cola
+        self.timeout = timeout
+        self._inicializador = inicializador
+        self._initargs = initargs
+        self._lock = threading.Lock()
+        self._pendientes = 0
+        self._executor = self._crear_executor()
+
+    def _crear_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers, initializer=self._inicializador, initargs=self._initargs
+        )
+
+    @property
+    def pendientes(self):
+        return self._pendientes
+
+    def _liberar(self, _futuro):
+        with self._lock:
+            self._pendientes -= 1
+
+    async def ejecutar(self, funcion, *args, **kwargs):
+        # Lanza ColaLlenaError si no hay cupo y TimeoutError si el trabajo excede el timeout
+        with self._lock:
+            if self._pendientes >= self.capacidad:
+                raise ColaLlenaError()
+            self._pendientes += 1
+
+        try:
+            futuro = self._executor.submit(functools.partial(funcion, *args, **kwargs))
+        except BrokenProcessPool:
+            self._liberar(None)
+            self._executor = self._crear_executor()
+            raise
+        # El cupo se libera cuando el proceso termina realmente, no cuando se deja de esperar
+        futuro.add_done_callback(self._liberar)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(futuro), self.timeout)
+        except (TimeoutError, asyncio.TimeoutError) as e:
+            # Hasta Python 3.10 wait_for lanza asyncio.TimeoutError, que no es el nativo; los llamadores esperan
+            # siempre el TimeoutError nativo
+            futuro.cancel()
+            raise TimeoutError(f"El trabajo superó el timeout de {self.timeout} s") from e
+        except BrokenProcessPool:
+            # Un worker murió (p. ej. por memoria); se recrea el pool para los siguientes trabajos
+            self._executor = self._crear_executor()
+            raise
+
+    def cerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,18 +1,19 @@
 import numpy as np
 import cv2
-import os
 
-def decode_qr(img_path) -> tuple[str, bytes] | None:
+from image_utils import decodificar_imagen
+
+def decode_qr(imagen) -> tuple[str, bytes] | None:
+    # imagen: array BGR, bytes o ruta de la imagen
     try:
-        qr_img = cv2.imread(img_path)
-        if qr_img is None:
-            return None
+        qr_img = decodificar_imagen(imagen)
 
         qr_code = cv2.QRCodeDetector()
         decoded_info, points, _ = qr_code.detectAndDecode(qr_img)
 
         if points is not None and decoded_info:
-            # Dibujar contorno del QR
+            # Dibujar contorno del QR (sobre una copia, el array recibido puede ser del llamador)
+            qr_img = qr_img.copy()
             points = points[0].astype(int)
             cv2.polylines(qr_img, [points], isClosed=True, color=(0, 255, 0), thickness=3)
             
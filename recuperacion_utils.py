@@ -0,0 +1,243 @@
+import math
+
+import cv2
+import numpy as np
+
+# El vocabulario se dimensiona con la galería: ramas ** niveles ≈ descriptores / DESCRIPTORES_POR_PALABRA.
+# Así el largo medio de las listas invertidas, y con él el costo de puntuar una consulta, no crece con
+# la cantidad de obras
+DESCRIPTORES_POR_PALABRA = 20
+MIN_PALABRAS = 256
+# Con más ramas se agrega un nivel: cuantizar cuesta ramas * niveles distancias por descriptor
+MAX_RAMAS_VOCABULARIO = 128
+# Obras por cada puntuación (coseno y cobertura) cuyos tiles pasan a la verificación geométrica: como
+# mínimo TOP_K_CANDIDATOS y una más por cada OBRAS_POR_CANDIDATO obras del índice, porque con un top_k
+# fijo el recall de la lista corta cae a medida que crece la galería
+TOP_K_CANDIDATOS = 3
+OBRAS_POR_CANDIDATO = 30
+# Constante de la fusión de rankings (reciprocal rank fusion): 1 / (RANGO_FUSION + rango) por puntuación
+RANGO_FUSION = 10
+
+def top_k_candidatos(n_obras, minimo=TOP_K_CANDIDATOS, obras_por_candidato=OBRAS_POR_CANDIDATO):
+    # top_k de la lista corta para una galería de n_obras; obras_por_candidato=0 deja el mínimo fijo
+    if not obras_por_candidato:
+        return minimo
+    return max(minimo, math.ceil(n_obras / obras_por_candidato))
+
+def dimensionar_vocabulario(n_descriptores, ramas=None, niveles=None,
+                            descriptores_por_palabra=DESCRIPTORES_POR_PALABRA):
+    # Devuelve (ramas, niveles) con ramas ** niveles ≈ n_descriptores / descriptores_por_palabra;
+    # los valores indicados se respetan y solo se calculan los que faltan
+    palabras = max(n_descriptores / descriptores_por_palabra, MIN_PALABRAS)
+    if ramas and niveles:
+        return ramas, niveles
+    if ramas:
+        return ramas, max(1, round(math.log(palabras, ramas)))
+    if not niveles:
+        niveles = 2
+        while palabras ** (1 / niveles) > MAX_RAMAS_VOCABULARIO:
+            niveles += 1
+    return max(2, math.ceil(palabras ** (1 / niveles))), niveles
+
+def _mas_cercano(descriptores, centros):
+    _, indices = cv2.batchDistance(descriptores, centros, cv2.CV_32S, normType=cv2.NORM_HAMMING, K=1)
+    return indices[:, 0].astype(np.int64)
+
+def _agrupar(etiquetas):
+    # Devuelve (etiqueta, posiciones) por cada etiqueta presente
+    orden = np.argsort(etiquetas, kind="stable")
+    unicas, inicios = np.unique(etiquetas[orden], return_index=True)
+    return zip(unicas, np.split(orden, inicios[1:]))
+
+def _rangos(valores):
+    # Posición de cada valor en el orden ascendente (0 = el menor)
+    rangos = np.empty(len(valores), dtype=np.int64)
+    rangos[np.argsort(valores, kind="stable")] = np.arange(len(valores))
+    return rangos
+
+def k_majority(descriptores, k, iteraciones, rng):
+    # k-means binario: cada centro es el voto mayoritario bit a bit de su grupo (distancia Hamming)
+    if len(descriptores) <= k:
+        return descriptores[np.arange(k) % len(descriptores)].copy()
+    centros = descriptores[rng.choice(len(descriptores), k, replace=False)].copy()
+    bits = np.unpackbits(descriptores, axis=1)
+    for _ in range(iteraciones):
+        asignacion = _mas_cercano(descriptores, centros)
+        orden = np.argsort(asignacion, kind="stable")
+        grupos, inicios, conteos = np.unique(asignacion[orden], return_index=True, return_counts=True)
+        sumas = np.add.reduceat(bits[orden].astype(np.int32), inicios, axis=0)
+        centros[grupos] = np.packbits(2 * sumas > conteos[:, None], axis=1)
+        # Los centros sin descriptores asignados se re-siembran con muestras aleatorias
+        vacios = np.setdiff1d(np.arange(k), grupos)
+        if len(vacios):
+            centros[vacios] = descriptores[rng.choice(len(descriptores), len(vacios), replace=False)]
+    return centros
+
+
+class Vocabulario:
+    """Árbol de vocabulario binario: `ramas` hijos por nodo y `ramas ** niveles` palabras visuales."""
+
+    def __init__(self, centros, ramas):
+        # centros contiene los nodos de todos los niveles concatenados: ramas + ramas**2 + ...
+        self.centros = centros
+        self.ramas = ramas
+        self.niveles = 0
+        total, n_nivel = 0, ramas
+        while total < len(centros):
+            total += n_nivel
+            n_nivel *= ramas
+            self.niveles += 1
+        if total != len(centros):
+            raise ValueError("El número de centros no corresponde a un árbol completo")
+
+    @property
+    def n_palabras(self):
+        return self.ramas ** self.niveles
+
+    def cuantizar(self, descriptores):
+        # Desciende el árbol nivel a nivel; cada descriptor solo se compara con los hijos de su nodo
+        if descriptores is None or len(descriptores) == 0:
+            return np.empty(0, dtype=np.int32)
+        nodos = np.zeros(len(descriptores), dtype=np.int64)
+        inicio_nivel, n_padres = 0, 1
+        for _ in range(self.niveles):
+            centros_nivel = self.centros[inicio_nivel:inicio_nivel + n_padres * self.ramas]
+            nuevos = np.empty_like(nodos)
+            for padre, posiciones in _agrupar(nodos):
+                hijos = centros_nivel[padre * self.ramas:(padre + 1) * self.ramas]
+                nuevos[posiciones] = padre * self.ramas + _mas_cercano(descriptores[posiciones], hijos)
+            nodos = nuevos
+            inicio_nivel += n_padres * self.ramas
+            n_padres *= self.ramas
+        return nodos.astype(np.int32)
+
+    @classmethod
+    def entrenar(cls, descriptores, ramas=None, niveles=None, iteraciones=8, max_muestras=200000, semilla=0):
+        # ramas/niveles sin indicar se dimensionan según la cantidad de descriptores
+        ramas, niveles = dimensionar_vocabulario(len(descriptores), ramas, niveles)
+        rng = np.random.default_rng(semilla)
+        # Al menos unas muestras por palabra, para que las hojas no queden vacías en galerías grandes
+        max_muestras = max(max_muestras, 4 * ramas ** niveles)
+        muestra = descriptores
+        if len(muestra) > max_muestras:
+            muestra = muestra[rng.choice(len(muestra), max_muestras, replace=False)]
+
+        # Cada nivel divide en `ramas` grupos a los descriptores de cada nodo del nivel anterior
+        por_nivel = []
+        nodos = np.zeros(len(muestra), dtype=np.int64)
+        n_padres = 1
+        for _ in range(niveles):
+            centros_nivel = np.empty((n_padres * ramas, muestra.shape[1]), dtype=np.uint8)
+            nuevos = np.empty_like(nodos)
+            presentes = set()
+            for padre, posiciones in _agrupar(nodos):
+                hijos = k_majority(muestra[posiciones], ramas, iteraciones, rng)
+                centros_nivel[padre * ramas:(padre + 1) * ramas] = hijos
+                nuevos[posiciones] = padre * ramas + _mas_cercano(muestra[posiciones], hijos)
+                presentes.add(int(padre))
+            # Nodos sin muestras: sus hijos repiten el centro del padre para no dejar huecos
+            for padre in set(range(n_padres)) - presentes:
+                padre_centro = por_nivel[-1][padre] if por_nivel else muestra[0]
+                centros_nivel[padre * ramas:(padre + 1) * ramas] = padre_centro
+            por_nivel.append(centros_nivel)
+            nodos = nuevos
+            n_padres *= ramas
+        return cls(np.concatenate(por_nivel), ramas)
+
+
+class IndiceInvertido:
+    """Índice invertido tf-idf de palabras visuales a tiles de referencia."""
+
+    def __init__(self, vocabulario, palabras_por_tile, obra_por_tile):
+        # obra_por_tile: número de obra de cada tile, para armar la lista corta por obra
+        self.vocabulario = vocabulario
+        n_palabras = vocabulario.n_palabras
+        self.n_tiles = len(palabras_por_tile)
+        self.obras = np.asarray(obra_por_tile, dtype=np.int32).reshape(-1)
+
+        tiles, palabras, tf = [], [], []
+        for idx, palabras_tile in enumerate(palabras_por_tile):
+            unicas, conteos = np.unique(palabras_tile, return_counts=True)
+            tiles.append(np.full(len(unicas), idx, dtype=np.int32))
+            palabras.append(unicas)
+            tf.append(conteos.astype(np.float32))
+        tiles = np.concatenate(tiles) if tiles else np.empty(0, np.int32)
+        palabras = np.concatenate(palabras) if palabras else np.empty(0, np.int32)
+        tf = np.concatenate(tf) if tf else np.empty(0, np.float32)
+
+        df = np.bincount(palabras, minlength=n_palabras)
+        self.idf = np.log((self.n_tiles + 1) / (df + 1)).astype(np.float32)
+
+        # Pesos tf-idf normalizados (L2) por tile, y masa tf-idf total de cada tile para la cobertura
+        pesos = tf * self.idf[palabras]
+        normas = np.sqrt(np.bincount(tiles, weights=pesos ** 2, minlength=self.n_tiles))
+        self.masas = np.bincount(tiles, weights=pesos, minlength=self.n_tiles).astype(np.float32)
+        pesos = pesos / np.maximum(normas[tiles], 1e-12)
+
+        # Listas invertidas en formato CSR ordenadas por palabra
+        orden = np.argsort(palabras, kind="stable")
+        self.post_tiles = tiles[orden]
+        self.post_pesos = pesos[orden].astype(np.float32)
+        self.post_conteos = tf[orden]
+        self.inicios = np.concatenate(([0], np.cumsum(df))).astype(np.int64)
+
+    def arrays(self):
+        # Estado completo del índice, para guardarlo junto al índice de referencias
+        return {"idf": self.idf, "post_tiles": self.post_tiles, "post_pesos": self.post_pesos,
+                "post_conteos": self.post_conteos, "masas": self.masas, "inicios": self.inicios,
+                "obras": self.obras}
+
+    @classmethod
+    def desde_arrays(cls, vocabulario, arrays, n_tiles):
+        # Reconstruye el índice sin recalcularlo (los arrays pueden ser vistas de un archivo mapeado en memoria)
+        indice = cls.__new__(cls)
+        indice.vocabulario = vocabulario
+        indice.n_tiles = n_tiles
+        for nombre, array in arrays.items():
+            setattr(indice, nombre, array)
+        return indice
+
+    def puntuar(self, descriptores):
+        # Devuelve (coseno, cobertura) de la consulta contra todos los tiles, recorriendo solo las listas
+        # invertidas de sus palabras. El coseno tf-idf favorece a los tiles con tantas características como
+        # la foto; la cobertura (fracción de la masa tf-idf del tile presente en la consulta) no castiga a
+        # los tiles con pocas, como los de obras chicas ampliadas en la foto
+        palabras, conteos = np.unique(self.vocabulario.cuantizar(descriptores), return_counts=True)
+        pesos_q = conteos * self.idf[palabras]
+        pesos_q /= max(np.linalg.norm(pesos_q), 1e-12)
+
+        inicios = self.inicios[palabras]
+        longitudes = self.inicios[palabras + 1] - inicios
+        total = int(longitudes.sum())
+        if total == 0:
+            return np.zeros(self.n_tiles), np.zeros(self.n_tiles)
+        desplazamientos = np.repeat(inicios - np.cumsum(longitudes) + longitudes, longitudes)
+        posiciones = desplazamientos + np.arange(total)
+        tiles = self.post_tiles[posiciones]
+        coseno = np.bincount(tiles, weights=self.post_pesos[posiciones] * np.repeat(pesos_q, longitudes),
+                             minlength=self.n_tiles)
+        comunes = np.minimum(self.post_conteos[posiciones], np.repeat(conteos, longitudes))
+        cobertura = np.bincount(tiles, weights=comunes * np.repeat(self.idf[palabras], longitudes),
+                                minlength=self.n_tiles) / np.maximum(self.masas, 1e-12)
+        return coseno, cobertura
+
+    def _mejores_obras(self, puntuaciones, top_k):
+        # Máscara de las top_k obras según su mejor tile
+        por_obra = np.zeros(int(self.obras.max()) + 1, dtype=puntuaciones.dtype)
+        np.maximum.at(por_obra, self.obras, puntuaciones)
+        elegidas = np.zeros(len(por_obra), dtype=bool)
+        elegidas[np.argpartition(-por_obra, min(top_k, len(por_obra)) - 1)[:top_k]] = True
+        return elegidas
+
+    def candidatos(self, descriptores, top_k=TOP_K_CANDIDATOS):
+        # Todos los tiles de las top_k obras con mejor tile por coseno más los de las top_k por cobertura
+        # (hasta 2 * top_k obras), ordenados por fusión de los dos rankings. La lista corta es por obra y no
+        # por tile: una foto de un detalle puede puntuar mejor en un tile vecino de la obra correcta que en
+        # el que contiene el detalle, y ese tile igual se verifica
+        if self.n_tiles == 0 or top_k <= 0:
+            return np.empty(0, dtype=np.int64)
+        coseno, cobertura = self.puntuar(descriptores)
+        elegidas = self._mejores_obras(coseno, top_k) | self._mejores_obras(cobertura, top_k)
+        tiles = np.flatnonzero(elegidas[self.obras])
+        fusion = sum(1 / (RANGO_FUSION + _rangos(-p[tiles])) for p in (coseno, cobertura))
+        return tiles[np.argsort(-fusion, kind="stable")]
@@ -0,0 +1,62 @@
+import asyncio
+import datetime
+import time
+
+from telegram import Chat, Message, Update
+
+from webhook_utils import ProcesadorPorChat
+
+
+def actualizacion(update_id, chat_id):
+    chat = Chat(chat_id, Chat.PRIVATE)
+    mensaje = Message(update_id, datetime.datetime.now(datetime.timezone.utc), chat)
+    return Update(update_id, message=mensaje)
+
+
+async def procesar(procesador, actualizaciones):
+    # actualizaciones: [(update, segundos)]; devuelve chat_id -> [(update_id, instante de término)]
+    terminadas = {}
+    inicio = time.perf_counter()
+
+    async def trabajo(update, segundos):
+        await asyncio.sleep(segundos)
+        terminadas.setdefault(update.effective_chat.id, []).append(
+            (update.update_id, time.perf_counter() - inicio))
+
+    tareas = []
+    for update, segundos in actualizaciones:
+        tareas.append(asyncio.create_task(procesador.process_update(update, trabajo(update, segundos))))
+        await asyncio.sleep(0)
+    await asyncio.gather(*tareas)
+    return terminadas
+
+
+def test_chat_ocupado_no_demora_a_otro_chat():
+    # Con 4 cupos, seis actualizaciones lentas del chat 1 no deben dejar esperando al chat 2
+    procesador = ProcesadorPorChat(4)
+    actualizaciones = [(actualizacion(i, 1), 0.2) for i in range(6)] + [(actualizacion(99, 2), 0)]
+    terminadas = asyncio.run(procesar(procesador, actualizaciones))
+
+    assert terminadas[2][0][1] < 0.1
+    assert [update_id for update_id, _ in terminadas[1]] == list(range(6))
+    assert procesador.chats_activos == 0
+    assert procesador.current_concurrent_updates == 0
+
+
+def test_limite_global_entre_chats():
+    # Chats distintos se procesan en paralelo, pero nunca más que max_concurrent_updates a la vez
+    procesador = ProcesadorPorChat(2)
+    en_curso = maximo = 0
+
+    async def trabajo():
+        nonlocal en_curso, maximo
+        en_curso += 1
+        maximo = max(maximo, en_curso)
+        await asyncio.sleep(0.05)
+        en_curso -= 1
+
+    async def principal():
+        await asyncio.gather(*(procesador.process_update(actualizacion(i, i), trabajo()) for i in range(6)))
+
+    asyncio.run(principal())
+    assert maximo == 2
@@ -2,78 +2,263 @@ import cv2
 import numpy as np
 import pytesseract
 
-def preprocess_image(img: np.ndarray) -> np.ndarray:
-    # Convertir a escala de grises y aplicar eliminación de ruido no local
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    gray = cv2.fastNlMeansDenoising(gray, h=17, templateWindowSize=7)
-    
+from image_utils import decodificar_imagen, reducir_ancho
+
+# tesserocr es opcional: enlaza la API de C de Tesseract y mantiene los modelos cargados
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Primero se intenta con un solo idioma; si la confianza media es baja se repite con todos
+IDIOMA_RAPIDO = "spa"
+IDIOMAS_COMPLETOS = "spa+eng+equ"
+CONFIANZA_MINIMA = 60
+CONFIANZA_REINTENTO = 75
+# Ancho al que se busca texto (la detección no necesita la resolución completa)
+ANCHO_DETECCION = 800
+MAX_REGIONES = 8
+# Desviación estimada del ruido a partir de la cual se aplica fastNlMeansDenoising
+UMBRAL_RUIDO = 6.0
+# "auto" usa tesserocr si está instalado y si no pytesseract
+MOTOR_OCR = "auto"
+
+def detectar_regiones_texto(gris):
+    # Detector barato de zonas con texto: gradiente morfológico + cierre horizontal que une
+    # los caracteres de una línea. Devuelve [(x, y, w, h)] en coordenadas de la imagen recibida
+    reducida = reducir_ancho(gris, ANCHO_DETECCION)
+    escala = gris.shape[1] / reducida.shape[1]
+
+    gradiente = cv2.morphologyEx(reducida, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, binaria = cv2.threshold(gradiente, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    lineas = cv2.morphologyEx(binaria, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 3)))
+    # RETR_LIST para encontrar también las líneas dentro de una ficha o cartel con borde
+    contornos, _ = cv2.findContours(lineas, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+    alto_img = reducida.shape[0]
+    candidatas = []
+    for contorno in contornos:
+        x, y, w, h = cv2.boundingRect(contorno)
+        # Líneas de texto: más anchas que altas, de altura acotada y con trazos que llenan
+        # parte (no todo) del rectángulo
+        if h < 6 or h > alto_img * 0.15 or w < h * 1.5 or w < 20:
+            continue
+        recorte = binaria[y:y + h, x:x + w]
+        if not 0.3 < cv2.countNonZero(recorte) / (w * h) < 0.85:
+            continue
+        # La mayoría de los componentes deben tener tamaño de carácter; las texturas de una
+        # pintura producen muchos fragmentos pequeños
+        n, _, stats, _ = cv2.connectedComponentsWithStats(recorte)
+        caracteres = np.sum((stats[1:, cv2.CC_STAT_HEIGHT] >= 0.3 * h) & (stats[1:, cv2.CC_STAT_WIDTH] <= 1.5 * h))
+        if caracteres < max(3, 0.7 * (n - 1)):
+            continue
+        candidatas.append((x, y, w, h))
+
+    # Une las líneas cercanas en bloques (p. ej. la ficha de una obra)
+    mascara = np.zeros_like(reducida)
+    for x, y, w, h in candidatas:
+        cv2.rectangle(mascara, (x, y), (x + w, y + h), 255, -1)
+    mascara = cv2.dilate(mascara, cv2.getStructuringElement(cv2.MORPH_RECT, (31, 31)))
+    bloques, _ = cv2.findContours(mascara, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    regiones = sorted((cv2.boundingRect(b) for b in bloques), key=lambda r: r[2] * r[3], reverse=True)
+
+    # Margen alrededor de cada bloque para no cortar ascendentes ni descendentes
+    alto, ancho = gris.shape
+    resultado = []
+    for x, y, w, h in regiones[:MAX_REGIONES]:
+        x0, y0 = max(0, int((x - 6) * escala)), max(0, int((y - 6) * escala))
+        x1, y1 = min(ancho, int((x + w + 6) * escala)), min(alto, int((y + h + 6) * escala))
+        resultado.append((x0, y0, x1 - x0, y1 - y0))
+    return resultado
+
+def estimar_ruido(gris):
+    # Desviación estimada del ruido con el filtro de Immerkær; la mediana evita que los bordes
+    # de las letras cuenten como ruido (la respuesta al ruido gaussiano tiene desviación 6 sigma)
+    laplaciano = cv2.filter2D(gris.astype(np.float32), -1, np.float32([[1, -2, 1], [-2, 4, -2], [1, -2, 1]]))
+    return float(np.median(np.abs(laplaciano)) / (0.6745 * 6))
+
+def preprocess_image(gray: np.ndarray) -> np.ndarray:
+    # Eliminación de ruido no local solo si la imagen la necesita (es la etapa más costosa)
+    if estimar_ruido(gray) > UMBRAL_RUIDO:
+        gray = cv2.fastNlMeansDenoising(gray, h=17, templateWindowSize=7)
+
     # Mejorar contraste usando CLAHE (Limitación de Contraste Adaptativo)
     clahe = cv2.createCLAHE(clipLimit=1.8, tileGridSize=(8, 8))
     enhanced = clahe.apply(gray)
-    
+
     # Umbralización adaptativa combinada con método Gaussiano
     thresh = cv2.adaptiveThreshold(
         enhanced, 255,
         cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
         cv2.THRESH_BINARY_INV, 25, 12
     )
-    
+
     # Operaciones morfológicas para limpieza y unión de caracteres
     kernel_clean = np.ones((1, 1), np.uint8)  # Eliminar pequeños artefactos
     kernel_join = np.ones((2, 2), np.uint8)   # Conectar partes de caracteres
-    
+
     thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel_clean)
     thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel_join)
-    
+
     return thresh
 
-def procesar_texto_imagen(image_bytes: bytearray) -> tuple[str, bytes]:
-    # Decodificar imagen desde bytes a array numpy
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    if img is None:
-        raise ValueError("Error en decodificación de imagen")
+class MotorPytesseract:
+    """OCR con pytesseract: lanza el binario tesseract en cada llamada (sin dependencias extra)."""
 
-    # Redimensionamiento para optimizar procesamiento en imágenes grandes
-    h, w = img.shape[:2]
-    if w > 1600:
-        ratio = 1600 / w
-        img = cv2.resize(img, (1600, int(h * ratio)))
+    nombre = "pytesseract"
 
-    original_img = img.copy()  # Copia para visualización de resultados
-    thresh = preprocess_image(img)  # Aplicar preprocesamiento
+    def __init__(self, ruta_tessdata=None):
+        self.ruta_tessdata = ruta_tessdata
 
-    # Configuración Tesseract para múltiples idiomas y alta precisión
-    config = (
-        '--oem 3 --psm 1 '    # Motor 3 (LSTM), Modo Página segmentada
-        '-l spa+eng+equ '     # Idiomas: español, inglés y ecuaciones
-        '--dpi 300'           # Asumir alta resolución de imagen
-    )
-    
-    # Ejecutar OCR 
-    data = pytesseract.image_to_data(thresh, config=config, output_type=pytesseract.Output.DICT)
+    def reconocer(self, imagen, idiomas):
+        # Devuelve [(texto, confianza, (x, y, w, h), linea)] con una clave de línea comparable
+        config = (
+            '--oem 3 --psm 6 '    # Motor 3 (LSTM), bloque uniforme de texto
+            f'-l {idiomas} '
+            '--dpi 300'           # Asumir alta resolución de imagen
+        )
+        if self.ruta_tessdata:
+            # Entre comillas: pytesseract separa config con shlex y la ruta puede tener espacios
+            config += f' --tessdata-dir "{self.ruta_tessdata}"'
+        data = pytesseract.image_to_data(imagen, config=config, output_type=pytesseract.Output.DICT)
+        palabras = []
+        for i, texto in enumerate(data['text']):
+            if not texto.strip():
+                continue
+            caja = (data['left'][i], data['top'][i], data['width'][i], data['height'][i])
+            linea = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            palabras.append((texto.strip(), float(data['conf'][i]), caja, linea))
+        return palabras
 
+    def precargar(self, idiomas):
+        pass
+
+    def cerrar(self):
+        pass
+
+
+class MotorTesserocr:
+    """OCR con tesserocr: una instancia de la API por combinación de idiomas, creada una vez por proceso."""
+
+    nombre = "tesserocr"
+
+    def __init__(self, ruta_tessdata=None):
+        self.ruta_tessdata = ruta_tessdata
+        self._apis = {}
+
+    def _api(self, idiomas):
+        if idiomas not in self._apis:
+            argumentos = {"path": self.ruta_tessdata} if self.ruta_tessdata else {}
+            api = tesserocr.PyTessBaseAPI(
+                lang=idiomas, psm=tesserocr.PSM.SINGLE_BLOCK, oem=tesserocr.OEM.LSTM_ONLY, **argumentos
+            )
+            api.SetVariable("user_defined_dpi", "300")
+            self._apis[idiomas] = api
+        return self._apis[idiomas]
+
+    def reconocer(self, imagen, idiomas):
+        api = self._api(idiomas)
+        imagen = np.ascontiguousarray(imagen)
+        alto, ancho = imagen.shape
+        # El array se pasa directo a Tesseract, sin archivos temporales
+        api.SetImageBytes(imagen.tobytes(), ancho, alto, 1, ancho)
+        api.Recognize()
+        iterador = api.GetIterator()
+        palabras = []
+        if iterador is None:
+            return palabras
+        linea = -1
+        for palabra in tesserocr.iterate_level(iterador, tesserocr.RIL.WORD):
+            if palabra.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                linea += 1
+            texto = (palabra.GetUTF8Text(tesserocr.RIL.WORD) or "").strip()
+            caja = palabra.BoundingBox(tesserocr.RIL.WORD)
+            if not texto or caja is None:
+                continue
+            x1, y1, x2, y2 = caja
+            palabras.append((texto, palabra.Confidence(tesserocr.RIL.WORD), (x1, y1, x2 - x1, y2 - y1), linea))
+        return palabras
+
+    def precargar(self, idiomas):
+        # Carga los modelos de cada combinación de idiomas antes de la primera foto
+        for combinacion in idiomas:
+            self._api(combinacion)
+
+    def cerrar(self):
+        for api in self._apis.values():
+            api.End()
+        self._apis.clear()
+
+
+# Motor de OCR del proceso, se crea en la primera llamada (o al iniciar el worker) y se reutiliza
+_motor_ocr = None
+
+def obtener_motor_ocr(nombre=MOTOR_OCR, ruta_tessdata=None, precargar=()):
+    # precargar: combinaciones de idiomas a cargar de inmediato. En modo "auto", si tesserocr
+    # no puede cargar los modelos se usa pytesseract
+    global _motor_ocr
+    if _motor_ocr is None or (nombre != "auto" and _motor_ocr.nombre != nombre):
+        if nombre == "tesserocr" and tesserocr is None:
+            raise RuntimeError("MOTOR_OCR=tesserocr pero tesserocr no está instalado")
+        if nombre == "pytesseract" or tesserocr is None:
+            _motor_ocr = MotorPytesseract(ruta_tessdata)
+        else:
+            _motor_ocr = MotorTesserocr(ruta_tessdata)
+    try:
+        _motor_ocr.precargar(precargar)
+    except RuntimeError as e:
+        if nombre != "auto":
+            raise
+        print(f"No se pudo iniciar tesserocr, se usará pytesseract: {e}")
+        _motor_ocr = MotorPytesseract(ruta_tessdata)
+    return _motor_ocr
+
+def ocr_region(thresh, idiomas, motor):
+    palabras = motor.reconocer(thresh, idiomas)
+    confianzas = [confianza for _, confianza, _, _ in palabras if confianza >= 0]
+    return palabras, (sum(confianzas) / len(confianzas) if confianzas else 0.0)
+
+def procesar_texto_imagen(imagen, motor_ocr=MOTOR_OCR) -> tuple[str, bytes]:
+    # imagen: array BGR o bytes de la imagen.
+    # Devuelve el texto y la imagen con los recuadros en JPG (vacía si no se detectó texto)
+    # Redimensionamiento para optimizar procesamiento en imágenes grandes
+    img = reducir_ancho(decodificar_imagen(imagen), 1600)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    # Etapa 1: detección barata de regiones; sin regiones no se llama a Tesseract
+    regiones = detectar_regiones_texto(gray)
+    if not regiones:
+        return "", b""
+
+    motor = obtener_motor_ocr(motor_ocr)
+    original_img = img.copy()  # Copia para visualización de resultados
     lines = {}  # Almacenar texto agrupado por líneas
-    for i, text in enumerate(data['text']):
-        text = text.strip()
-        confianza = int(data['conf'][i])
-        
-        # Filtrar texto vacío o con baja confianza (<60)
-        if not text or confianza < 60:
-            continue
+    # Etapa 2: OCR solo sobre los recortes, de arriba hacia abajo
+    for region, (rx, ry, rw, rh) in enumerate(sorted(regiones, key=lambda r: (r[1], r[0]))):
+        thresh = preprocess_image(gray[ry:ry + rh, rx:rx + rw])
+        palabras, confianza_media = ocr_region(thresh, IDIOMA_RAPIDO, motor)
+        if confianza_media < CONFIANZA_REINTENTO:
+            palabras_completas, confianza_completa = ocr_region(thresh, IDIOMAS_COMPLETOS, motor)
+            if confianza_completa > confianza_media:
+                palabras = palabras_completas
+
+        for text, confianza, (x, y, w, h), linea in palabras:
+            # Filtrar texto con baja confianza
+            if confianza < CONFIANZA_MINIMA:
+                continue
 
-        # Agrupar palabras por número de línea detectada
-        line_num = data['line_num'][i]
-        lines.setdefault(line_num, []).append(text)
+            # Agrupar palabras por región y línea detectada
+            lines.setdefault((region, linea), []).append(text)
 
-        # Dibujar rectángulos en imagen original para visualización
-        x, y, w, h = data['left'][i], data['top'][i], data['width'][i], data['height'][i]
-        cv2.rectangle(original_img, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            # Dibujar rectángulos en imagen original para visualización
+            x, y = x + rx, y + ry
+            cv2.rectangle(original_img, (x, y), (x + w, y + h), (0, 255, 0), 2)
 
     # Construir texto final uniendo líneas detectadas
     extracted_text = "\n".join([" ".join(line) for line in lines.values()])
+    if not extracted_text.strip():
+        return "", b""
 
     # Codificar imagen modificada con rectángulos a formato JPG
     _, buffer = cv2.imencode(".jpg", original_img)
-    return extracted_text.strip(), buffer.tobytes()
\ No newline at end of file
+    return extracted_text.strip(), buffer.tobytes()
@@ -0,0 +1,119 @@
+import asyncio
+import hmac
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+
+class ProcesadorPorChat(BaseUpdateProcessor):
+    """Procesa actualizaciones en paralelo (hasta max_concurrent_updates) pero en orden dentro de cada chat.
+
+    Los mensajes de un mismo chat se atienden uno tras otro para que el estado del ConversationHandler
+    no se mezcle; los de chats distintos (un grupo de visitantes escaneando QR a la vez) no se esperan.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}      # chat_id -> asyncio.Lock
+        self._esperando = {}  # chat_id -> actualizaciones del chat en curso o en espera
+
+    @property
+    def chats_activos(self):
+        return len(self._locks)
+
+    @staticmethod
+    def _clave_chat(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        # Reemplaza al de BaseUpdateProcessor, que toma el cupo global antes de llamar a do_process_update:
+        # aquí se espera primero el turno del chat y recién después el cupo, así una actualización que
+        # espera a su chat no ocupa uno de los max_concurrent_updates cupos que necesitan los demás chats
+        clave = self._clave_chat(update)
+        if clave is None:
+            async with self._semaphore:
+                await self.do_process_update(update, coroutine)
+            return
+
+        lock = self._locks.setdefault(clave, asyncio.Lock())
+        self._esperando[clave] = self._esperando.get(clave, 0) + 1
+        try:
+            async with lock, self._semaphore:
+                await self.do_process_update(update, coroutine)
+        finally:
+            # El lock se descarta cuando el chat no tiene más actualizaciones pendientes
+            self._esperando[clave] -= 1
+            if not self._esperando[clave]:
+                del self._esperando[clave]
+                del self._locks[clave]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def crear_app_webhook(application: Application, ruta, secreto=None):
+    # Aplicación ASGI que recibe los POST de Telegram y encola las actualizaciones en la Application
+    async def recibir(request: Request):
+        if secreto and not hmac.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secreto
+        ):
+            return Response(status_code=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception:
+            return Response(status_code=400)
+        # Se responde enseguida; el procesamiento sigue en la Application
+        await application.update_queue.put(update)
+        return Response(status_code=200)
+
+    async def salud(_request: Request):
+        return PlainTextResponse("ok")
+
+    return Starlette(routes=[
+        Route(ruta, recibir, methods=["POST"]),
+        Route("/salud", salud, methods=["GET"]),
+    ])
+
+async def ejecutar_webhook(application: Application, url_publica, host, puerto, ruta,
+                           secreto=None, max_conexiones=40):
+    # Equivalente a run_polling con un servidor uvicorn propio: registra el webhook en Telegram,
+    # atiende hasta que uvicorn recibe SIGINT/SIGTERM y apaga la Application con sus hooks
+    servidor = uvicorn.Server(uvicorn.Config(
+        crear_app_webhook(application, ruta, secreto), host=host, port=puerto, log_level="warning"
+    ))
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(
+            url=url_publica.rstrip("/") + ruta, allowed_updates=Update.ALL_TYPES,
+            secret_token=secreto, max_connections=max_conexiones
+        )
+        await application.start()
+        print(f"Webhook escuchando en {host}:{puerto}{ruta}")
+        await servidor.serve()
+    finally:
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)